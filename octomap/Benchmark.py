@@ -0,0 +1,215 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+from Config import SENSOR_TH, STATE_FREE, STATE_OCCUPIED
+from Config import LOGGER, TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, TREE_BACKENDS, PRUNE_POLICIES
+from MapUtil import import_flying_data, get_scan_list, bresenham3D, compute_ray_keys, transform_measurements
+from OctoTree import OctoTree
+
+"""
+Benchmarks of the OctoTree, replaying the recorded flight in start_points.csv and end_points.csv.
+"""
+
+def build_tree(start_points, end_points, backend):
+    octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend)
+    for index in range(len(end_points)):
+        octotree.ray_casting(tuple(start_points[index]), tuple(end_points[index]))
+    return octotree
+
+def compare_backends():
+    """
+    Compare memory and ray casting throughput of the object-based and the array-based tree.
+
+    Returns:
+        a row for each backend --- list of dict
+    """
+    start_points, end_points = import_flying_data()
+    num_rays = min(len(start_points), len(end_points))
+    results = []
+    for backend in TREE_BACKENDS:
+        start_time = time.perf_counter()
+        build_tree(start_points, end_points, backend)
+        elapsed = time.perf_counter() - start_time
+
+        # tracing slows down the build, so memory is measured in a second run
+        tracemalloc.start()
+        octotree = build_tree(start_points, end_points, backend)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        row = {
+            'backend': backend,
+            'rays': num_rays,
+            'seconds': elapsed,
+            'rays_per_second': num_rays / elapsed,
+            'leaf_nodes': len(octotree.get_leaf_node_list()),
+            'memory_bytes': memory,
+        }
+        LOGGER.info("{backend}: {rays} rays in {seconds:.2f}s ({rays_per_second:.0f} rays/s), "
+                    "{leaf_nodes} leaf nodes, {memory_bytes} bytes".format(**row))
+        results.append(row)
+    return results
+
+def compare_scan_insertion():
+    """
+    Compare replaying the flight ray by ray with replaying it scan by scan.
+
+    Returns:
+        a row for each insertion mode --- list of dict
+    """
+    start_points, end_points = import_flying_data()
+    scan_list = get_scan_list(start_points, end_points)
+    results = []
+    for mode in ('ray', 'scan', 'scan_list'):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        start_time = time.perf_counter()
+        if mode == 'ray':
+            for start_point, scan_end_points in scan_list:
+                for end_point in scan_end_points:
+                    octotree.ray_casting(start_point, end_point)
+        elif mode == 'scan':
+            for start_point, scan_end_points in scan_list:
+                octotree.insert_scan(start_point, scan_end_points)
+        else:
+            octotree.insert_scan_list(scan_list)
+        elapsed = time.perf_counter() - start_time
+
+        row = {
+            'mode': mode,
+            'scans': len(scan_list),
+            'seconds': elapsed,
+            'scans_per_second': len(scan_list) / elapsed,
+            'leaf_nodes': len(octotree.get_leaf_node_list()),
+        }
+        LOGGER.info("{mode}: {scans} scans in {seconds:.2f}s ({scans_per_second:.0f} scans/s), "
+                    "{leaf_nodes} leaf nodes".format(**row))
+        results.append(row)
+    return results
+
+def compare_ray_traversal():
+    """
+    Compare the per-ray bresenham3D with the batched compute_ray_keys on all rays of the flight.
+
+    Returns:
+        a row for each traversal --- list of dict
+    """
+    start_points, end_points = import_flying_data()
+    num_rays = min(len(start_points), len(end_points))
+    start_points = start_points[:num_rays]
+    end_points = end_points[:num_rays]
+    octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+    results = []
+    for traversal in ('bresenham3D', 'compute_ray_keys'):
+        start_time = time.perf_counter()
+        if traversal == 'bresenham3D':
+            num_voxels = sum(len(bresenham3D(start_points[index], end_points[index])) for index in range(num_rays))
+        else:
+            keys, _ = compute_ray_keys(start_points, end_points, octotree.origin, TREE_RESOLUTION)
+            num_voxels = keys.shape[0]
+        elapsed = time.perf_counter() - start_time
+
+        row = {
+            'traversal': traversal,
+            'rays': num_rays,
+            'voxels': num_voxels,
+            'seconds': elapsed,
+            'rays_per_second': num_rays / elapsed,
+        }
+        LOGGER.info("{traversal}: {rays} rays, {voxels} voxels in {seconds:.3f}s ({rays_per_second:.0f} rays/s)".format(**row))
+        results.append(row)
+    return results
+
+def compare_prune_policies():
+    """
+    Compare the ingestion time of the pruning policies, the tree is pruned once at the end.
+
+    Returns:
+        a row for each policy --- list of dict
+    """
+    start_points, end_points = import_flying_data()
+    scan_list = get_scan_list(start_points, end_points)
+    results = []
+    for prune_policy in PRUNE_POLICIES:
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, prune_policy=prune_policy)
+        start_time = time.perf_counter()
+        octotree.insert_scan_list(scan_list)
+        elapsed = time.perf_counter() - start_time
+        octotree.prune()
+        statistics = octotree.get_statistics()
+
+        row = {
+            'prune_policy': prune_policy,
+            'scans': len(scan_list),
+            'seconds': elapsed,
+            'splits': statistics['num_splits'],
+            'prunes': statistics['num_prunes'],
+            'nodes': statistics['num_nodes'],
+        }
+        LOGGER.info("{prune_policy}: {scans} scans in {seconds:.2f}s, {splits} splits, {prunes} prunes, "
+                    "{nodes} nodes after pruning".format(**row))
+        results.append(row)
+    return results
+
+def get_square_flight(num_records: int, side: float = 120, wall: float = 100, height: float = 30):
+    """
+    Synthetic measurements of a flight along a square with a wall in front, the other beams see no obstacle.
+
+    Returns:
+        start points, attitudes and ranges, see transform_measurements --- Nx3, Nx3, Nx4: ndarray
+    """
+    t = np.arange(num_records) / num_records * 4
+    side_index, fraction = np.floor(t), t - np.floor(t)
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1], [-1, -1]]) * side / 2
+    xy = corners[side_index.astype(int)] + (corners[side_index.astype(int) + 1] - corners[side_index.astype(int)]) * fraction[:, np.newaxis]
+    start_points = np.trunc(np.column_stack([xy, np.full(num_records, height)]))
+    attitudes = np.zeros((num_records, 3))
+    ranges = np.full((num_records, 4), 10.0 * SENSOR_TH)
+    ranges[:, 0] = wall - start_points[:, 0]
+    return start_points, attitudes, ranges
+
+def compare_free_beams(num_records: int = 200, passes: int = 3, free_beam_range: float = 100):
+    """
+    Compare the known voxels after each pass of a synthetic flight without and with free-only beams beyond the sensor range.
+
+    Returns:
+        a row for each setting and pass --- list of dict
+    """
+    start_points, attitudes, ranges = get_square_flight(num_records)
+    results = []
+    for beam_range in (-1, free_beam_range):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        end_points, record_index, is_hit = transform_measurements(start_points, attitudes, ranges, beam_range)
+        for flight in range(1, passes + 1):
+            start_time = time.perf_counter()
+            octotree.insert_rays(start_points[record_index], end_points, record_index, is_hit=is_hit)
+            elapsed = time.perf_counter() - start_time
+            statistics = octotree.get_statistics()
+            arrays = octotree.to_arrays()
+            state = arrays['state']
+            # a pruned leaf at depth d covers 8^(max_depth - d) voxels
+            volume = 8 ** (TREE_MAX_DEPTH - arrays['depth'])
+            row = {
+                'free_beam_range': beam_range,
+                'pass': flight,
+                'rays': len(end_points) * flight,
+                'seconds': elapsed,
+                'free_voxels': int(volume[state == STATE_FREE].sum()),
+                'occupied_voxels': int(volume[state == STATE_OCCUPIED].sum()),
+                'leaf_nodes': statistics['num_leafs'],
+            }
+            LOGGER.info("free beam range {free_beam_range}, pass {pass}: {rays} rays, {free_voxels} free and "
+                        "{occupied_voxels} occupied voxels, {leaf_nodes} known leafs".format(**row))
+            results.append(row)
+    return results
+
+def main():
+    compare_backends()
+    compare_scan_insertion()
+    compare_ray_traversal()
+    compare_prune_policies()
+    compare_free_beams()
+
+if __name__ == "__main__":
+    main()
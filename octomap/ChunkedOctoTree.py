@@ -0,0 +1,643 @@
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from Config import HIT_LOGODDS, MISS_LOGODDS, DEFAULT_PROBABILITY, TREE_BACKEND, PRUNE_POLICY, INNER_OCCUPANCY
+from Config import TRACK_CHANGES, LOG_ODDS_STORAGE
+from Config import ROLLING_RADIUS, EVICTION_POLICY, EVICTION_POLICIES, EVICTION_DEPTH, SPILL_DIRECTORY
+from Config import MAX_RESIDENT_CHUNKS
+from OctoTree import OctoTree
+from TileStore import TileStore
+from MapUtil import cast_rays, export_known_voxel
+
+class ChunkedOctoTree:
+    """
+    Map without bounds made of a sparse hash of OctoTrees (chunks) of the same shape.
+    A chunk is keyed by its chunk coordinates and allocated when a voxel in it is observed for the first time,
+    so only observed regions cost memory and a lookup is a hash access plus the descent of one chunk.
+
+    Voxel keys are global: key = floor((point - origin) / resolution) without bounds, the chunk coordinates of a key
+    are its upper bits (key >> max_depth) and the key inside the chunk its lower max_depth bits.
+    The chunk (0, 0, 0) covers the same space as an OctoTree with the same center, resolution and max_depth.
+
+    As a rolling local map the chunks farther than rolling_radius from the drone (set_position) are evicted,
+    so the memory and the cost of a snapshot depend on the radius and not on the length of the flight.
+
+    With a TileStore the map is out-of-core: the chunks are tiles on disk and at most max_resident_chunks of them
+    are kept in memory. A chunk which is not in memory is loaded on its first access (get_probability, insert),
+    the least recently used chunk is written back if it changed and leaves memory.
+    Iterations, exports and statistics only cover the chunks in memory, flush writes all of them back.
+    """
+
+    def __init__(self, center: tuple, resolution: int, max_depth: int, backend: str = TREE_BACKEND,
+                 prune_policy: str = PRUNE_POLICY, inner_occupancy: str = INNER_OCCUPANCY,
+                 track_changes: bool = TRACK_CHANGES, log_odds_storage: str = LOG_ODDS_STORAGE,
+                 rolling_radius: float = ROLLING_RADIUS, eviction: str = EVICTION_POLICY,
+                 eviction_depth: int = EVICTION_DEPTH, spill_directory: str = SPILL_DIRECTORY,
+                 tile_store: TileStore = None, max_resident_chunks: int = MAX_RESIDENT_CHUNKS):
+        """
+        Create a new map without chunks.
+
+        Args:
+            center: the coordinate of the center of the chunk (0, 0, 0) --- (x,y,z): tuple
+            resolution: maximal resolution --- int
+            max_depth: depth of each chunk --- int
+            backend: storage engine of the chunks, 'object' or 'array' --- str
+            prune_policy: when children are pruned, 'eager', 'deferred' or 'off' --- str
+            inner_occupancy: logodds summary of the children kept by inner nodes, 'max' or 'mean' --- str
+            track_changes: whether voxels whose state changes are recorded, see pop_changes --- bool
+            log_odds_storage: type of the stored logodds, 'float' or the fixed-point 'int16'/'int8' --- str
+            rolling_radius: chunks farther than this from the drone are evicted, nothing is evicted if negative --- float
+            eviction: what happens to an evicted chunk, 'drop', 'coarsen' or 'spill' --- str
+            eviction_depth: depth of a coarsened chunk --- int
+            spill_directory: directory of the tiles of spilled chunks without a tile store --- str
+            tile_store: the tiles of the chunks, the map lives only in memory if None --- TileStore
+            max_resident_chunks: number of chunks kept in memory with a tile store, 0 keeps all --- int
+        """
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError("Unknown eviction policy '{}', expected one of {}".format(eviction, EVICTION_POLICIES))
+        self._center = center
+        self._resolution = resolution
+        self._max_depth = max_depth
+        self._chunk_options = {
+            'backend': backend,
+            'prune_policy': prune_policy,
+            'inner_occupancy': inner_occupancy,
+            'track_changes': track_changes,
+            'log_odds_storage': log_odds_storage,
+            # a ray of the chunked map is split across chunks, the chunks never see whole rays
+            'ray_cache_size': 0,
+        }
+        # the options are checked once by a chunk which is not kept
+        template = OctoTree(center, resolution, max_depth, **self._chunk_options)
+        self._origin: tuple = template.origin
+        self._chunk_width = template.width
+        self._key_mask = (1 << max_depth) - 1
+        self._statistic_names = list(template.get_statistics().keys())
+
+        # chunk coordinates (cx,cy,cz) -> OctoTree, least recently used first
+        self._chunks = OrderedDict()
+        self._track_changes = track_changes
+        self._change_callbacks = []
+        self._history = []
+
+        self._rolling_radius = rolling_radius
+        self._eviction = eviction
+        self._eviction_depth = eviction_depth
+        # chunk of the last position, the chunks are only checked for eviction when it changes
+        self._position_chunk = None
+        # chunk coordinates of the coarsened chunks which are still far away
+        self._coarse_chunks = set()
+        self._num_evicted = 0
+        # changes of evicted chunks which have not been popped yet
+        self._evicted_changes = []
+
+        if tile_store is None and eviction == 'spill':
+            tile_store = TileStore(spill_directory)
+        self._tile_store = tile_store
+        self._max_resident_chunks = max_resident_chunks
+        # chunk coordinates of the chunks in memory which differ from their tile
+        self._dirty_chunks = set()
+
+    @property
+    def origin(self):
+        """
+        Returns:
+            the coordinate of the global key (0, 0, 0) --- (x,y,z): tuple
+        """
+        return self._origin
+
+    @property
+    def chunk_width(self):
+        """
+        Returns:
+            the width of each chunk --- int
+        """
+        return self._chunk_width
+
+    def coord_to_key(self, point: tuple):
+        """
+        Convert a coordinate into the global key of the voxel containing it, every point has a key.
+
+        Args:
+            point: the coordinate to convert --- (x,y,z): tuple
+        Returns:
+            the global voxel key --- (kx,ky,kz): tuple
+        """
+        return (math.floor((point[0] - self._origin[0]) / self._resolution),
+                math.floor((point[1] - self._origin[1]) / self._resolution),
+                math.floor((point[2] - self._origin[2]) / self._resolution))
+
+    def key_to_coord(self, key: tuple):
+        """
+        Convert a global voxel key into the coordinate of the voxel origin.
+        """
+        return (self._origin[0] + key[0] * self._resolution,
+                self._origin[1] + key[1] * self._resolution,
+                self._origin[2] + key[2] * self._resolution)
+
+    def get_chunk(self, chunk_key: tuple, create: bool = False):
+        """
+        Return the chunk with the given chunk coordinates, a chunk with a tile is loaded from the tile store.
+
+        Args:
+            chunk_key: chunk coordinates --- (cx,cy,cz): tuple
+            create: whether a missing chunk is allocated --- bool
+        Returns:
+            the chunk, None if it has not been allocated --- OctoTree
+        """
+        chunk = self._chunks.get(chunk_key)
+        if chunk is not None:
+            self._chunks.move_to_end(chunk_key)
+            return chunk
+        if self._tile_store is not None and chunk_key in self._tile_store:
+            chunk = self._load_chunk(chunk_key)
+        elif create:
+            center = tuple(self._origin[i] + chunk_key[i] * self._chunk_width + self._chunk_width / 2 for i in range(3))
+            chunk = OctoTree(center, self._resolution, self._max_depth, **self._chunk_options)
+        else:
+            return None
+        self._chunks[chunk_key] = chunk
+        self._limit_resident()
+        return chunk
+
+    def get_chunk_keys(self):
+        """
+        Returns:
+            chunk coordinates of all chunks in memory --- list of (cx,cy,cz)
+        """
+        return list(self._chunks.keys())
+
+    @property
+    def num_chunks(self):
+        return len(self._chunks)
+
+    def _split_key(self, key: tuple):
+        """
+        Returns:
+            chunk coordinates and key inside the chunk of a global key --- (cx,cy,cz), (kx,ky,kz)
+        """
+        depth, mask = self._max_depth, self._key_mask
+        return (key[0] >> depth, key[1] >> depth, key[2] >> depth), (key[0] & mask, key[1] & mask, key[2] & mask)
+
+    def _update_key(self, key: tuple, diff_logodds: float):
+        """
+        Update the voxel of a global key, its chunk is allocated if needed.
+
+        Returns:
+            whether the map changed --- bool
+        """
+        chunk_key, local_key = self._split_key(key)
+        changed = self.get_chunk(chunk_key, create=True)._update_key(local_key, diff_logodds)
+        if changed:
+            self._dirty_chunks.add(chunk_key)
+        return changed
+
+    def insert_point(self, point: tuple, diff_logodds: float = HIT_LOGODDS):
+        """
+        Add an observation to the map, see OctoTree.insert_point.
+
+        Returns:
+            whether the map changed --- bool
+        """
+        if not len(point) == 3:
+            raise ValueError("Point should be tuple (x,y,z)")
+        return self._update_key(self.coord_to_key(point), diff_logodds)
+
+    def ray_casting(self, start_point: tuple, end_point: tuple, diff_logodds: float = MISS_LOGODDS):
+        """
+        Add a single ray to the map, see OctoTree.ray_casting.
+        """
+        if len(start_point) != 3 or len(end_point) != 3:
+            raise ValueError("Point should be tuple (x,y,z)")
+        if diff_logodds == MISS_LOGODDS:
+            self._insert_scans([start_point], [end_point], [0, 1], -1)
+            return
+        self.insert_point(end_point)
+        ray_keys, _, _, _ = cast_rays([start_point], [end_point], self._origin, self._resolution)
+        for key in map(tuple, ray_keys.tolist()):
+            self._update_key(key, diff_logodds)
+
+    def insert_scan(self, origin: tuple, end_points: list, max_range: float = -1):
+        """
+        Add all rays of one scan to the map, see OctoTree.insert_scan.
+        """
+        if len(origin) != 3:
+            raise ValueError("Point should be tuple (x,y,z)")
+        end_points = np.asarray(end_points, dtype=float).reshape(-1, 3)
+        start_points = np.broadcast_to(np.asarray(origin, dtype=float), end_points.shape)
+        self._insert_scans(start_points, end_points, [0, end_points.shape[0]], max_range)
+
+    def insert_scan_list(self, scan_list: list, max_range: float = -1):
+        """
+        Add a sequence of scans to the map, see OctoTree.insert_scan_list.
+        """
+        start_points = []
+        end_points = []
+        is_hit = []
+        scan_bounds = [0]
+        for scan in scan_list:
+            origin, scan_end_points = scan[0], scan[1]
+            start_points.extend([origin] * len(scan_end_points))
+            end_points.extend(scan_end_points)
+            is_hit.extend(scan[2] if len(scan) > 2 else [True] * len(scan_end_points))
+            scan_bounds.append(len(end_points))
+        self._insert_scans(start_points, end_points, scan_bounds, max_range, np.array(is_hit, dtype=bool))
+
+    def insert_rays(self, start_points: np.ndarray, end_points: np.ndarray, scan_index: np.ndarray,
+                    max_range: float = -1, is_hit: np.ndarray = None):
+        """
+        Add a batch of rays given as arrays, see OctoTree.insert_rays.
+        """
+        scan_index = np.asarray(scan_index)
+        changes = np.flatnonzero(scan_index[1:] != scan_index[:-1]) + 1
+        scan_bounds = [0] + changes.tolist() + [len(scan_index)] if len(scan_index) else [0]
+        self._insert_scans(start_points, end_points, scan_bounds, max_range, is_hit)
+
+    def _insert_scans(self, start_points, end_points, scan_bounds: list, max_range: float, is_hit: np.ndarray = None):
+        """
+        Traverse the rays of all scans in global keys in one batch, then hand the observed voxels of each scan
+        to their chunks. A scan is deduplicated as a whole before it is split, so every voxel is updated once.
+        """
+        ray_keys, offsets, end_keys, is_hit = cast_rays(start_points, end_points, self._origin, self._resolution,
+                                                        max_range, is_hit)
+        for first, last in zip(scan_bounds[:-1], scan_bounds[1:]):
+            occupied_keys = set(map(tuple, end_keys[first:last][is_hit[first:last]].tolist()))
+            free_keys = set(map(tuple, ray_keys[offsets[first]:offsets[last]].tolist()))
+            free_keys -= occupied_keys
+            updates = {}
+            for keys, index in ((free_keys, 0), (occupied_keys, 1)):
+                for key in keys:
+                    chunk_key, local_key = self._split_key(key)
+                    updates.setdefault(chunk_key, ([], []))[index].append(local_key)
+            for chunk_key, (chunk_free_keys, chunk_occupied_keys) in updates.items():
+                chunk = self.get_chunk(chunk_key, create=True)
+                if chunk._apply_update(chunk_free_keys, chunk_occupied_keys):
+                    self._dirty_chunks.add(chunk_key)
+                chunk._count_scan()
+
+    def get_probability(self, point: tuple, depth: int = None):
+        """
+        Return the occupancy probability of the voxel at a given point coordinate, see OctoTree.get_probability.
+        A point in a chunk which has not been allocated is unknown.
+        """
+        chunk_key, _ = self._split_key(self.coord_to_key(point))
+        chunk = self.get_chunk(chunk_key)
+        if chunk is None:
+            return DEFAULT_PROBABILITY
+        return chunk.get_probability(point, depth)
+
+    def any_occupied(self, bbox_min: tuple, bbox_max: tuple):
+        """
+        Return whether any occupied voxel intersects the box, only the chunks overlapping it are visited.
+        A chunk overlapping the box which is only in the tile store is loaded, see get_chunk.
+        """
+        return any(self.get_chunk(chunk_key).any_occupied(bbox_min, bbox_max)
+                   for chunk_key in self._box_chunks(bbox_min, bbox_max))
+
+    def iter_box(self, bbox_min: tuple, bbox_max: tuple, state: int = None):
+        """
+        Iterate over the known leafs intersecting a box in the chunks overlapping it, see OctoTree.iter_box.
+        The chunks only in the tile store are loaded one after the other and may be evicted again,
+        the nodes of an evicted chunk are not updated anymore.
+
+        Returns:
+            (global key, depth, node) for each leaf --- generator of ((kx,ky,kz), int, OctoNode)
+        """
+        for chunk_key in self._box_chunks(bbox_min, bbox_max):
+            base = [chunk_key[i] << self._max_depth for i in range(3)]
+            for key, depth, node in self.get_chunk(chunk_key).iter_box(bbox_min, bbox_max, state):
+                yield (base[0] + key[0], base[1] + key[1], base[2] + key[2]), depth, node
+
+    def query_box(self, bbox_min: tuple, bbox_max: tuple, state: int = None):
+        """
+        Collect the known leafs intersecting a box into columnar arrays with global keys, see OctoTree.query_box.
+        """
+        return self._concatenate({chunk_key: self.get_chunk(chunk_key).query_box(bbox_min, bbox_max, state)
+                                  for chunk_key in self._box_chunks(bbox_min, bbox_max)})
+
+    def iter_radius(self, center: tuple, radius: float, state: int = None):
+        """
+        Iterate over the known leafs intersecting a sphere in the chunks overlapping it, see OctoTree.iter_radius
+        and iter_box for the chunks in the tile store.
+
+        Returns:
+            (global key, depth, node) for each leaf --- generator of ((kx,ky,kz), int, OctoNode)
+        """
+        for chunk_key in self._radius_chunks(center, radius):
+            base = [chunk_key[i] << self._max_depth for i in range(3)]
+            for key, depth, node in self.get_chunk(chunk_key).iter_radius(center, radius, state):
+                yield (base[0] + key[0], base[1] + key[1], base[2] + key[2]), depth, node
+
+    def query_radius(self, center: tuple, radius: float, state: int = None):
+        """
+        Collect the known leafs intersecting a sphere into columnar arrays with global keys, see OctoTree.query_radius.
+        """
+        return self._concatenate({chunk_key: self.get_chunk(chunk_key).query_radius(center, radius, state)
+                                  for chunk_key in self._radius_chunks(center, radius)})
+
+    def _box_chunks(self, bbox_min: tuple, bbox_max: tuple):
+        """
+        Returns:
+            coordinates of the chunks overlapping a box, see _region_chunks --- list of (cx,cy,cz)
+        """
+        chunk_min, _ = self._split_key(self.coord_to_key(bbox_min))
+        chunk_max, _ = self._split_key(self.coord_to_key(bbox_max))
+        return self._region_chunks(lambda chunk_key: all(chunk_min[i] <= chunk_key[i] <= chunk_max[i] for i in range(3)))
+
+    def _radius_chunks(self, center: tuple, radius: float):
+        """
+        Returns:
+            coordinates of the chunks overlapping a sphere, see _region_chunks --- list of (cx,cy,cz)
+        """
+        return self._region_chunks(lambda chunk_key: self._chunk_distance(chunk_key, center) <= radius)
+
+    def _region_chunks(self, overlaps):
+        """
+        Coordinates of the chunks in memory and in the tile store for which overlaps(chunk_key) is true.
+        The chunks in memory come first, so a query loads tiles only after it is done with them.
+
+        Returns:
+            chunk coordinates --- list of (cx,cy,cz)
+        """
+        chunk_keys = [chunk_key for chunk_key in self._chunks if overlaps(chunk_key)]
+        if self._tile_store is not None:
+            chunk_keys.extend(chunk_key for chunk_key in self._tile_store.keys()
+                              if chunk_key not in self._chunks and overlaps(chunk_key))
+        return chunk_keys
+
+    def set_position(self, position: tuple):
+        """
+        Move the center of the rolling local map, e.g. to the position of the last measurement (see parse_log_data).
+        The chunks are checked for eviction whenever the position enters another chunk.
+
+        Args:
+            position: the coordinate of the drone --- (x,y,z): tuple
+        Returns:
+            number of evicted chunks --- int
+        """
+        if self._rolling_radius < 0:
+            return 0
+        chunk_key, _ = self._split_key(self.coord_to_key(position))
+        if chunk_key == self._position_chunk:
+            return 0
+        self._position_chunk = chunk_key
+        return self.evict(position)
+
+    def evict(self, position: tuple, radius: float = None):
+        """
+        Evict all chunks in memory whose space is farther than 'radius' from 'position' according to the eviction policy.
+        A coarsened chunk which comes back into the radius is refined again by new observations.
+
+        Args:
+            position: the coordinate of the drone --- (x,y,z): tuple
+            radius: the radius of the local map, rolling_radius if None --- float
+        Returns:
+            number of evicted chunks --- int
+        """
+        if radius is None:
+            radius = self._rolling_radius
+        num_evicted = 0
+        for chunk_key in list(self._chunks):
+            if self._chunk_distance(chunk_key, position) <= radius:
+                self._coarse_chunks.discard(chunk_key)
+                continue
+            if chunk_key in self._coarse_chunks:
+                continue
+            if self._eviction == 'coarsen':
+                self._chunks[chunk_key].coarsen(self._eviction_depth)
+                self._coarse_chunks.add(chunk_key)
+                self._dirty_chunks.add(chunk_key)
+            else:
+                self._evict_chunk(chunk_key, keep=self._eviction == 'spill')
+            num_evicted += 1
+        self._num_evicted += num_evicted
+        return num_evicted
+
+    def _chunk_distance(self, chunk_key: tuple, position: tuple):
+        """
+        Returns:
+            distance between a point and the closest point of a chunk --- float
+        """
+        distance = 0.0
+        for i in range(3):
+            low = self._origin[i] + chunk_key[i] * self._chunk_width
+            distance += max(low - position[i], 0, position[i] - low - self._chunk_width) ** 2
+        return math.sqrt(distance)
+
+    def _evict_chunk(self, chunk_key: tuple, keep: bool):
+        """
+        Remove a chunk from memory, its tracked changes are kept until the next pop_changes.
+
+        Args:
+            chunk_key: chunk coordinates --- (cx,cy,cz): tuple
+            keep: whether the chunk is written back to its tile, otherwise its tile is deleted --- bool
+        """
+        chunk = self._chunks.pop(chunk_key)
+        if self._track_changes:
+            self._evicted_changes.append(self._pop_chunk_changes(chunk_key, chunk))
+        if keep:
+            if chunk_key in self._dirty_chunks or chunk_key not in self._tile_store:
+                self._tile_store.write(chunk_key, chunk.to_bytes(log_odds=True))
+        elif self._tile_store is not None:
+            self._tile_store.delete(chunk_key)
+        self._dirty_chunks.discard(chunk_key)
+        self._coarse_chunks.discard(chunk_key)
+
+    def _limit_resident(self):
+        """
+        Write back and evict the least recently used chunks until at most max_resident_chunks are in memory.
+        """
+        if self._tile_store is None or self._max_resident_chunks <= 0:
+            return
+        while len(self._chunks) > self._max_resident_chunks:
+            self._evict_chunk(next(iter(self._chunks)), keep=True)
+
+    def _load_chunk(self, chunk_key: tuple):
+        """
+        Load a chunk from its tile, the tile stays in the store until the chunk is dropped.
+        """
+        options = {name: value for name, value in self._chunk_options.items()
+                   if name not in ('inner_occupancy', 'ray_cache_size')}
+        return OctoTree.from_bytes(self._tile_store.read(chunk_key), **options)
+
+    def flush(self):
+        """
+        Write all chunks in memory which differ from their tile to the tile store, they stay in memory.
+
+        Returns:
+            number of written tiles --- int
+        """
+        if self._tile_store is None:
+            return 0
+        num_written = 0
+        for chunk_key, chunk in self._chunks.items():
+            if chunk_key in self._dirty_chunks or chunk_key not in self._tile_store:
+                self._tile_store.write(chunk_key, chunk.to_bytes(log_odds=True))
+                num_written += 1
+        self._dirty_chunks.clear()
+        return num_written
+
+    def prune(self):
+        """
+        Prune all chunks, see OctoTree.prune.
+
+        Returns:
+            number of pruned nodes --- int
+        """
+        return sum(chunk.prune() for chunk in self._chunks.values())
+
+    def iter_leafs(self, max_depth: int = None, predicate=None):
+        """
+        Iterate over the known leafs of all chunks in memory, see OctoTree.iter_leafs.
+
+        Returns:
+            (global key, depth, node) for each leaf --- generator of ((kx,ky,kz), int, OctoNode)
+        """
+        for chunk_key, chunk in self._chunks.items():
+            base = [chunk_key[i] << self._max_depth for i in range(3)]
+            for key, depth, node in chunk.iter_leafs(max_depth, predicate):
+                yield (base[0] + key[0], base[1] + key[1], base[2] + key[2]), depth, node
+
+    def to_arrays(self, max_depth: int = None, predicate=None):
+        """
+        Collect the known leafs of all chunks in memory into columnar arrays with global keys, see OctoTree.to_arrays.
+        """
+        return self._concatenate({chunk_key: chunk.to_arrays(max_depth, predicate)
+                                  for chunk_key, chunk in self._chunks.items()})
+
+    def snapshot(self):
+        """
+        Copy the known leafs of all chunks in memory, see OctoTree.snapshot.
+        """
+        return self._concatenate({chunk_key: chunk.snapshot() for chunk_key, chunk in self._chunks.items()})
+
+    def _concatenate(self, chunk_arrays: dict):
+        """
+        Merge the arrays of the chunks, the keys inside the chunks become global keys.
+        """
+        keys, coords, depths, log_odds, states = [np.empty((0, 3), dtype=np.int64)], [np.empty((0, 3))], \
+            [np.empty(0, dtype=np.int64)], [np.empty(0)], [np.empty(0, dtype=np.int8)]
+        for chunk_key, arrays in chunk_arrays.items():
+            keys.append(arrays['keys'] + (np.array(chunk_key, dtype=np.int64) << self._max_depth))
+            coords.append(arrays['coords'])
+            depths.append(arrays['depth'])
+            log_odds.append(arrays['log_odds'])
+            states.append(arrays['state'])
+        return {
+            'keys': np.concatenate(keys),
+            'coords': np.concatenate(coords),
+            'depth': np.concatenate(depths),
+            'log_odds': np.concatenate(log_odds),
+            'state': np.concatenate(states).astype(np.int8),
+        }
+
+    def export_known_voxel(self, counter):
+        """
+        Export voxels whose logodds have been arrived at the threshold.
+        """
+        export_known_voxel(self.snapshot(), counter)
+
+    def is_tracking_changes(self):
+        return self._track_changes
+
+    def pop_changes(self):
+        """
+        Return the voxels of all chunks whose state changed since the last checkpoint, see OctoTree.pop_changes.
+        The changes of chunks evicted since then are included.
+        """
+        if not self._track_changes:
+            raise ValueError("Changes are not tracked by this tree.")
+        change_sets = self._evicted_changes
+        self._evicted_changes = []
+        change_sets.extend(self._pop_chunk_changes(chunk_key, chunk) for chunk_key, chunk in self._chunks.items())
+        return {
+            'keys': np.concatenate([np.empty((0, 3), dtype=np.int64)] + [changes['keys'] for changes in change_sets]),
+            'origins': np.concatenate([np.empty((0, 3))] + [changes['origins'] for changes in change_sets]),
+            'old_state': np.concatenate([np.empty(0, dtype=np.int64)] + [changes['old_state'] for changes in change_sets]),
+            'new_state': np.concatenate([np.empty(0, dtype=np.int64)] + [changes['new_state'] for changes in change_sets]),
+        }
+
+    def _pop_chunk_changes(self, chunk_key: tuple, chunk: OctoTree):
+        """
+        Returns:
+            the changes of a chunk with global keys, see OctoTree.pop_changes --- dict of ndarray
+        """
+        changes = chunk.pop_changes()
+        changes['keys'] = changes['keys'] + (np.array(chunk_key, dtype=np.int64) << self._max_depth)
+        return changes
+
+    def add_change_callback(self, callback):
+        """
+        Register a consumer of change sets, see OctoTree.add_change_callback.
+        """
+        self._change_callbacks.append(callback)
+
+    def publish_changes(self):
+        """
+        Pop the changes of all chunks and hand them to all registered callbacks.
+        """
+        changes = self.pop_changes()
+        for callback in self._change_callbacks:
+            callback(changes)
+        return changes
+
+    def get_statistics(self):
+        """
+        Return the node statistics summed over all chunks, see OctoTree.get_statistics.
+
+        Returns:
+            the statistics summed over the chunks in memory, the number of chunks in memory, coarsened and dirty
+            chunks, of all evictions and the statistics of the tile store --- dict
+        """
+        statistics = {name: 0 for name in self._statistic_names}
+        statistics['nodes_per_depth'] = [0] * (self._max_depth + 1)
+        statistics['num_chunks'] = len(self._chunks)
+        statistics['num_coarse_chunks'] = len(self._coarse_chunks)
+        statistics['num_dirty_chunks'] = len(self._dirty_chunks)
+        statistics['num_evicted'] = self._num_evicted
+        if self._tile_store is not None:
+            statistics.update(self._tile_store.get_statistics())
+        for chunk in self._chunks.values():
+            for name, value in chunk.get_statistics().items():
+                if name == 'nodes_per_depth':
+                    statistics[name] = [total + count for total, count in zip(statistics[name], value)]
+                else:
+                    statistics[name] += value
+        return statistics
+
+    def sample_statistics(self):
+        """
+        Append the current statistics with a timestamp to the time series of this map.
+
+        Returns:
+            the sampled statistics --- dict
+        """
+        snapshot = self.get_statistics()
+        snapshot['time'] = time.time()
+        self._history.append(snapshot)
+        return snapshot
+
+    def get_statistics_history(self):
+        """
+        Returns:
+            all statistics taken by sample_statistics, oldest first --- list of dict
+        """
+        return self._history
+
+    def get_center(self):
+        return self._center
+
+    def get_resolution(self):
+        return self._resolution
+
+    def get_max_depth(self):
+        return self._max_depth
+
+    def get_prune_policy(self):
+        return self._chunk_options['prune_policy']
+
+    def get_tile_store(self):
+        return self._tile_store
@@ -26,6 +26,15 @@ Initial probability value.
 DEFAULT_PROBABILITY=0.5
 DEFAULT_LOGODDS=0
 
+"""
+State of a voxel.
+A voxel is unknown before its first observation, free or occupied when its logodds arrive at a threshold and uncertain in between.
+"""
+STATE_UNKNOWN=0
+STATE_FREE=1
+STATE_OCCUPIED=2
+STATE_UNCERTAIN=3
+
 """
 Shape of the OctoTree, a cube with the same width, length and the height.
 TREE_RESOLUTION (cm): the size of each voxel.
@@ -38,6 +47,140 @@ TREE_MAX_DEPTH=6
 TREE_CENTER=(0, 0, 0)
 WIDTH=TREE_RESOLUTION * math.pow(2, TREE_MAX_DEPTH)
 
+"""
+Storage engine of the OctoTree.
+TREE_BACKEND: 'object' keeps one OctoNode object per voxel, 'array' keeps all nodes in the flat buffers of an OctoNodePool.
+POOL_INITIAL_CAPACITY: number of node slots preallocated by the array backend, the buffers double when they are full.
+"""
+TREE_BACKEND='object'
+TREE_BACKENDS=('object', 'array')
+POOL_INITIAL_CAPACITY=4096
+
+"""
+Fixed-point logodds of the array backend.
+LOG_ODDS_STORAGE: 'float' keeps float64 logodds, 'int16' and 'int8' keep integers in units of 1 / LOG_ODDS_SCALES[storage].
+The increments and the thresholds are then integers and the probability is taken from a lookup table,
+HIT_LOGODDS, MISS_LOGODDS, OCCUPANCY_LOGODDS and FREE_LOGODDS have to be multiples of the unit.
+"""
+LOG_ODDS_STORAGE='float'
+LOG_ODDS_STORAGES=('float', 'int16', 'int8')
+LOG_ODDS_SCALES={'int16': 10000, 'int8': 100}
+
+"""
+Map without bounds, see ChunkedOctoTree.
+TREE_CHUNKED: OctoMap maps into chunks with the shape of the tree above, allocated when they are observed first,
+instead of a single tree of WIDTH. The measurements are not clipped to the scene then.
+"""
+TREE_CHUNKED=False
+
+"""
+Rolling local map of the chunked map, see ChunkedOctoTree.set_position.
+ROLLING_RADIUS (cm): chunks farther than this from the drone are evicted, nothing is evicted if negative.
+EVICTION_POLICY: 'drop' forgets evicted chunks, 'coarsen' reduces them to EVICTION_DEPTH,
+'spill' writes them as tiles to a TileStore (SPILL_DIRECTORY without TILE_DIRECTORY) and loads them again
+when they are touched.
+"""
+ROLLING_RADIUS=-1
+EVICTION_POLICY='drop'
+EVICTION_POLICIES=('drop', 'coarsen', 'spill')
+EVICTION_DEPTH=3
+SPILL_DIRECTORY='chunks'
+
+"""
+Out-of-core chunked map, see TileStore.
+TILE_DIRECTORY: directory of the compressed tiles of the chunks, the map lives only in memory if None.
+MAX_RESIDENT_CHUNKS: with tiles at most this many chunks stay in memory, the least recently used chunk
+is written back if it changed and evicted; 0 keeps all chunks.
+TILE_COMPRESSION_LEVEL: zlib level of the tiles, 1 is fast and already shrinks the tree files several times.
+"""
+TILE_DIRECTORY=None
+MAX_RESIDENT_CHUNKS=64
+TILE_COMPRESSION_LEVEL=1
+
+"""
+Parallel construction of the map from a recorded flight, see ParallelBuilder.
+BUILD_WORKERS: number of worker processes of read_flying_data, 1 builds in the main process (no process pool),
+0 uses all cores. The parallel build is opt-in, it only pays off for long flights.
+PARTITION_DEPTH: the voxel updates are split into the 8^PARTITION_DEPTH nodes at this depth, every worker
+builds the subtrees of some of them.
+"""
+BUILD_WORKERS=1
+PARTITION_DEPTH=2
+
+"""
+Merging of maps, e.g. of several drones or sessions, see OctoTree.merge.
+MERGE_POLICY: 'sum' adds the logodds of a voxel known by both maps (clamped),
+'max_confidence' keeps the logodds farther from unknown (0).
+"""
+MERGE_POLICY='sum'
+MERGE_POLICIES=('sum', 'max_confidence')
+
+"""
+Pruning of the OctoTree, 8 children with the same clamped logodds are merged into their parent.
+PRUNE_POLICY: 'eager' checks the whole path after every update,
+'deferred' only marks the updated parents and prunes them bottom-up every PRUNE_INTERVAL scans and before export,
+'off' prunes only when OctoTree.prune() is called.
+"""
+PRUNE_POLICY='eager'
+PRUNE_POLICIES=('eager', 'deferred', 'off')
+PRUNE_INTERVAL=10
+
+"""
+Inner nodes summarize the logodds of their known children, queries at a coarse depth use this value.
+INNER_OCCUPANCY: 'max' keeps the maximum (a subtree without occupied leaf can be skipped at its root), 'mean' the mean.
+"""
+INNER_OCCUPANCY='max'
+INNER_OCCUPANCY_MODES=('max', 'mean')
+
+"""
+Change tracking.
+TRACK_CHANGES: whether a new OctoTree records the voxels whose state changed since the last checkpoint.
+EXPORT_DELTA: OctoMap exports only the changed voxels instead of all known voxels, this turns on change tracking.
+"""
+TRACK_CHANGES=False
+EXPORT_DELTA=False
+
+"""
+Repeated observations, e.g. while hovering.
+RAY_CACHE_SIZE: number of rays remembered (LRU) whose voxels were all clamped, a repetition of such a ray is skipped
+while no clamped voxel changed. 0 disables the cache.
+"""
+RAY_CACHE_SIZE=1024
+
+"""
+Export of the map.
+EXPORT_IN_BACKGROUND: OctoMap writes its exports on the thread of an ExportWorker, so the map updates keep their cadence.
+"""
+EXPORT_IN_BACKGROUND=True
+
+"""
+Ingestion of the log records, see IngestionPipeline.
+INGEST_QUEUE_SIZE: number of log records waiting for the mapper thread before the overflow policy applies.
+INGEST_OVERFLOW: 'block' makes the log callback wait (backpressure), 'drop_oldest' drops the oldest waiting record,
+'decimate' drops every second waiting record.
+INGEST_BATCH_SIZE: maximum number of log records inserted into the tree at once.
+"""
+INGEST_QUEUE_SIZE=50
+INGEST_OVERFLOW='block'
+INGEST_OVERFLOWS=('block', 'drop_oldest', 'decimate')
+INGEST_BATCH_SIZE=10
+
+"""
+Offline replay of recorded flights through a stand-in of the Crazyflie, see LogReplay.
+REPLAY_URI: link uri reported by the stand-in.
+REPLAY_RATES: replay speeds tried by find_max_rate as multiples of the recorded log rate, 0 replays as fast as possible.
+"""
+REPLAY_URI='replay://0'
+REPLAY_RATES=(10, 20, 50, 100, 200, 0)
+
+"""
+Binary tree files, see OctoTree.save and OctoTree.load.
+FILE_OCTOTREE: the map saved by read_flying_data, Tools loads it instead of replaying the flight.
+SAVE_LOG_ODDS: whether the logodds of all nodes are saved, otherwise only the free/occupied leafs (like OctoMap's .bt files).
+"""
+FILE_OCTOTREE='octotree.bt'
+SAVE_LOG_ODDS=True
+
 """
 Crazyflie and its laser sensor.
 """
@@ -45,6 +188,13 @@ URI='radio://0/60/2M/E7E7E7E70F'
 SENSOR_TH=400
 WHETHER_FLY=True
 
+"""
+Beams without an obstacle in sensor range (range >= SENSOR_TH).
+FREE_BEAM_RANGE (cm): such beams are inserted as rays of this length which only mark free space,
+they are dropped if negative.
+"""
+FREE_BEAM_RANGE=-1
+
 """
 Visualization.
 The coornidate under the OctoTree should be adjusted to the Matplotlib.
@@ -81,6 +231,21 @@ SIDE_WIDTH = 1.5
 FLIGHT_SPEED = 0.1
 SAVE_FLYING_DATA = True
 
+"""
+Binary flight log, see FlightLog.
+FILE_FLIGHT_LOG: the raw measurements of the last flight recorded by OctoMap when SAVE_FLYING_DATA is on,
+                 read_flying_data rebuilds the map from it.
+FLIGHT_LOG_RESUME: whether OctoMap appends to the log of the previous session (e.g. after a crash) instead of starting a new one.
+FLIGHT_LOG_CHUNK_SIZE: number of measurements buffered before they are written to the log.
+FLIGHT_LOG_FSYNC_INTERVAL (s): the log is synced to disk at most this often.
+FLIGHT_LOG_BLOCK_SIZE: number of measurements per block when a log is read.
+"""
+FILE_FLIGHT_LOG = 'flight_log.bin'
+FLIGHT_LOG_RESUME = False
+FLIGHT_LOG_CHUNK_SIZE = 10
+FLIGHT_LOG_FSYNC_INTERVAL = 1.0
+FLIGHT_LOG_BLOCK_SIZE = 4096
+
 """
 Global logger.
 """
@@ -0,0 +1,147 @@
+import threading
+import time
+from collections import deque
+
+from Config import LOGGER, EXPORT_IN_BACKGROUND
+
+class ExportWorker:
+    """
+    Runs exports on a background thread, so writing files never blocks the map updates.
+    The caller passes a snapshot of the data (e.g. OctoTree.snapshot) together with the export function.
+    A job submitted with a coalesce key replaces a pending job with the same key which has not started yet,
+    so a slow disk skips intermediate snapshots instead of building up a backlog.
+    """
+
+    def __init__(self, background: bool = EXPORT_IN_BACKGROUND):
+        """
+        Args:
+            background: whether the jobs run on a background thread, otherwise they run when submitted --- bool
+        """
+        self._background = background
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._running = False
+        self._closed = False
+        self._num_submitted = 0
+        self._num_exported = 0
+        self._num_coalesced = 0
+        self._num_failed = 0
+        self._last_latency = 0.0
+        self._max_latency = 0.0
+        self._total_latency = 0.0
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, name='ExportWorker', daemon=True)
+            self._thread.start()
+
+    def submit(self, export, *args, coalesce_key: str = None):
+        """
+        Queue an export.
+
+        Args:
+            export: the function writing the data --- callable
+            args: arguments of the function, they must not be changed by the caller afterwards --- tuple
+            coalesce_key: a pending job with the same key is replaced by this one --- str
+        """
+        job = [coalesce_key, export, args, time.perf_counter()]
+        with self._condition:
+            if self._closed:
+                raise ValueError("The export worker has been closed")
+            self._num_submitted += 1
+            if coalesce_key is not None:
+                for pending in self._jobs:
+                    if pending[0] == coalesce_key:
+                        # keep the submit time of the replaced job, its latency is the one of the coalesced export
+                        pending[1], pending[2] = export, args
+                        self._num_coalesced += 1
+                        return
+            self._jobs.append(job)
+            self._condition.notify()
+
+        if not self._background:
+            self._run_pending()
+
+    @property
+    def queue_depth(self):
+        """
+        Returns:
+            number of jobs waiting or running --- int
+        """
+        with self._condition:
+            return len(self._jobs) + (1 if self._running else 0)
+
+    def get_statistics(self):
+        """
+        Returns:
+            counters of the jobs and the latency from submit to the end of the export in seconds --- dict
+        """
+        with self._condition:
+            return {
+                'submitted': self._num_submitted,
+                'exported': self._num_exported,
+                'coalesced': self._num_coalesced,
+                'failed': self._num_failed,
+                'queue_depth': len(self._jobs) + (1 if self._running else 0),
+                'last_latency': self._last_latency,
+                'max_latency': self._max_latency,
+                'mean_latency': self._total_latency / self._num_exported if self._num_exported else 0.0,
+            }
+
+    def wait(self):
+        """
+        Block until all submitted jobs are done.
+        """
+        with self._condition:
+            while self._jobs or self._running:
+                self._condition.wait()
+
+    def close(self, wait: bool = True):
+        """
+        Stop the worker, pending jobs are still exported if 'wait' is set and dropped otherwise.
+        """
+        with self._condition:
+            self._closed = True
+            if not wait:
+                self._jobs.clear()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while self._run_pending():
+            pass
+
+    def _run_pending(self):
+        """
+        Run the next jobs until the queue is empty (inline) or the worker is closed (background).
+
+        Returns:
+            whether the worker is still open --- bool
+        """
+        while True:
+            with self._condition:
+                while self._background and not self._jobs and not self._closed:
+                    self._condition.wait()
+                if not self._jobs:
+                    return not self._closed
+                _, export, args, submit_time = self._jobs.popleft()
+                self._running = True
+
+            failed = False
+            try:
+                export(*args)
+            except Exception:
+                failed = True
+                LOGGER.exception("Export {} failed".format(getattr(export, '__name__', export)))
+
+            latency = time.perf_counter() - submit_time
+            with self._condition:
+                self._running = False
+                if failed:
+                    self._num_failed += 1
+                else:
+                    self._num_exported += 1
+                    self._last_latency = latency
+                    self._max_latency = max(self._max_latency, latency)
+                    self._total_latency += latency
+                self._condition.notify_all()
@@ -0,0 +1,260 @@
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from Config import LOGGER, SENSOR_TH, FLIGHT_LOG_CHUNK_SIZE, FLIGHT_LOG_FSYNC_INTERVAL, FLIGHT_LOG_BLOCK_SIZE
+from Config import FREE_BEAM_RANGE
+from MapUtil import get_scan_list, transform_measurements
+
+"""
+Append-only binary log of the raw measurements of a flight.
+
+header:  magic, version, size of a record
+records: one MEASUREMENT record per log callback, in the units of parse_log_data (cm and degrees)
+
+Records are only ever appended, so a crash loses at most the measurements which were not flushed yet;
+a record cut off at the end of the file is ignored by the reader.
+"""
+MAGIC = b'OCFL'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+MEASUREMENT = np.dtype([
+    ('timestamp', '<f8'),
+    ('x', '<f8'), ('y', '<f8'), ('z', '<f8'),
+    ('roll', '<f8'), ('pitch', '<f8'), ('yaw', '<f8'),
+    ('front', '<f8'), ('back', '<f8'), ('left', '<f8'), ('right', '<f8'),
+])
+BEAMS = ('front', 'back', 'left', 'right')
+
+class FlightLogWriter:
+    """
+    Appends measurements to a flight log.
+    Measurements are buffered and written in chunks, the file is synced to disk at most every fsync_interval seconds,
+    so a log callback never rewrites data which has already been written.
+    """
+
+    def __init__(self, path: str, chunk_size: int = FLIGHT_LOG_CHUNK_SIZE,
+                 fsync_interval: float = FLIGHT_LOG_FSYNC_INTERVAL, resume: bool = False):
+        """
+        Open a new log, an existing file is replaced unless the log is resumed.
+        A record cut off at the end of a resumed log is removed, so the appended records stay aligned.
+
+        Args:
+            path: file of the log --- str
+            chunk_size: number of measurements buffered before they are written --- int
+            fsync_interval: seconds between two syncs of the file --- float
+            resume: whether the measurements are appended to an existing log --- bool
+        """
+        self._path = path
+        self._chunk_size = max(chunk_size, 1)
+        self._fsync_interval = fsync_interval
+        self._buffer = np.zeros(self._chunk_size, dtype=MEASUREMENT)
+        self._buffered = 0
+        self._num_records = 0
+        self._last_timestamp = None
+
+        exists = resume and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, 'r+b') as file:
+                _read_header(file, path)
+                size = os.path.getsize(path)
+                num_whole = (size - HEADER.size) // MEASUREMENT.itemsize
+                if HEADER.size + num_whole * MEASUREMENT.itemsize < size:
+                    LOGGER.warning("Removed an incomplete measurement at the end of '{}'".format(path))
+                    file.truncate(HEADER.size + num_whole * MEASUREMENT.itemsize)
+                if num_whole:
+                    file.seek(HEADER.size + (num_whole - 1) * MEASUREMENT.itemsize)
+                    self._last_timestamp = float(np.frombuffer(file.read(MEASUREMENT.itemsize), dtype=MEASUREMENT)[0]['timestamp'])
+        self._file = open(path, 'ab' if exists else 'wb')
+        if not exists:
+            self._file.write(HEADER.pack(MAGIC, VERSION, MEASUREMENT.itemsize))
+        self._last_sync = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_records(self):
+        """
+        Returns:
+            number of measurements appended by this writer, including the buffered ones --- int
+        """
+        return self._num_records
+
+    @property
+    def last_timestamp(self):
+        """
+        Returns:
+            timestamp of the last measurement in the log, None if it is empty --- float
+        """
+        return self._last_timestamp
+
+    def append(self, timestamp: float, measurement: dict):
+        """
+        Append one measurement.
+
+        Args:
+            timestamp: time of the measurement --- float
+            measurement: position, attitude and ranges, see parse_log_data --- dict
+        """
+        record = self._buffer[self._buffered]
+        record['timestamp'] = timestamp
+        for name in MEASUREMENT.names[1:]:
+            record[name] = measurement[name]
+        self._buffered += 1
+        self._num_records += 1
+        self._last_timestamp = timestamp
+        if self._buffered == self._chunk_size:
+            self.flush()
+
+    def flush(self, sync: bool = False):
+        """
+        Write the buffered measurements, the file is synced when fsync_interval has passed or 'sync' is set.
+        """
+        if self._buffered:
+            self._file.write(self._buffer[:self._buffered].tobytes())
+            self._buffered = 0
+        self._file.flush()
+        now = time.monotonic()
+        if sync or now - self._last_sync >= self._fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def close(self):
+        """
+        Write and sync all buffered measurements and close the file.
+        """
+        if self._file.closed:
+            return
+        self.flush(sync=True)
+        self._file.close()
+
+def _read_header(file, path: str):
+    header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("'{}' is not a flight log, it is too short".format(path))
+    magic, version, record_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("'{}' is not a flight log".format(path))
+    if version != VERSION or record_size != MEASUREMENT.itemsize:
+        raise ValueError("Unsupported flight log version {} in '{}'".format(version, path))
+
+def read_flight_log(path: str, block_size: int = FLIGHT_LOG_BLOCK_SIZE):
+    """
+    Stream the measurements of a flight log.
+
+    Args:
+        path: file of the log --- str
+        block_size: number of measurements per block --- int
+    Returns:
+        blocks of at most 'block_size' measurements --- generator of ndarray of MEASUREMENT
+    """
+    with open(path, 'rb') as file:
+        _read_header(file, path)
+        while True:
+            data = file.read(block_size * MEASUREMENT.itemsize)
+            num_records = len(data) // MEASUREMENT.itemsize
+            if num_records:
+                yield np.frombuffer(data, dtype=MEASUREMENT, count=num_records)
+            if num_records < block_size:
+                if len(data) % MEASUREMENT.itemsize:
+                    LOGGER.warning("Ignored an incomplete measurement at the end of '{}'".format(path))
+                return
+
+def get_flight_log_measurements(path: str, block_size: int = FLIGHT_LOG_BLOCK_SIZE):
+    """
+    Stream the measurements of a flight log one by one.
+
+    Returns:
+        timestamp and measurement, see parse_log_data --- generator of (float, dict)
+    """
+    for block in read_flight_log(path, block_size):
+        for record in block.tolist():
+            measurement = dict(zip(MEASUREMENT.names, record))
+            yield measurement.pop('timestamp'), measurement
+
+def get_flight_log_scans(path: str, block_size: int = FLIGHT_LOG_BLOCK_SIZE, free_beam_range: float = FREE_BEAM_RANGE,
+                         clip: bool = True):
+    """
+    Replay a flight log as scans, the end points of each block are computed at once with transform_measurements.
+    The beams beyond the sensor range are handled like by the ingestion pipeline: they are dropped,
+    or with a positive free_beam_range they are kept as rays which only mark free space.
+
+    Args:
+        path: file of the log --- str
+        block_size: number of measurements per block --- int
+        free_beam_range: length of the free-only rays of beams beyond the sensor range, see transform_measurements --- float
+        clip: whether the end points are clipped to the scene, off for a map without bounds --- bool
+    Returns:
+        (start point, end points) for each measurement with at least one beam, with a positive free_beam_range
+        (start point, end points, whether each beam ends in an obstacle) --- generator of (tuple, list[, list])
+    """
+    for block in read_flight_log(path, block_size):
+        start_points = np.trunc(np.stack([block['x'], block['y'], block['z']], axis=1))
+        attitudes = np.stack([block['roll'], block['pitch'], block['yaw']], axis=1)
+        ranges = np.stack([block[name] for name in BEAMS], axis=1)
+        end_points, record_index, is_hit = transform_measurements(start_points, attitudes, ranges, free_beam_range, clip)
+        bounds = np.searchsorted(record_index, np.arange(len(block) + 1))
+        start_points = start_points.astype(int).tolist()
+        end_points = end_points.tolist()
+        is_hit = is_hit.tolist()
+        for index in range(len(block)):
+            first, last = bounds[index], bounds[index + 1]
+            if first == last:
+                continue
+            scan = (tuple(start_points[index]), [tuple(point) for point in end_points[first:last]])
+            yield scan + (is_hit[first:last],) if free_beam_range > 0 else scan
+
+def get_csv_measurements(start_points_file: str, end_points_file: str):
+    """
+    Recover measurements from the legacy start_points.csv and end_points.csv.
+    The CSV files only keep the rotated end points, so the conversion is lossy: each ray becomes the beam
+    along its dominant axis with the length of the ray and the attitude is 0.
+    Consecutive rays with the same start point are one measurement until a beam repeats.
+
+    Args:
+        start_points_file: csv file of the start points --- str
+        end_points_file: csv file of the end points --- str
+    Returns:
+        position, attitude and ranges, see parse_log_data --- generator of dict
+    """
+    start_points = pd.read_csv(start_points_file, index_col=0).values.tolist()
+    end_points = pd.read_csv(end_points_file, index_col=0).values.tolist()
+
+    for start_point, scan_end_points in get_scan_list(start_points, end_points):
+        measurement = None
+        for end_point in scan_end_points:
+            ray = np.subtract(end_point, start_point)
+            axis = int(np.argmax(np.abs(ray[:2])))
+            beam = BEAMS[2 * axis + (1 if ray[axis] < 0 else 0)]
+            if measurement is None or measurement[beam] < SENSOR_TH:
+                if measurement is not None:
+                    yield measurement
+                measurement = dict(zip(('x', 'y', 'z'), start_point), roll=0, pitch=0, yaw=0)
+                measurement.update((name, SENSOR_TH) for name in BEAMS)
+            measurement[beam] = float(np.linalg.norm(ray))
+        yield measurement
+
+def convert_flying_data(start_points_file: str, end_points_file: str, path: str, period: float = 100):
+    """
+    Convert the legacy start_points.csv and end_points.csv into a flight log, see get_csv_measurements.
+
+    Args:
+        start_points_file: csv file of the start points --- str
+        end_points_file: csv file of the end points --- str
+        path: file of the new log, an existing log is extended after its last measurement --- str
+        period: time between two measurements (ms) --- float
+    Returns:
+        number of written measurements --- int
+    """
+    with FlightLogWriter(path, resume=True) as writer:
+        start = 0.0 if writer.last_timestamp is None else writer.last_timestamp + period
+        for measurement in get_csv_measurements(start_points_file, end_points_file):
+            writer.append(start + writer.num_records * period, measurement)
+        return writer.num_records
@@ -0,0 +1,217 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+from Config import LOGGER, INGEST_QUEUE_SIZE, INGEST_OVERFLOW, INGEST_OVERFLOWS, INGEST_BATCH_SIZE, FREE_BEAM_RANGE
+from MapUtil import parse_log_data, get_measurement_arrays, transform_measurements
+
+STAGES = ('parse', 'transform', 'insert', 'batch')
+
+class IngestionPipeline:
+    """
+    Staged ingestion of Crazyflie log records into an OctoTree.
+    The log callback only enqueues the raw records (put), a mapper thread drains them in micro-batches:
+    parse (parse_log_data), transform (transform_measurements), insert (OctoTree.insert_rays) and the on_batch hook.
+    The queue is bounded, when it is full the overflow policy decides between backpressure and dropping records.
+    """
+
+    def __init__(self, octotree, queue_size: int = INGEST_QUEUE_SIZE, overflow: str = INGEST_OVERFLOW,
+                 batch_size: int = INGEST_BATCH_SIZE, on_batch=None, free_beam_range: float = FREE_BEAM_RANGE,
+                 clip: bool = True):
+        """
+        Args:
+            octotree: the map updated by the mapper thread --- OctoTree
+            queue_size: number of records waiting for the mapper before the overflow policy applies --- int
+            overflow: 'block' makes put wait, 'drop_oldest' drops the oldest waiting record,
+                      'decimate' drops every second waiting record --- str
+            batch_size: maximum number of records inserted at once --- int
+            on_batch: called by the mapper thread after each batch with the (timestamp, measurement) pairs --- callable
+            free_beam_range: length of the free-only rays of beams beyond the sensor range, see transform_measurements --- float
+            clip: whether the end points are clipped to the scene, off for a map without bounds --- bool
+        """
+        if overflow not in INGEST_OVERFLOWS:
+            raise ValueError("Unknown overflow policy '{}', expected one of {}".format(overflow, INGEST_OVERFLOWS))
+        self._octotree = octotree
+        self._queue_size = max(queue_size, 1)
+        self._overflow = overflow
+        self._batch_size = max(batch_size, 1)
+        self._on_batch = on_batch
+        self._free_beam_range = free_beam_range
+        self._clip = clip
+
+        # (time of put, timestamp, data)
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._busy = False
+
+        self._num_received = 0
+        self._num_processed = 0
+        self._num_dropped = 0
+        self._num_batches = 0
+        self._max_queue_depth = 0
+        self._blocked_time = 0.0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        # stage -> [total seconds, max seconds]
+        self._stage_time = {stage: [0.0, 0.0] for stage in STAGES}
+
+    def start(self):
+        """
+        Start the mapper thread, records put before are kept in the queue.
+        """
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='IngestionPipeline', daemon=True)
+        self._thread.start()
+
+    def put(self, timestamp, data, logconf=None):
+        """
+        Enqueue a log record, the signature matches the data callback of a cflib LogConfig.
+        After close, e.g. a log callback delivered after the disconnect, the record is dropped and counted.
+
+        Args:
+            timestamp: timestamp of the record --- int
+            data: the logged variables --- dict
+            logconf: the log configuration which received the record, unused --- LogConfig
+        """
+        with self._condition:
+            self._num_received += 1
+            if self._closed:
+                self._num_dropped += 1
+                return
+            if len(self._queue) >= self._queue_size:
+                self._make_room()
+                if self._closed:
+                    # closed while blocked, the mapper may already have stopped
+                    self._num_dropped += 1
+                    return
+            self._queue.append((time.perf_counter(), timestamp, data))
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._condition.notify_all()
+
+    def _make_room(self):
+        """
+        Apply the overflow policy to the full queue, the caller holds the lock.
+        """
+        if self._overflow == 'block':
+            start_time = time.perf_counter()
+            while len(self._queue) >= self._queue_size and not self._closed:
+                self._condition.wait()
+            self._blocked_time += time.perf_counter() - start_time
+        elif self._overflow == 'drop_oldest':
+            self._queue.popleft()
+            self._num_dropped += 1
+        else:
+            # keep the oldest record and every second one after it, the queue covers the same time at half the rate
+            kept = deque(itertools.islice(self._queue, 0, None, 2))
+            if len(kept) == len(self._queue):
+                kept.popleft()
+            self._num_dropped += len(self._queue) - len(kept)
+            self._queue = kept
+
+    @property
+    def queue_depth(self):
+        """
+        Returns:
+            number of records waiting for the mapper --- int
+        """
+        with self._condition:
+            return len(self._queue)
+
+    def get_statistics(self):
+        """
+        Returns:
+            record counters, queue depth and size, time spent blocked in put, the lag from put to the end of the insertion
+            and the mean and maximum time of each stage per batch in seconds --- dict
+        """
+        with self._condition:
+            statistics = {
+                'received': self._num_received,
+                'processed': self._num_processed,
+                'dropped': self._num_dropped,
+                'batches': self._num_batches,
+                'queue_depth': len(self._queue),
+                'queue_size': self._queue_size,
+                'max_queue_depth': self._max_queue_depth,
+                'blocked_time': self._blocked_time,
+                'last_lag': self._last_lag,
+                'max_lag': self._max_lag,
+            }
+            for stage, (total, maximum) in self._stage_time.items():
+                statistics[stage + '_mean'] = total / self._num_batches if self._num_batches else 0.0
+                statistics[stage + '_max'] = maximum
+            return statistics
+
+    def wait(self):
+        """
+        Block until all queued records have been inserted, the mapper thread must have been started.
+        """
+        with self._condition:
+            while self._queue or self._busy:
+                self._condition.wait()
+
+    def close(self, wait: bool = True):
+        """
+        Stop the mapper thread, queued records are still inserted if 'wait' is set and dropped otherwise.
+        """
+        with self._condition:
+            self._closed = True
+            if not wait:
+                self._num_dropped += len(self._queue)
+                self._queue.clear()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))]
+                self._busy = True
+                # there is room again for a blocked put
+                self._condition.notify_all()
+
+            try:
+                self._process(batch)
+            except Exception:
+                LOGGER.exception("Ingestion of {} log records failed".format(len(batch)))
+
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _process(self, batch: list):
+        """
+        Run all stages on a batch of queued records.
+        """
+        times = [time.perf_counter()]
+        parsed = [(timestamp, parse_log_data(data)) for _, timestamp, data in batch]
+        times.append(time.perf_counter())
+        start_points, attitudes, ranges = get_measurement_arrays([measurement for _, (measurement, _) in parsed])
+        end_points, record_index, is_hit = transform_measurements(start_points, attitudes, ranges, self._free_beam_range,
+                                                                  self._clip)
+        times.append(time.perf_counter())
+        self._octotree.insert_rays(start_points[record_index], end_points, record_index, is_hit=is_hit)
+        times.append(time.perf_counter())
+        if self._on_batch is not None:
+            self._on_batch([(timestamp, measurement) for timestamp, (measurement, _) in parsed])
+        times.append(time.perf_counter())
+
+        lag = times[3] - batch[0][0]
+        with self._condition:
+            self._num_processed += len(batch)
+            self._num_batches += 1
+            self._last_lag = lag
+            self._max_lag = max(self._max_lag, lag)
+            for index, stage in enumerate(STAGES):
+                elapsed = times[index + 1] - times[index]
+                self._stage_time[stage][0] += elapsed
+                self._stage_time[stage][1] = max(self._stage_time[stage][1], elapsed)
@@ -0,0 +1,257 @@
+import os
+import tempfile
+import threading
+import time
+
+from Config import LOGGER, REPLAY_URI, REPLAY_RATES
+from FlightLog import get_flight_log_measurements, get_csv_measurements
+
+"""
+Offline stand-in of a Crazyflie, it replays recorded log records through the same callbacks as cflib,
+so the mapping pipeline of OctoMap can be load tested without a radio.
+"""
+
+def to_log_data(measurement: dict):
+    """
+    Convert a measurement back into the logged variables, the inverse of parse_log_data.
+
+    Args:
+        measurement: position (cm), attitude (degree) and ranges (cm) --- dict
+    Returns:
+        the logged variables in the units of the Crazyflie (mm) --- dict
+    """
+    return {
+        'stateEstimateZ.x': measurement['x'] * 10,
+        'stateEstimateZ.y': measurement['y'] * 10,
+        'stateEstimateZ.z': measurement['z'] * 10,
+        'stabilizer.roll': measurement['roll'],
+        'stabilizer.pitch': measurement['pitch'],
+        'stabilizer.yaw': measurement['yaw'],
+        'range.front': measurement['front'] * 10,
+        'range.back': measurement['back'] * 10,
+        'range.left': measurement['left'] * 10,
+        'range.right': measurement['right'] * 10,
+    }
+
+def get_flight_log_records(path: str):
+    """
+    Returns:
+        (timestamp, logged variables) of each measurement of a flight log --- list of (int, dict)
+    """
+    return [(int(timestamp), to_log_data(measurement)) for timestamp, measurement in get_flight_log_measurements(path)]
+
+def get_csv_records(start_points_file: str = 'start_points.csv', end_points_file: str = 'end_points.csv',
+                    period_in_ms: float = 100):
+    """
+    Returns:
+        (timestamp, logged variables) of each measurement recovered from the legacy csv files,
+        see get_csv_measurements --- list of (int, dict)
+    """
+    return [(int(index * period_in_ms), to_log_data(measurement))
+            for index, measurement in enumerate(get_csv_measurements(start_points_file, end_points_file))]
+
+class Caller:
+    """
+    List of callbacks, like cflib.utils.callbacks.Caller.
+    """
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def call(self, *args):
+        for callback in self.callbacks:
+            callback(*args)
+
+class FakeLogSource:
+    """
+    Replays log records on its own thread like the log configuration of a Crazyflie,
+    the callbacks of data_received_cb get (timestamp, data, logconf).
+    """
+
+    def __init__(self, records: list, period_in_ms: float = 100, rate: float = 1):
+        """
+        Args:
+            records: (timestamp, data) of each log record --- list of (int, dict)
+            period_in_ms: time between two records of the recording --- float
+            rate: replay speed as a multiple of the recording, 0 replays as fast as possible --- float
+        """
+        self.name = 'FakeLogSource'
+        self.period_in_ms = period_in_ms
+        self.rate = rate
+        self.data_received_cb = Caller()
+        self._records = records
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start replaying the records.
+        """
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop replaying, the record being delivered is completed.
+        """
+        self._stop.set()
+        self.wait()
+
+    def wait(self):
+        """
+        Block until all records have been delivered or the source has been stopped.
+        """
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        period = self.period_in_ms / 1000 / self.rate if self.rate else 0
+        start_time = time.perf_counter()
+        for index, (timestamp, data) in enumerate(self._records):
+            if self._stop.is_set():
+                return
+            delay = start_time + index * period - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            self.data_received_cb.call(timestamp, data, self)
+
+class ReplayLogConfig(FakeLogSource):
+    """
+    Stand-in of cflib's LogConfig, the records are replayed once it has been added to a ReplayCrazyflie and started.
+    """
+
+    def __init__(self, name: str = 'Mapping', period_in_ms: float = 100):
+        super().__init__([], period_in_ms)
+        self.name = name
+        self.variables = []
+        self.cf = None
+
+    def add_variable(self, name: str, fetch_as=None):
+        self.variables.append(name)
+
+class ReplayLog:
+    """
+    Stand-in of the log subsystem (Crazyflie.log).
+    """
+
+    def __init__(self, cf):
+        self.cf = cf
+        self.log_blocks = []
+
+    def add_config(self, logconf: ReplayLogConfig):
+        logconf.cf = self.cf
+        logconf._records = self.cf.records
+        logconf.rate = self.cf.rate
+        self.log_blocks.append(logconf)
+
+class ReplayCrazyflie:
+    """
+    Stand-in of the part of cflib's Crazyflie used by OctoMap: the connection callbacks and the log subsystem.
+    """
+
+    def __init__(self, records: list, rate: float = 1):
+        """
+        Args:
+            records: (timestamp, data) of each log record --- list of (int, dict)
+            rate: replay speed as a multiple of the recording, 0 replays as fast as possible --- float
+        """
+        self.records = records
+        self.rate = rate
+        self.link_uri = None
+        self.connected = Caller()
+        self.disconnected = Caller()
+        self.log = ReplayLog(self)
+
+    def open_link(self, link_uri: str):
+        self.link_uri = link_uri
+        self.connected.call(link_uri)
+
+    def close_link(self):
+        for logconf in self.log.log_blocks:
+            logconf.stop()
+        self.disconnected.call(self.link_uri)
+
+    def wait(self):
+        """
+        Block until all started log configurations have delivered their records.
+        """
+        for logconf in self.log.log_blocks:
+            logconf.wait()
+
+def replay(records: list, rate: float = 1, octomap=None):
+    """
+    Feed recorded log records into OctoMap.update_map through a ReplayCrazyflie and measure the throughput.
+
+    Args:
+        records: (timestamp, data) of each log record --- list of (int, dict)
+        rate: replay speed as a multiple of the recording, 0 replays as fast as possible --- float
+        octomap: the map to feed, a new one without flight log if None --- OctoMap
+    Returns:
+        throughput, drops, queue depth and lag of the replay; kept_up is set when the mapper
+        never fell a full queue behind the log --- dict
+    """
+    # lazy import, the map pulls in the radio drivers of cflib
+    from OctoMap import OctoMap
+    if octomap is None:
+        octomap = OctoMap(save_flying_data=False)
+    cf = ReplayCrazyflie(records, rate)
+    octomap.cf = cf
+    cf.connected.add_callback(octomap.connected)
+    cf.disconnected.add_callback(octomap.disconnected)
+
+    octomap.pipeline.start()
+    start_time = time.perf_counter()
+    cf.open_link(REPLAY_URI)
+    octomap.start_logging(ReplayLogConfig())
+    cf.wait()
+    delivered = time.perf_counter() - start_time
+    # disconnecting drains the pipeline and the export worker
+    cf.close_link()
+    elapsed = time.perf_counter() - start_time
+
+    statistics = octomap.pipeline.get_statistics()
+    row = {
+        'rate': rate,
+        'records': len(records),
+        'seconds': elapsed,
+        'delivered_per_second': len(records) / delivered if delivered else 0.0,
+        'processed_per_second': statistics['processed'] / elapsed if elapsed else 0.0,
+        'dropped': statistics['dropped'],
+        'max_queue_depth': statistics['max_queue_depth'],
+        'max_lag': statistics['max_lag'],
+        'kept_up': statistics['dropped'] == 0 and statistics['max_queue_depth'] < statistics['queue_size'],
+    }
+    LOGGER.info("rate {rate}x: {records} records in {seconds:.2f}s, {processed_per_second:.0f} records/s processed, "
+                "{dropped} dropped, max queue depth {max_queue_depth}, max lag {max_lag:.3f}s, "
+                "kept up: {kept_up}".format(**row))
+    return row
+
+def find_max_rate(records: list, rates: tuple = REPLAY_RATES):
+    """
+    Replay the records at increasing rates, see replay.
+
+    Returns:
+        a row for each rate and the highest rate the mapper kept up with (0 if none) --- (list of dict, float)
+    """
+    rows = [replay(records, rate) for rate in rates]
+    max_rate = max((row['rate'] for row in rows if row['kept_up'] and row['rate']), default=0)
+    sustained = max(row['processed_per_second'] for row in rows)
+    LOGGER.info("The mapper keeps up with {}x the recorded rate, sustained throughput {:.0f} records/s".format(
+        max_rate, sustained))
+    return rows, max_rate
+
+def main():
+    records = get_csv_records()
+    # the map exports its csv files into the working directory, keep them out of the recorded data
+    os.chdir(tempfile.mkdtemp())
+    find_max_rate(records)
+
+if __name__ == "__main__":
+    main()
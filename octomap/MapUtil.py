@@ -1,11 +1,13 @@
 import math
+import os
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 from cflib.crazyflie.log import LogConfig
 
-from Config import SENSOR_TH, WIDTH, FREE_LOGODDS, LOGGER, OCCUPANCY_LOGODDS, TREE_RESOLUTION, FILE_OCCU_NODE_LIST, FILE_FREE_NODE_LIST, TREE_CENTER, TREE_MAX_DEPTH
+from Config import SENSOR_TH, FREE_BEAM_RANGE, WIDTH, LOGGER, STATE_FREE, STATE_OCCUPIED, TREE_RESOLUTION, FILE_OCCU_NODE_LIST, FILE_FREE_NODE_LIST, TREE_CENTER, TREE_MAX_DEPTH, FILE_OCTOTREE
+from Config import BUILD_WORKERS, OCCUPANCY_LOGODDS, FREE_LOGODDS, FILE_FLIGHT_LOG
 
 """
 OctoMap
@@ -77,6 +79,79 @@ def get_end_point(start_point: list, measurement: dict):
     end_points = rotate_and_create_points(measurement, start_point)
     return end_points
 
+# direction of the front, back, left and right beam in the body frame
+BEAM_DIRECTIONS = np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0]], dtype=float)
+
+def get_rotation_matrices(roll: np.ndarray, pitch: np.ndarray, yaw: np.ndarray):
+    """
+    The rotation of rot for many records, each matrix is computed once.
+
+    Args:
+        roll, pitch, yaw: the angles of each record (degree) --- N: ndarray
+    Returns:
+        rotation matrix of each record --- Nx3x3: ndarray
+    """
+    roll, pitch, yaw = (np.radians(np.asarray(angle, dtype=float)) for angle in (roll, pitch, yaw))
+    cosr, sinr = np.cos(roll), np.sin(roll)
+    cosp, sinp = np.cos(pitch), np.sin(pitch)
+    cosy, siny = np.cos(yaw), np.sin(yaw)
+    zeros, ones = np.zeros_like(roll), np.ones_like(roll)
+
+    roty = np.stack([cosy, -siny, zeros, siny, cosy, zeros, zeros, zeros, ones], axis=-1).reshape(-1, 3, 3)
+    rotp = np.stack([cosp, zeros, sinp, zeros, ones, zeros, -sinp, zeros, cosp], axis=-1).reshape(-1, 3, 3)
+    rotr = np.stack([ones, zeros, zeros, zeros, cosr, -sinr, zeros, sinr, cosr], axis=-1).reshape(-1, 3, 3)
+    return rotr @ rotp @ roty
+
+def get_measurement_arrays(measurements: list):
+    """
+    Stack measurements into the arrays used by transform_measurements.
+
+    Args:
+        measurements: position, attitude and ranges, see parse_log_data --- list of dict
+    Returns:
+        start points (the positions truncated like in parse_log_data), attitudes and ranges --- Nx3, Nx3, Nx4: ndarray
+    """
+    values = np.array([[measurement[name] for name in ('x', 'y', 'z', 'roll', 'pitch', 'yaw',
+                                                       'front', 'back', 'left', 'right')]
+                       for measurement in measurements], dtype=float).reshape(-1, 10)
+    return np.trunc(values[:, :3]), values[:, 3:6], values[:, 6:]
+
+def transform_measurements(start_points: np.ndarray, attitudes: np.ndarray, ranges: np.ndarray,
+                           free_beam_range: float = FREE_BEAM_RANGE, clip: bool = True):
+    """
+    Compute the end points of the beams of many records at once, the same points as get_end_point.
+    A beam with a range of SENSOR_TH or more did not hit anything, it is dropped unless free_beam_range is positive,
+    then it is kept with this length as a beam which only observed free space.
+
+    Args:
+        start_points: position of the sensor of each record --- Nx3: ndarray
+        attitudes: roll, pitch and yaw of each record as logged (degree) --- Nx3: ndarray
+        ranges: front, back, left and right range of each record --- Nx4: ndarray
+        free_beam_range: length of the beams beyond the sensor range, they are dropped if negative --- float
+        clip: whether the end points are clipped to the scene (WIDTH) like determine_threshold --- bool
+    Returns:
+        end points of the beams --- Mx3: ndarray
+        index of the record of each end point --- M: ndarray
+        whether each beam ends in an obstacle --- M: ndarray
+    """
+    start_points = np.asarray(start_points, dtype=float).reshape(-1, 3)
+    attitudes = np.asarray(attitudes, dtype=float).reshape(-1, 3)
+    ranges = np.asarray(ranges, dtype=float).reshape(-1, 4)
+    rotations = get_rotation_matrices(attitudes[:, 0], -attitudes[:, 1], attitudes[:, 2])
+
+    in_range = ranges < SENSOR_TH
+    if free_beam_range > 0:
+        ranges = np.where(in_range, ranges, free_beam_range)
+        record_index, beam_index = np.nonzero(np.ones_like(in_range))
+    else:
+        record_index, beam_index = np.nonzero(in_range)
+    beams = ranges[record_index, beam_index, np.newaxis] * BEAM_DIRECTIONS[beam_index]
+    rotated = np.matmul(rotations[record_index], beams[:, :, np.newaxis])[:, :, 0]
+    end_points = np.around(rotated + start_points[record_index], decimals=1)
+    if clip:
+        end_points = np.clip(end_points, -WIDTH / 2, WIDTH / 2)
+    return end_points, record_index, in_range[record_index, beam_index]
+
 def get_log_config():
     lmap = LogConfig(name='Mapping', period_in_ms=100)
     
@@ -179,12 +254,127 @@ def bresenham3D(startPoint, endPoint):
             path.append(point)
     return path
 
-def export_known_voxel(leaf_node_list,counter):
-    LOGGER.info("leaf_node_list: {}".format(len(leaf_node_list)))
-    threshold_node_list: list = get_threshold_node_list(leaf_node_list)
-    LOGGER.info("threshold_node_list: {}".format(len(threshold_node_list)))
-    occu_node_list, free_node_list = get_classified_node_list(threshold_node_list)
-    occu_node_coor_list, free_node_coor_list = get_classified_node_coor_list(occu_node_list, free_node_list)
+def compute_ray_keys(start_points, end_points, origin, resolution):
+    """
+    Return the keys of the voxels traversed by a batch of rays (Amanatides-Woo voxel traversal).
+    The voxel containing the start point is included, the voxel containing the end point is not.
+    Consecutive voxels of a ray always share a face, so no voxel is skipped on diagonal rays.
+
+    Every ray crosses a known number of voxel boundaries along each axis, the crossing parameters
+    t of all rays are generated at once and sorted per ray, the keys are the running sum of the steps.
+
+    Args:
+        start_points: start coordinates of the rays --- Nx3: ndarray
+        end_points: end coordinates of the rays --- Nx3: ndarray
+        origin: the coordinate of key (0, 0, 0) --- (x,y,z): tuple
+        resolution: the size of each voxel --- int
+
+    Returns:
+        keys of all rays concatenated, the keys of ray i are keys[offsets[i]:offsets[i + 1]] --- Mx3: ndarray, N+1: ndarray
+    """
+    start = (np.asarray(start_points, dtype=float).reshape(-1, 3) - origin) / resolution
+    end = (np.asarray(end_points, dtype=float).reshape(-1, 3) - origin) / resolution
+    start_key = np.floor(start).astype(np.int64)
+    end_key = np.floor(end).astype(np.int64)
+    num_rays = start_key.shape[0]
+
+    step = np.sign(end_key - start_key)
+    num_crossings = np.abs(end_key - start_key)
+    offsets = np.zeros(num_rays + 1, dtype=np.int64)
+    np.cumsum(num_crossings.sum(axis=1), out=offsets[1:])
+    if offsets[-1] == 0:
+        return np.empty((0, 3), dtype=np.int64), offsets
+
+    # t in [0, 1] at which each ray crosses its first boundary and the distance in t between two boundaries
+    direction = end - start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_delta = np.abs(1.0 / direction)
+        t_first = (np.where(step > 0, start_key + 1, start_key) - start) / direction
+
+    ray_ids, t, axes = [], [], []
+    for axis in range(3):
+        count = num_crossings[:, axis]
+        axis_ray_ids = np.repeat(np.arange(num_rays), count)
+        axis_offsets = np.cumsum(count) - count
+        crossing = np.arange(axis_ray_ids.shape[0]) - np.repeat(axis_offsets, count)
+        ray_ids.append(axis_ray_ids)
+        t.append(t_first[axis_ray_ids, axis] + crossing * t_delta[axis_ray_ids, axis])
+        axes.append(np.full(axis_ray_ids.shape[0], axis))
+    ray_ids = np.concatenate(ray_ids)
+    t = np.concatenate(t)
+    axes = np.concatenate(axes)
+
+    # simultaneous crossings are resolved one axis after the other
+    order = np.lexsort((axes, t, ray_ids))
+    ray_ids = ray_ids[order]
+    axes = axes[order]
+    steps = np.zeros((ray_ids.shape[0], 3), dtype=np.int64)
+    steps[np.arange(ray_ids.shape[0]), axes] = step[ray_ids, axes]
+
+    # the key before each crossing: start key plus the steps already taken by this ray
+    taken = np.cumsum(steps, axis=0) - steps
+    keys = start_key[ray_ids] + taken - taken[offsets[ray_ids]]
+    return keys, offsets
+
+def truncate_rays(start_points, end_points, max_range: float = -1, is_hit=None):
+    """
+    Truncate the rays longer than max_range, a truncated ray only marks free space.
+
+    Args:
+        start_points: the coordinates of the sensor --- Nx3: ndarray
+        end_points: the coordinates of the observation points --- Nx3: ndarray
+        max_range: rays longer than this are truncated, no limit if negative --- float
+        is_hit: whether each ray ends in an obstacle, all rays do if None --- N: ndarray
+    Returns:
+        the end points of the truncated rays and whether each of them ends in an obstacle --- Nx3: ndarray, N: ndarray
+    """
+    start_points = np.asarray(start_points, dtype=float).reshape(-1, 3)
+    end_points = np.asarray(end_points, dtype=float).reshape(-1, 3)
+    if is_hit is None:
+        is_hit = np.ones(end_points.shape[0], dtype=bool)
+    if max_range > 0:
+        vectors = end_points - start_points
+        distances = np.linalg.norm(vectors, axis=1)
+        in_range = distances <= max_range
+        is_hit = is_hit & in_range
+        scale = np.where(in_range, 1.0, max_range / np.maximum(distances, max_range))
+        end_points = start_points + vectors * scale[:, np.newaxis]
+    return end_points, is_hit
+
+def cast_rays(start_points, end_points, origin, resolution, max_range: float = -1, is_hit=None, traverse=None):
+    """
+    Traverse a batch of rays, see compute_ray_keys.
+
+    Args:
+        start_points: the coordinates of the sensor --- Nx3: ndarray
+        end_points: the coordinates of the observation points --- Nx3: ndarray
+        origin: the coordinate of key (0, 0, 0) --- (x,y,z): tuple
+        resolution: the size of each voxel --- int
+        max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+        is_hit: whether each ray ends in an obstacle, all rays do if None --- N: ndarray
+        traverse: which rays are traversed, the others get no voxels, all rays if None --- N: ndarray
+    Returns:
+        keys of the traversed voxels and the offsets of each ray in them, see compute_ray_keys --- Mx3: ndarray, N+1: ndarray
+        keys of the end points --- Nx3: ndarray
+        whether each ray ends in an obstacle --- N: ndarray
+    """
+    start_points = np.asarray(start_points, dtype=float).reshape(-1, 3)
+    end_points, is_hit = truncate_rays(start_points, end_points, max_range, is_hit)
+
+    if traverse is None:
+        ray_keys, offsets = compute_ray_keys(start_points, end_points, origin, resolution)
+    else:
+        ray_keys, traversed_offsets = compute_ray_keys(start_points[traverse], end_points[traverse],
+                                                       origin, resolution)
+        counts = np.zeros(end_points.shape[0], dtype=np.int64)
+        counts[traverse] = np.diff(traversed_offsets)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+    end_keys = np.floor((end_points - origin) / resolution).astype(np.int64)
+    return ray_keys, offsets, end_keys, is_hit
+
+def export_known_voxel(voxel_arrays, counter):
+    LOGGER.info("leaf_node_list: {}".format(len(voxel_arrays['keys'])))
+    occu_node_coor_list, free_node_coor_list = get_classified_node_coor_list(voxel_arrays)
     LOGGER.info("length of occu_node_coor_list: {}".format(len(occu_node_coor_list)))
     LOGGER.info("length of free_node_coor_list: {}".format(len(free_node_coor_list)))   
 
@@ -199,51 +389,44 @@ def export_known_voxel(leaf_node_list,counter):
     label_free = ('free_node_coor_list', date_value,len(free_node_coor_list))
     free_node_tempcsv = pd.DataFrame(columns=label_free, data=free_node_coor_list)
     free_node_tempcsv.to_csv('free_node_coor_list{}.csv'.format(counter), encoding='gbk')
-    
 
-def get_threshold_node_list(leaf_node_list):
+def export_changed_voxel(changes, counter):
     """
-    Store leaf nodes with deterministic probability
+    Output the voxels whose state changed since the last export to csv, see OctoTree.pop_changes
     """
-    threshold_node_list = []
-    for node in leaf_node_list:
-        if node.get_log_odds() == OCCUPANCY_LOGODDS or node.get_log_odds() == FREE_LOGODDS:
-            threshold_node_list.append(node)
-    return threshold_node_list
+    value = datetime.today()
+    date_value = datetime.strftime(value,'%H:%M:%S')
 
-def get_classified_node_list(threshold_node_list):
+    node_coor = (changes['origins'] / TREE_RESOLUTION).astype(int)
+    label_changed = ('changed_node_coor_list', date_value, len(node_coor))
+    changed_node_tempcsv = pd.DataFrame({
+        label_changed[0]: node_coor[:, 0],
+        label_changed[1]: node_coor[:, 1],
+        label_changed[2]: node_coor[:, 2],
+        'old_state': changes['old_state'],
+        'new_state': changes['new_state'],
+    })
+    changed_node_tempcsv.to_csv('changed_node_coor_list{}.csv'.format(counter), encoding='gbk')
+
+def export_tree_statistics(statistics_history, file_name='tree_statistics.csv'):
     """
-    Separate occupied and free points 
+    Output the sampled statistics of an OctoTree to csv, one row per sample
     """
-    occu_node_list: list = []
-    free_node_list: list = []
-
-    for node in threshold_node_list:
-        if node.get_log_odds() == OCCUPANCY_LOGODDS:
-            occu_node_list.append(node)
-        if node.get_log_odds() == FREE_LOGODDS:
-            free_node_list.append(node)
-    
-    return occu_node_list, free_node_list
-
-def get_classified_node_coor_list(occu_node_list, free_node_list):
+    rows = []
+    for statistics in statistics_history:
+        row = {key: value for key, value in statistics.items() if key != 'nodes_per_depth'}
+        for depth, num_nodes in enumerate(statistics['nodes_per_depth']):
+            row['nodes_depth_{}'.format(depth)] = num_nodes
+        rows.append(row)
+    pd.DataFrame(rows).to_csv(file_name, encoding='gbk')
+
+def get_classified_node_coor_list(voxel_arrays):
     """
-    Use list to store the corresponding coordinates 
-    """        
-    occu_node_coor_list = []
-    free_node_coor_list = []
-
-    for node in occu_node_list:
-        node_coor = (int(node.get_origin()[0] / TREE_RESOLUTION), 
-                    int(node.get_origin()[1] / TREE_RESOLUTION), 
-                    int(node.get_origin()[2] / TREE_RESOLUTION))
-        occu_node_coor_list.append(node_coor)
-    for node in free_node_list:
-        node_coor = (int(node.get_origin()[0] / TREE_RESOLUTION), 
-                    int(node.get_origin()[1] / TREE_RESOLUTION), 
-                    int(node.get_origin()[2] / TREE_RESOLUTION))
-        free_node_coor_list.append(node_coor)
-
+    Separate the coordinates of occupied and free voxels, see OctoTree.to_arrays
+    """
+    node_coor = (voxel_arrays['coords'] / TREE_RESOLUTION).astype(int)
+    occu_node_coor_list = node_coor[voxel_arrays['state'] == STATE_OCCUPIED]
+    free_node_coor_list = node_coor[voxel_arrays['state'] == STATE_FREE]
     return occu_node_coor_list, free_node_coor_list
 
 
@@ -265,6 +448,26 @@ def import_known_occu_node():
     occu_node_coor_list = occu_nodes.values.tolist()
     return occu_node_coor_list
 
+def import_checkpoint(counter, directory: str = '.'):
+    """
+    Rebuild the map of an export checkpoint (see export_known_voxel) from its csv files,
+    e.g. to compare two checkpoints with OctoTree.diff. Every listed voxel gets the clamped logodds of its state.
+
+    Args:
+        counter: counter of the checkpoint, as in occu_node_coor_list{counter}.csv --- float
+        directory: directory of the csv files --- str
+    Returns:
+        the map of the checkpoint --- OctoTree
+    """
+    # lazy import, OctoTree depends on this module
+    from OctoTree import OctoTree
+    octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+    for file_name, log_odds in (('occu_node_coor_list{}.csv', OCCUPANCY_LOGODDS), ('free_node_coor_list{}.csv', FREE_LOGODDS)):
+        node_coor = pd.read_csv(os.path.join(directory, file_name.format(counter)), index_col=0).values * TREE_RESOLUTION
+        for point in node_coor.tolist():
+            octotree.insert_point(tuple(point), log_odds)
+    return octotree
+
 def import_flying_data():
     start_points_list = []
     end_points_list = []
@@ -276,22 +479,58 @@ def import_flying_data():
     end_points_list= end_points.values.tolist()
     return start_points_list, end_points_list
 
-# lazy import
-from OctoTree import OctoTree
-def read_flying_data():
-    # start_time = time.time()
+def get_scan_list(start_points_list, end_points_list, scan_size=4):
+    """
+    Group consecutive rays with the same start point into scans.
+    A scan holds at most 'scan_size' rays, the number of beams of the Multi-ranger deck.
+
+    Returns:
+        (start point, end points) for each scan --- list of (tuple, list)
+    """
+    scan_list = []
+    for index in range(min(len(start_points_list), len(end_points_list))):
+        start_point = tuple(start_points_list[index])
+        end_point = tuple(end_points_list[index])
+        if scan_list and scan_list[-1][0] == start_point and len(scan_list[-1][1]) < scan_size:
+            scan_list[-1][1].append(end_point)
+        else:
+            scan_list.append((start_point, [end_point]))
+    return scan_list
+
+def get_flying_scan_list(flight_log: str = FILE_FLIGHT_LOG):
+    """
+    Scans of the recorded flight, read from the flight log if there is one (see FlightLog.get_flight_log_scans),
+    otherwise from the legacy start_points.csv and end_points.csv.
+
+    Returns:
+        (start point, end points) for each scan --- list of (tuple, list)
+    """
+    if os.path.exists(flight_log) and os.path.getsize(flight_log) > 0:
+        # lazy import, FlightLog depends on this module
+        from FlightLog import get_flight_log_scans
+        return list(get_flight_log_scans(flight_log))
     sheet_start_points,sheet_end_points = import_flying_data()
-    octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
-    for index in range(len(sheet_end_points)):
-        octotree.ray_casting(tuple(sheet_start_points[index]), tuple(sheet_end_points[index]))
-    leaf_node_list = octotree.get_leaf_node_list()
-    threshold_node_list: list = get_threshold_node_list(leaf_node_list)
-    occu_node_list, free_node_list = get_classified_node_list(threshold_node_list)
-    occu_node_coor_list, free_node_coor_list = get_classified_node_coor_list(occu_node_list, free_node_list)
+    return get_scan_list(sheet_start_points, sheet_end_points)
+
+def read_flying_data(num_workers: int = BUILD_WORKERS):
+    # lazy import, OctoTree depends on this module
+    from OctoTree import OctoTree
+    from ParallelBuilder import build_octotree, get_num_workers
+    # start_time = time.time()
+    scan_list = get_flying_scan_list()
+    if get_num_workers(num_workers) > 1:
+        octotree = build_octotree(scan_list, num_workers)
+    else:
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_scan_list(scan_list)
+        if octotree.get_prune_policy() == 'deferred':
+            octotree.prune()
+    octotree.save(FILE_OCTOTREE)
+    occu_node_coor_list, free_node_coor_list = get_classified_node_coor_list(octotree.to_arrays())
     # end_time = time.time()
     # print('Running time: %s s' % ((end_time - start_time)))
     export_flying_data(occu_node_coor_list, free_node_coor_list)
-    return occu_node_coor_list, free_node_coor_list
+    return occu_node_coor_list.tolist(), free_node_coor_list.tolist()
 
 def export_flying_data(occu_node_coor_list, free_node_coor_list):
     value = datetime.today()
@@ -1,28 +1,50 @@
-from datetime import datetime
 import math
 
 import cflib.crtp
 from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from cflib.positioning.position_hl_commander import PositionHlCommander
-import pandas as pd
 
 from Config import URI, LOGGER, TREE_CENTER, TREE_MAX_DEPTH, TREE_RESOLUTION, WHETHER_FLY, OBSTACLE_HEIGHT, TAKEOFF_HEIGHT
-from Config import SIDE_LENGTH, FLIGHT_SPEED, SAVE_FLYING_DATA,SIDE_WIDTH
+from Config import SIDE_LENGTH, FLIGHT_SPEED, SAVE_FLYING_DATA,SIDE_WIDTH, EXPORT_DELTA
+from Config import FILE_FLIGHT_LOG, FLIGHT_LOG_RESUME, TREE_CHUNKED, TILE_DIRECTORY
+from ChunkedOctoTree import ChunkedOctoTree
+from TileStore import TileStore
+from FlightLog import FlightLogWriter
 from OctoTree import OctoTree
-from MapUtil import get_log_config, parse_log_data, get_end_point
+from MapUtil import get_log_config, export_tree_statistics, export_changed_voxel
+from MapUtil import export_known_voxel
+from ExportWorker import ExportWorker
+from IngestionPipeline import IngestionPipeline
 
 
 class OctoMap:
-    def __init__(self):
-        self.octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+    def __init__(self, save_flying_data: bool = SAVE_FLYING_DATA, resume_flight_log: bool = FLIGHT_LOG_RESUME):
+        if TREE_CHUNKED:
+            tile_store = TileStore(TILE_DIRECTORY) if TILE_DIRECTORY is not None else None
+            self.octotree = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, track_changes=EXPORT_DELTA,
+                                            tile_store=tile_store)
+        else:
+            self.octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, track_changes=EXPORT_DELTA)
+        self.export_worker = ExportWorker()
+        self.pipeline = IngestionPipeline(self.octotree, on_batch=self.on_batch, clip=not TREE_CHUNKED)
+        if EXPORT_DELTA:
+            # deltas can not be coalesced, every set of changes is exported
+            self.octotree.add_change_callback(
+                lambda changes: self.export_worker.submit(export_changed_voxel, changes, self.counter / 100))
         self.counter = 0
-        self.start_points_data = []
-        self.end_points_data = []
-        LOGGER.info("OctoTree has been build, the coordinate range is from {} to {}".
-        format(-TREE_RESOLUTION * math.pow(2, TREE_MAX_DEPTH) / 2, TREE_RESOLUTION * math.pow(2, TREE_MAX_DEPTH) / 2))
+        # every session records a new flight unless it resumes the log of an interrupted one
+        self.flight_log = FlightLogWriter(FILE_FLIGHT_LOG, resume=resume_flight_log) if save_flying_data else None
+        # the writes and syncs of the flight log run on their own worker, a slow disk never delays the mapper
+        self.flight_log_worker = ExportWorker() if save_flying_data else None
+        if TREE_CHUNKED:
+            LOGGER.info("Chunked OctoTree has been build, each chunk has a width of {}".format(self.octotree.chunk_width))
+        else:
+            LOGGER.info("OctoTree has been build, the coordinate range is from {} to {}".
+            format(-TREE_RESOLUTION * math.pow(2, TREE_MAX_DEPTH) / 2, TREE_RESOLUTION * math.pow(2, TREE_MAX_DEPTH) / 2))
         
     def start(self):
+        self.pipeline.start()
         cflib.crtp.init_drivers()
         self.cf = Crazyflie(ro_cache=None, rw_cache='cache')
         
@@ -39,10 +61,7 @@ class OctoMap:
         LOGGER.info('We are now connected to {}'.format(URI))
         with SyncCrazyflie(URI, cf=self.cf) as scf:
             try:
-                lmap = get_log_config()
-                self.cf.log.add_config(lmap)
-                lmap.data_received_cb.add_callback(self.update_map)
-                lmap.start()
+                self.start_logging(get_log_config())
                 LOGGER.info("Log has been configured.")
             except KeyError as e:
                 LOGGER.error('Could not start log configuration,''{} not found in TOC'.format(str(e)))
@@ -76,42 +95,71 @@ class OctoMap:
                     print('done')
                     
 
+    def start_logging(self, lmap):
+        """
+        Feed the records of a log configuration into the map.
+
+        Args:
+            lmap: log configuration of the measurements, see get_log_config --- LogConfig
+        """
+        self.cf.log.add_config(lmap)
+        lmap.data_received_cb.add_callback(self.update_map)
+        lmap.start()
+
     def connected(self, URI):
         LOGGER.info('Connected with {}'.format(URI))
 
     def disconnected(self, URI):
         LOGGER.info('Disconnected with {}'.format(URI))
+        self.pipeline.close()
+        self.export_worker.close()
+        if TREE_CHUNKED:
+            self.octotree.flush()
+        if self.flight_log is not None:
+            self.flight_log_worker.close()
+            self.flight_log.close()
 
-    def export_flying_data(self,start_points,end_points):
-        value = datetime.today()
-        date_value = datetime.strftime(value,'%H:%M:%S')
+    def update_map(self, timestamp, data, logconf):
+        # the log callback only enqueues the record, the mapper thread of the pipeline inserts it
+        self.pipeline.put(timestamp, data, logconf)
 
-        label_start_points = ('start_points', date_value,len(start_points))
-        start_points_tempcsv = pd.DataFrame(columns=label_start_points, data=start_points)
-        start_points_tempcsv.to_csv('start_points.csv', encoding='gbk')
+    def append_flight_log(self, records):
+        """
+        Append a batch of log records to the flight log, runs on the flight log worker.
 
-        label_end_points = ('end_points', date_value,len(end_points))
-        end_points_tempcsv = pd.DataFrame(columns=label_end_points, data=end_points)
-        end_points_tempcsv.to_csv('end_points.csv', encoding='gbk')
-       
-    def update_map(self, timestamp, data, logconf):
-        # start_time = time.time()
-        measurement, start_point = parse_log_data(data)
-        for i in range(4):
-            self.start_points_data.append(tuple(start_point))
-        end_points = get_end_point(start_point, measurement)
-        self.end_points_data.extend(end_points)
-        if SAVE_FLYING_DATA:
-            self.export_flying_data(self.start_points_data,self.end_points_data)
-        for end_point in end_points:
-            self.octotree.ray_casting(tuple(start_point), tuple(end_point))
+        Args:
+            records: (timestamp, measurement) of each inserted log record --- list of (int, dict)
+        """
+        for timestamp, measurement in records:
+            self.flight_log.append(timestamp, measurement)
 
-        # export nodes each 100 times ranging
-        self.counter += 1
-        # TODO: new a thread to export
-        if self.counter % 100 == 0:
-            self.octotree.export_known_voxel(self.counter / 100)
-        
-        # end_time = time.time()
-        # print('Running time: %s s' % ((end_time - start_time)))
-    
+    def on_batch(self, records):
+        """
+        Called by the mapper thread after a batch of log records has been inserted.
+
+        Args:
+            records: (timestamp, measurement) of each inserted log record --- list of (int, dict)
+        """
+        if TREE_CHUNKED and records:
+            # the rolling local map follows the drone
+            measurement = records[-1][1]
+            self.octotree.set_position((measurement['x'], measurement['y'], measurement['z']))
+        if self.flight_log is not None and records:
+            # the batches are appended in order, they are never coalesced
+            self.flight_log_worker.submit(self.append_flight_log, records)
+        for timestamp, measurement in records:
+            # export nodes each 100 times ranging, the files are written by the export worker
+            self.counter += 1
+            if self.counter % 100 == 0:
+                if EXPORT_DELTA:
+                    self.octotree.publish_changes()
+                else:
+                    self.export_worker.submit(export_known_voxel, self.octotree.snapshot(), self.counter / 100,
+                                              coalesce_key='known_voxel')
+                self.octotree.sample_statistics()
+                self.export_worker.submit(export_tree_statistics, list(self.octotree.get_statistics_history()),
+                                          coalesce_key='statistics')
+                LOGGER.info("Ingestion pipeline: {}".format(self.pipeline.get_statistics()))
+                LOGGER.info("Export worker: {}".format(self.export_worker.get_statistics()))
+                if self.flight_log_worker is not None:
+                    LOGGER.info("Flight log worker: {}".format(self.flight_log_worker.get_statistics()))
@@ -1,8 +1,28 @@
-import pytest
+import os
+import tempfile
+import threading
+import time
+import unittest
 import math
 
-from Config import TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH
+import numpy as np
+import pandas as pd
+
+from Config import TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, OCCUPANCY_LOGODDS, MISS_LOGODDS, HIT_LOGODDS
+from Config import INGEST_QUEUE_SIZE, FILE_FLIGHT_LOG
+from Config import STATE_UNKNOWN, STATE_FREE, STATE_OCCUPIED, STATE_UNCERTAIN
 from OctoTree import OctoTree
+from ChunkedOctoTree import ChunkedOctoTree
+from TileStore import TileStore
+from OctoTreeFile import read_tree_file
+from ParallelBuilder import build_octotree, get_scan_updates
+from MapUtil import compute_ray_keys, parse_log_data, get_end_point, get_measurement_arrays, transform_measurements
+from MapUtil import import_checkpoint, get_classified_node_coor_list, get_flying_scan_list
+from IngestionPipeline import IngestionPipeline
+from LogReplay import FakeLogSource, ReplayCrazyflie, ReplayLogConfig, to_log_data, replay, get_flight_log_records
+from OctoMap import OctoMap
+from ExportWorker import ExportWorker
+from FlightLog import FlightLogWriter, read_flight_log, get_flight_log_scans, convert_flying_data
 
 class Test_OctoTree(unittest.TestCase):
     octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
@@ -11,15 +31,1319 @@ class Test_OctoTree(unittest.TestCase):
         self.assertEqual(self.octotree.get_center(), TREE_CENTER)
         self.assertEqual(self.octotree.get_resolution(), TREE_RESOLUTION)
         self.assertEqual(self.octotree.get_max_depth(), TREE_MAX_DEPTH)
-    
+
     def test_tree_range(self):
         size = TREE_RESOLUTION * math.pow(2, TREE_MAX_DEPTH)
-        corner_point = (size / 2, size / 2, size / 2)
+        # the upper bound of the tree is exclusive
+        corner_point = (size / 2 - 1, size / 2 - 1, size / 2 - 1)
         self.assertTrue(self.octotree.contains(TREE_CENTER))
         self.assertTrue(self.octotree.contains(corner_point))
-    
+        self.assertFalse(self.octotree.contains((size / 2, size / 2, size / 2)))
+
     def test_prune_small_size(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        for index in range(8):
+            octotree.insert_point(((index & 1) * TREE_RESOLUTION,
+                                   (index >> 1 & 1) * TREE_RESOLUTION,
+                                   (index >> 2 & 1) * TREE_RESOLUTION))
+        leaf_node_list = octotree.get_leaf_node_list()
+        self.assertEqual(len(leaf_node_list), 1)
+        self.assertEqual(leaf_node_list[0].get_log_odds(), OCCUPANCY_LOGODDS)
+
+    def test_voxel_key(self):
+        key = self.octotree.coord_to_key((-1, 0, 5.5))
+        half = 1 << (TREE_MAX_DEPTH - 1)
+        self.assertEqual(key, (half - 1, half, half + 1))
+        self.assertEqual(self.octotree.key_to_coord(key), (-TREE_RESOLUTION, 0, TREE_RESOLUTION))
+        self.assertIsNone(self.octotree.coord_to_key((self.octotree.radius, 0, 0)))
+
+    def test_point_outside_is_ignored(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_point((octotree.radius, 0, 0))
+        self.assertEqual(octotree.get_leaf_node_list(), [])
+
+    def test_split_pruned_leaf(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        for index in range(8):
+            octotree.insert_point(((index & 1) * TREE_RESOLUTION,
+                                   (index >> 1 & 1) * TREE_RESOLUTION,
+                                   (index >> 2 & 1) * TREE_RESOLUTION))
+        octotree.insert_point((0, 0, 0), MISS_LOGODDS)
+        # the siblings keep the value of the pruned parent
+        self.assertEqual(len(octotree.get_leaf_node_list()), 8)
+        self.assertLess(octotree.get_probability((0, 0, 0)), octotree.get_probability((TREE_RESOLUTION, 0, 0)))
+        self.assertEqual(octotree.get_probability((TREE_RESOLUTION, 0, 0)), octotree.get_probability((0, 0, TREE_RESOLUTION)))
+
+
+class Test_PrunePolicy(unittest.TestCase):
+    # parallel rays sweep blocks of free voxels which can be pruned
+    scan_list = [((1, y, z), [(61, y, z), (-59, y, z)]) for y in (1, 5) for z in (1, 5)] + \
+                [((2, 3, 0), [(61, 10, 2), (-3, 58, 1), (-62, 0, 0), (0, -57, -1)])] * 3
+
+    def get_leafs(self, octotree):
+        return sorted((key, depth, node.get_log_odds()) for key, depth, node in octotree.iter_leafs())
+
+    def test_policies_build_the_same_map(self):
+        eager = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        eager.insert_scan_list(self.scan_list)
+        for prune_policy in ('deferred', 'off'):
+            for backend in ('object', 'array'):
+                octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend, prune_policy=prune_policy)
+                octotree.insert_scan_list(self.scan_list)
+                self.assertGreater(octotree.prune(), 0)
+                self.assertEqual(self.get_leafs(octotree), self.get_leafs(eager))
+                self.assertEqual(octotree.get_statistics()['nodes_per_depth'], eager.get_statistics()['nodes_per_depth'])
+
+    def test_expand_and_prune(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, prune_policy='deferred')
+        octotree.insert_scan_list(self.scan_list)
+        octotree.prune()
+        leafs = self.get_leafs(octotree)
+        self.assertGreater(octotree.expand(), 0)
+        expanded = octotree.get_statistics()
+        self.assertEqual(len(octotree.get_leaf_node_list()), expanded['num_leafs'])
+        self.assertGreater(expanded['num_leafs'], len(leafs))
+        octotree.prune()
+        self.assertEqual(self.get_leafs(octotree), leafs)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, prune_policy='sometimes')
+
+
+class Test_InnerOccupancy(unittest.TestCase):
+
+    def setUp(self):
+        self.octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        self.octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+
+    def test_inner_nodes_keep_the_maximum(self):
+        root = self.octotree.get_root()
+        self.assertEqual(root.get_log_odds(), OCCUPANCY_LOGODDS)
+        self.assertEqual(self.octotree.get_probability((4, 0, 0), depth=0), root.probability)
+        self.assertEqual(self.octotree.get_probability((4, 0, 0), depth=1), root.probability)
+        self.assertLess(self.octotree.get_probability((4, 0, 0)), 0.5)
+
+    def test_any_occupied(self):
+        self.assertTrue(self.octotree.any_occupied((30, -10, -10), (50, 10, 10)))
+        self.assertFalse(self.octotree.any_occupied((0, -10, -10), (30, 10, 10)))
+        self.assertFalse(self.octotree.any_occupied((-100, -100, -100), (-50, -50, -50)))
+        self.assertFalse(self.octotree.any_occupied((500, 500, 500), (600, 600, 600)))
+
+    def test_coarse_occupancy(self):
+        coarse = self.octotree.get_coarse_occupancy(1)
+        self.assertEqual(list(coarse['depth']), [1])
+        self.assertEqual(list(coarse['log_odds']), [OCCUPANCY_LOGODDS])
+        half = 1 << (TREE_MAX_DEPTH - 1)
+        self.assertEqual(coarse['keys'].tolist(), [[half, half, half]])
+        fine = self.octotree.get_coarse_occupancy(TREE_MAX_DEPTH)
+        self.assertEqual(len(fine['keys']), len(self.octotree.get_leaf_node_list()))
+
+    def test_mean_summary(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, inner_occupancy='mean')
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+        self.assertLess(octotree.get_root().get_log_odds(), OCCUPANCY_LOGODDS)
+        self.assertTrue(octotree.any_occupied((30, -10, -10), (50, 10, 10)))
+
+
+class Test_ChangeTracking(unittest.TestCase):
+
+    def test_pop_changes(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, track_changes=True)
+        octotree.insert_scan((0, 0, 0), [(20, 0, 0)])
+        changes = octotree.pop_changes()
+        self.assertEqual(len(changes['keys']), 6)
+        occupied = changes['new_state'] == STATE_OCCUPIED
+        self.assertEqual(changes['keys'][occupied].tolist(), [list(octotree.coord_to_key((20, 0, 0)))])
+        self.assertEqual(changes['origins'][occupied].tolist(), [[20, 0, 0]])
+        self.assertTrue(np.all(changes['old_state'] == STATE_UNKNOWN))
+        self.assertTrue(np.all(changes['new_state'][~occupied] == STATE_FREE))
+
+        # saturated voxels do not change, the end point becomes uncertain
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+        changes = octotree.pop_changes()
+        changed = {tuple(key): (old, new) for key, old, new in
+                   zip(changes['keys'].tolist(), changes['old_state'], changes['new_state'])}
+        self.assertEqual(changed[octotree.coord_to_key((20, 0, 0))], (STATE_OCCUPIED, STATE_UNCERTAIN))
+        self.assertEqual(changed[octotree.coord_to_key((40, 0, 0))], (STATE_UNKNOWN, STATE_OCCUPIED))
+        self.assertNotIn(octotree.coord_to_key((8, 0, 0)), changed)
+
+    def test_reverted_change_is_dropped(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, track_changes=True)
+        octotree.insert_point((0, 0, 0))
+        octotree.pop_changes()
+        octotree.insert_point((0, 0, 0), MISS_LOGODDS)
+        octotree.insert_point((0, 0, 0), HIT_LOGODDS)
+        self.assertEqual(len(octotree.pop_changes()['keys']), 0)
+
+    def test_publish_changes(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        with self.assertRaises(ValueError):
+            octotree.pop_changes()
+        octotree.enable_change_tracking()
+        received = []
+        octotree.add_change_callback(received.append)
+        octotree.insert_point((0, 0, 0))
+        octotree.publish_changes()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['new_state'].tolist(), [STATE_OCCUPIED])
+
+
+class Test_TreeStatistics(unittest.TestCase):
+
+    def test_statistics_follow_split_and_prune(self):
+        for backend in ('object', 'array'):
+            octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend)
+            octotree.insert_point((0, 0, 0))
+            statistics = octotree.get_statistics()
+            self.assertEqual(statistics['nodes_per_depth'], [1] + [8] * TREE_MAX_DEPTH)
+            self.assertEqual(statistics['num_splits'], TREE_MAX_DEPTH)
+            self.assertEqual(statistics['num_leafs'], 1)
+            self.assertEqual(statistics['num_occupied'], 1)
+            for index in range(1, 8):
+                octotree.insert_point(((index & 1) * TREE_RESOLUTION,
+                                       (index >> 1 & 1) * TREE_RESOLUTION,
+                                       (index >> 2 & 1) * TREE_RESOLUTION))
+            statistics = octotree.get_statistics()
+            self.assertEqual(statistics['num_prunes'], 1)
+            self.assertEqual(statistics['nodes_per_depth'][-1], 0)
+            self.assertEqual((statistics['num_leafs'], statistics['num_inner']), (1, TREE_MAX_DEPTH - 1))
+            self.assertEqual(statistics['num_occupied'], 1)
+            self.assertGreater(statistics['estimated_bytes'], 0)
+
+    def test_sample_statistics(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.sample_statistics()
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+        octotree.sample_statistics()
+        history = octotree.get_statistics_history()
+        self.assertEqual(len(history), 2)
+        self.assertLess(history[0]['num_leafs'], history[1]['num_leafs'])
+        self.assertIn('time', history[1])
+
+
+class Test_InsertScan(unittest.TestCase):
+
+    def test_occupied_wins_over_free(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0), (20, 0, 0)])
+        free_keys, occupied_keys = octotree.compute_update((0, 0, 0), [(40, 0, 0), (20, 0, 0)])
+        self.assertIn(octotree.coord_to_key((20, 0, 0)), occupied_keys)
+        self.assertTrue(free_keys.isdisjoint(occupied_keys))
+        self.assertEqual(octotree.get_probability((20, 0, 0)), octotree.get_probability((40, 0, 0)))
+        self.assertLess(octotree.get_probability((8, 0, 0)), 0.5)
+
+    def test_max_range_only_marks_free_space(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_point_cloud((0, 0, 0), np.array([[80.0, 0.0, 0.0]]), max_range=40)
+        self.assertLess(octotree.get_probability((36, 0, 0)), 0.5)
+        self.assertEqual(octotree.get_probability((44, 0, 0)), 0.5)
+        self.assertEqual(octotree.get_probability((80, 0, 0)), 0.5)
+        with self.assertRaises(ValueError):
+            octotree.insert_point_cloud((0, 0, 0), np.zeros((2, 2)))
+
+
+class Test_RayTraversal(unittest.TestCase):
+
+    def test_diagonal_rays_do_not_skip_voxels(self):
+        start_points = np.array([[0.0, 0.0, 0.0], [2.0, -3.0, 1.0], [-30.0, 12.0, 5.0]])
+        end_points = np.array([[40.0, 40.0, 40.0], [-50.0, 21.0, -9.0], [-30.0, 12.0, 5.0]])
+        keys, offsets = compute_ray_keys(start_points, end_points, (0, 0, 0), TREE_RESOLUTION)
+        for index in range(len(start_points)):
+            ray_keys = keys[offsets[index]:offsets[index + 1]]
+            start_key = np.floor(start_points[index] / TREE_RESOLUTION)
+            end_key = np.floor(end_points[index] / TREE_RESOLUTION)
+            self.assertEqual(len(ray_keys), np.abs(end_key - start_key).sum())
+            if len(ray_keys) == 0:
+                continue
+            self.assertTrue(np.array_equal(ray_keys[0], start_key))
+            # each voxel shares a face with the next one, the last one with the end voxel
+            path = np.vstack([ray_keys, end_key])
+            self.assertTrue(np.all(np.abs(np.diff(path, axis=0)).sum(axis=1) == 1))
+
+
+class Test_OctoNodePool(unittest.TestCase):
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='unknown')
+
+    def test_same_map_as_object_backend(self):
+        trees = [OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend) for backend in ('object', 'array')]
+        for octotree in trees:
+            octotree.ray_casting((0, 0, 0), (60, 20, 8))
+            octotree.ray_casting((0, 0, 0), (-40, 30, -10))
+        for point in [(0, 0, 0), (30, 10, 4), (60, 20, 8), (-40, 30, -10), (50, 50, 50)]:
+            self.assertEqual(trees[0].get_probability(point), trees[1].get_probability(point))
+        self.assertEqual(len(trees[0].get_leaf_node_list()), len(trees[1].get_leaf_node_list()))
+
+    def test_pruned_blocks_are_reused(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array')
+        pool = octotree._pool
+        for index in range(8):
+            octotree.insert_point(((index & 1) * TREE_RESOLUTION,
+                                   (index >> 1 & 1) * TREE_RESOLUTION,
+                                   (index >> 2 & 1) * TREE_RESOLUTION))
+        num_slots, size = pool.num_slots, pool._size
+        octotree.insert_point((64, 64, 64))
+        # the new path splits 4 nodes, one of them reuses the block released by pruning
+        self.assertEqual(pool.num_slots, num_slots + 8 * 4)
+        self.assertEqual(pool._size, size + 8 * 3)
+        self.assertEqual(len(octotree.get_leaf_node_list()), 2)
+
+
+class Test_LeafIterator(unittest.TestCase):
+    def setUp(self):
+        self.octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        self.octotree.insert_scan((1, 1, 1), [(41, 1, 1), (1, -39, 1)])
+
+    def test_keys_match_nodes(self):
+        for backend in ('object', 'array'):
+            octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend)
+            octotree.insert_scan((1, 1, 1), [(41, 1, 1), (1, -39, 1)])
+            leafs = list(octotree.iter_leafs())
+            self.assertEqual(len(leafs), len(octotree.get_leaf_node_list()))
+            for key, depth, node in leafs:
+                self.assertEqual(octotree._find_node(key, depth).get_log_odds(), node.get_log_odds())
+
+    def test_to_arrays(self):
+        arrays = self.octotree.to_arrays()
+        self.assertEqual(arrays['keys'].shape, (len(self.octotree.get_leaf_node_list()), 3))
+        origin = self.octotree.key_to_coord(tuple(arrays['keys'][0]))
+        self.assertEqual(arrays['coords'][0].tolist(), list(origin))
+        for log_odds, state in zip(arrays['log_odds'], arrays['state']):
+            self.assertEqual(state, OctoTree.get_state(log_odds))
+        self.assertEqual(int((arrays['state'] == STATE_OCCUPIED).sum()), 2)
+
+    def test_array_backend_matches_iterator(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array')
+        octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+        for max_depth in (None, 2, 0):
+            arrays = octotree.to_arrays(max_depth)
+            expected = sorted((key, depth, node.get_log_odds()) for key, depth, node in octotree.iter_leafs(max_depth))
+            rows = sorted(zip(map(tuple, arrays['keys'].tolist()), arrays['depth'].tolist(), arrays['log_odds'].tolist()))
+            self.assertEqual(rows, expected)
+
+    def test_predicate(self):
+        occupied = list(self.octotree.iter_leafs(predicate=lambda key, depth, node: node.get_log_odds() >= OCCUPANCY_LOGODDS))
+        self.assertEqual(len(occupied), 2)
+
+    def test_empty_tree(self):
+        arrays = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH).to_arrays()
+        self.assertEqual(arrays['keys'].shape, (0, 3))
+        self.assertEqual(len(arrays['state']), 0)
+
+
+class Test_SaveLoad(unittest.TestCase):
+    def setUp(self):
+        self.octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        self.octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'octotree.bt')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_nodes(self, octotree):
+        return sorted((key, depth, node.get_log_odds(), node.is_leaf()) for key, depth, node in octotree.iter_leafs())
+
+    def test_round_trip(self):
+        self.octotree.save(self.path)
+        for backend in ('object', 'array'):
+            for use_mmap in (True, False):
+                loaded = OctoTree.load(self.path, mmap=use_mmap, backend=backend)
+                self.assertEqual(self.get_nodes(loaded), self.get_nodes(self.octotree))
+                self.assertEqual(loaded.get_root().get_log_odds(), self.octotree.get_root().get_log_odds())
+                statistics = loaded.get_statistics()
+                expected = self.octotree.get_statistics()
+                for name in ('nodes_per_depth', 'num_leafs', 'num_inner', 'num_occupied', 'num_free'):
+                    self.assertEqual(statistics[name], expected[name])
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_mapping_is_closed(self):
+        self.octotree.save(self.path)
+        num_files = len(os.listdir('/proc/self/fd'))
+        for backend in ('object', 'array'):
+            OctoTree.load(self.path, mmap=True, backend=backend)
+            # the mapping keeps a file descriptor of its own until it is closed
+            self.assertEqual(len(os.listdir('/proc/self/fd')), num_files)
+        with read_tree_file(self.path, use_mmap=True) as tree_file:
+            self.assertEqual(len(tree_file['log_odds']), len(tree_file['codes']))
+            self.assertEqual(len(os.listdir('/proc/self/fd')), num_files + 1)
+        # the views are released and the mapping is closed at the end of the with statement
+        self.assertEqual(tree_file, {})
+        self.assertEqual(len(os.listdir('/proc/self/fd')), num_files)
+
+    def test_loaded_tree_can_be_updated(self):
+        self.octotree.save(self.path)
+        for backend in ('object', 'array'):
+            loaded = OctoTree.load(self.path, backend=backend)
+            loaded.insert_scan((2, 3, 0), [(-30, -30, 30)])
+            self.assertEqual(loaded.get_probability((-30, -30, 30)), loaded.get_probability((-30, -30, 30), depth=TREE_MAX_DEPTH))
+            self.assertTrue(loaded.any_occupied((-34, -34, 26), (-26, -26, 34)))
+
+    def test_without_log_odds(self):
+        self.octotree.save(self.path, log_odds=False)
+        loaded = OctoTree.load(self.path)
+        # leafs keep their maximum likelihood state, the logodds are clamped
+        get_occupied = lambda octotree: sorted((key, depth, node.get_log_odds() > 0) for key, depth, node in octotree.iter_leafs())
+        self.assertEqual(get_occupied(loaded), get_occupied(self.octotree))
+        self.assertEqual(loaded.get_root().get_log_odds(), OCCUPANCY_LOGODDS)
+        self.assertLess(os.path.getsize(self.path), 8 * loaded.get_statistics()['num_nodes'])
+
+    def test_empty_tree(self):
+        OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH).save(self.path)
+        loaded = OctoTree.load(self.path, backend='array')
+        self.assertEqual(loaded.get_leaf_node_list(), [])
+        self.assertEqual(loaded.get_max_depth(), TREE_MAX_DEPTH)
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'not an octotree file at all, but long enough for the header')
+        self.assertRaises(ValueError, OctoTree.load, self.path)
+
+    def test_bytes_round_trip(self):
+        buffer = self.octotree.to_bytes(log_odds=True)
+        self.octotree.save(self.path, log_odds=True)
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), buffer)
+        loaded = OctoTree.from_bytes(buffer, backend='array')
+        self.assertEqual(self.get_nodes(loaded), self.get_nodes(self.octotree))
+
+
+class Test_FlightLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'flight_log.bin')
+        self.measurements = [dict(x=index, y=2.5, z=30, roll=0, pitch=0, yaw=90.0 * index,
+                                  front=40, back=400, left=20 + index, right=400) for index in range(25)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, measurements):
+        with FlightLogWriter(self.path, chunk_size=10, resume=True) as writer:
+            for index, measurement in enumerate(measurements):
+                writer.append(100 * index, measurement)
+
+    def test_round_trip(self):
+        self.write(self.measurements)
+        blocks = list(read_flight_log(self.path, block_size=10))
+        self.assertEqual([len(block) for block in blocks], [10, 10, 5])
+        records = np.concatenate(blocks)
+        self.assertEqual(records['timestamp'][3], 300)
+        self.assertEqual(records['left'].tolist(), [20 + index for index in range(25)])
+        self.assertEqual(records['yaw'][2], 180)
+
+    def test_append_and_incomplete_record(self):
+        self.write(self.measurements[:5])
+        self.write(self.measurements[5:])
+        with open(self.path, 'ab') as file:
+            file.write(b'cut off')
+        records = np.concatenate(list(read_flight_log(self.path)))
+        self.assertEqual(records['x'].tolist(), list(range(25)))
+        # the cut record is removed when the log is opened again, the new records stay aligned
+        with FlightLogWriter(self.path, resume=True) as writer:
+            self.assertEqual(writer.last_timestamp, 1900)
+            writer.append(2000, dict(self.measurements[0], x=25))
+        records = np.concatenate(list(read_flight_log(self.path)))
+        self.assertEqual(records['x'].tolist(), list(range(26)))
+        self.assertEqual(records['timestamp'][-1], 2000)
+        self.assertEqual(records['yaw'][-1], 0)
+
+    def test_scans(self):
+        self.write(self.measurements[:1])
+        scans = list(get_flight_log_scans(self.path))
+        self.assertEqual(scans, [((0, 2, 30), [(40.0, 2.0, 30.0), (0.0, 22.0, 30.0)])])
+
+    def test_free_beams_like_the_pipeline(self):
+        # the back and right beams are beyond the sensor range
+        self.write(self.measurements[:8])
+        for free_beam_range in (-1, 50):
+            live = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+            pipeline = IngestionPipeline(live, free_beam_range=free_beam_range)
+            for record in read_flight_log(self.path):
+                for values in record.tolist():
+                    pipeline.put(values[0], to_log_data(dict(zip(record.dtype.names[1:], values[1:]))))
+            pipeline.start()
+            pipeline.close()
+            scan_list = list(get_flight_log_scans(self.path, free_beam_range=free_beam_range))
+            self.assertEqual(sum(len(scan[1]) for scan in scan_list), 8 * (4 if free_beam_range > 0 else 2))
+            offline = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+            offline.insert_scan_list(scan_list)
+            parallel = build_octotree(scan_list, num_workers=1)
+            for octotree in (offline, parallel):
+                self.assertEqual(Test_PrunePolicy.get_leafs(self, octotree), Test_PrunePolicy.get_leafs(self, live))
+
+    def test_flying_scan_list(self):
+        self.write(self.measurements[:3])
+        self.assertEqual(get_flying_scan_list(self.path), list(get_flight_log_scans(self.path)))
+        self.assertEqual(len(get_flying_scan_list(self.path)), 3)
+
+    def test_convert_flying_data(self):
+        start_file = os.path.join(self.directory.name, 'start_points.csv')
+        end_file = os.path.join(self.directory.name, 'end_points.csv')
+        start_points = [(0, 0, 30)] * 3 + [(4, 0, 30)]
+        end_points = [(50, 2, 30), (0, -20, 30), (60, 0, 30), (4, 40, 30)]
+        pd.DataFrame(start_points).to_csv(start_file)
+        pd.DataFrame(end_points).to_csv(end_file)
+        # the second beam to the front starts a new measurement
+        self.assertEqual(convert_flying_data(start_file, end_file, self.path), 3)
+        scans = list(get_flight_log_scans(self.path))
+        self.assertEqual([start for start, _ in scans], [(0, 0, 30), (0, 0, 30), (4, 0, 30)])
+        self.assertEqual(scans[1][1], [(60.0, 0.0, 30.0)])
+        self.assertEqual(scans[2][1], [(4.0, 40.0, 30.0)])
+        # converting into the same log again continues after its last measurement
+        self.assertEqual(convert_flying_data(start_file, end_file, self.path), 3)
+        self.assertEqual(np.concatenate(list(read_flight_log(self.path)))['timestamp'].tolist(),
+                         [0, 100, 200, 300, 400, 500])
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'not a flight log')
+        self.assertRaises(ValueError, lambda: list(read_flight_log(self.path)))
+
+
+class Test_ExportWorker(unittest.TestCase):
+    def test_inline(self):
+        exported = []
+        worker = ExportWorker(background=False)
+        worker.submit(exported.append, 1, coalesce_key='known_voxel')
+        worker.submit(exported.append, 2, coalesce_key='known_voxel')
+        self.assertEqual(exported, [1, 2])
+        self.assertEqual(worker.get_statistics()['exported'], 2)
+
+    def test_coalesce_while_busy(self):
+        exported = []
+        started, release = threading.Event(), threading.Event()
+        def block(value):
+            started.set()
+            release.wait()
+            exported.append(value)
+
+        worker = ExportWorker(background=True)
+        worker.submit(block, 0, coalesce_key='known_voxel')
+        started.wait()
+        for value in (1, 2, 3):
+            worker.submit(exported.append, value, coalesce_key='known_voxel')
+        worker.submit(exported.append, 'delta')
+        self.assertEqual(worker.queue_depth, 3)
+        release.set()
+        worker.close()
+
+        self.assertEqual(exported, [0, 3, 'delta'])
+        statistics = worker.get_statistics()
+        self.assertEqual((statistics['submitted'], statistics['exported'], statistics['coalesced']), (5, 3, 2))
+        self.assertEqual(statistics['queue_depth'], 0)
+        self.assertGreaterEqual(statistics['max_latency'], statistics['mean_latency'])
+        self.assertRaises(ValueError, worker.submit, exported.append, 4)
+
+    def test_failed_export(self):
+        worker = ExportWorker(background=True)
+        worker.submit(lambda: 1 / 0)
+        worker.wait()
+        self.assertEqual(worker.get_statistics()['failed'], 1)
+        worker.close()
+
+    def test_snapshot_is_consistent(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, prune_policy='deferred')
+        octotree.insert_scan((1, 1, 1), [(41, 1, 1)])
+        snapshot = octotree.snapshot()
+        keys = snapshot['keys'].copy()
+        octotree.insert_scan((1, 1, 1), [(1, 41, 1)])
+        self.assertTrue(np.array_equal(snapshot['keys'], keys))
+        self.assertEqual(len(octotree.snapshot()['keys']), len(octotree.get_leaf_node_list()))
+
+
+class Test_IngestionPipeline(unittest.TestCase):
+    @staticmethod
+    def get_records(num_records):
+        return [(100 * index, to_log_data(dict(x=index % 20, y=2, z=30, roll=0, pitch=0, yaw=10.0 * index,
+                                               front=40, back=30, left=400, right=25)))
+                for index in range(num_records)]
+
+    def test_fake_source_builds_the_same_map(self):
+        records = self.get_records(60)
+        batches = []
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        pipeline = IngestionPipeline(octotree, batch_size=8, on_batch=batches.append)
+        pipeline.start()
+        source = FakeLogSource(records, period_in_ms=0)
+        source.data_received_cb.add_callback(pipeline.put)
+        source.start()
+        source.wait()
+        pipeline.close()
+
+        expected = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        for _, data in records:
+            measurement, start_point = parse_log_data(data)
+            expected.insert_scan(tuple(start_point), get_end_point(start_point, measurement))
+        get_leafs = lambda octotree: sorted((key, node.get_log_odds()) for key, _, node in octotree.iter_leafs())
+        self.assertEqual(get_leafs(octotree), get_leafs(expected))
+
+        self.assertEqual(sum(len(batch) for batch in batches), 60)
+        self.assertEqual(batches[0][0][0], 0)
+        statistics = pipeline.get_statistics()
+        self.assertEqual((statistics['received'], statistics['processed'], statistics['dropped']), (60, 60, 0))
+        self.assertLessEqual(statistics['max_queue_depth'], INGEST_QUEUE_SIZE)
+        self.assertGreater(statistics['insert_max'], 0)
+
+    def test_drop_oldest(self):
+        pipeline = IngestionPipeline(OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH), queue_size=4,
+                                     overflow='drop_oldest')
+        for timestamp, data in self.get_records(10):
+            pipeline.put(timestamp, data)
+        self.assertEqual([record[1] for record in pipeline._queue], [600, 700, 800, 900])
+        self.assertEqual(pipeline.get_statistics()['dropped'], 6)
+
+    def test_decimate(self):
+        pipeline = IngestionPipeline(OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH), queue_size=4,
+                                     overflow='decimate')
+        for timestamp, data in self.get_records(7):
+            pipeline.put(timestamp, data)
+        # the full queue [0, 200, 400, 500] is halved to [0, 400] before 600 is appended
+        self.assertEqual([record[1] for record in pipeline._queue], [0, 400, 600])
+        self.assertEqual(pipeline.get_statistics()['dropped'], 4)
+
+    def test_block(self):
+        pipeline = IngestionPipeline(OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH), queue_size=2)
+        records = self.get_records(5)
+        producer = threading.Thread(target=lambda: [pipeline.put(timestamp, data) for timestamp, data in records])
+        producer.start()
+        producer.join(0.2)
+        # the producer waits for room in the queue
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(pipeline.queue_depth, 2)
+        pipeline.start()
+        producer.join()
+        pipeline.close()
+        statistics = pipeline.get_statistics()
+        self.assertEqual((statistics['processed'], statistics['dropped']), (5, 0))
+        self.assertGreater(statistics['blocked_time'], 0)
+
+    def test_close_while_blocked(self):
+        pipeline = IngestionPipeline(OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH), queue_size=2)
+        records = self.get_records(3)
+        producer = threading.Thread(target=lambda: [pipeline.put(timestamp, data) for timestamp, data in records])
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+        pipeline.close(wait=False)
+        producer.join()
+        # the blocked record is counted as dropped instead of being queued behind the closed pipeline
+        statistics = pipeline.get_statistics()
+        self.assertEqual((statistics['received'], statistics['processed'], statistics['dropped']), (3, 0, 3))
+        self.assertEqual(statistics['queue_depth'], 0)
+
+    def test_put_after_close(self):
+        pipeline = IngestionPipeline(OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH))
+        pipeline.start()
+        pipeline.close()
+        # a log callback delivered after the disconnect must not raise on the radio thread
+        for timestamp, data in self.get_records(2):
+            pipeline.put(timestamp, data)
+        statistics = pipeline.get_statistics()
+        self.assertEqual((statistics['received'], statistics['processed'], statistics['dropped']), (2, 0, 2))
+        self.assertEqual(pipeline.queue_depth, 0)
+
+    def test_unknown_overflow(self):
+        self.assertRaises(ValueError, IngestionPipeline, None, overflow='ignore')
+
+
+class Test_LogReplay(unittest.TestCase):
+    def test_replay_feeds_update_map(self):
+        records = Test_IngestionPipeline.get_records(30)
+        octomap = OctoMap(save_flying_data=False)
+        row = replay(records, rate=0, octomap=octomap)
+        self.assertEqual(row['records'], 30)
+        self.assertEqual(octomap.pipeline.get_statistics()['processed'], 30)
+        self.assertTrue(row['kept_up'] or row['max_queue_depth'] == INGEST_QUEUE_SIZE)
+        self.assertGreater(len(octomap.octotree.get_leaf_node_list()), 0)
+
+    def test_sessions_record_separate_flights(self):
+        first, second = Test_IngestionPipeline.get_records(20), Test_IngestionPipeline.get_records(5)
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                replay(first, rate=0, octomap=OctoMap(save_flying_data=True))
+                replay(second, rate=0, octomap=OctoMap(save_flying_data=True))
+                logged = np.concatenate(list(read_flight_log(FILE_FLIGHT_LOG)))
+                self.assertEqual(logged['timestamp'].tolist(), [timestamp for timestamp, _ in second])
+                # resuming continues the log of the previous session
+                replay(first, rate=0, octomap=OctoMap(save_flying_data=True, resume_flight_log=True))
+                logged = np.concatenate(list(read_flight_log(FILE_FLIGHT_LOG)))
+                self.assertEqual(len(logged), 25)
+            finally:
+                os.chdir(working_directory)
+
+    def test_replay_uses_the_queue_size_of_the_pipeline(self):
+        records = Test_IngestionPipeline.get_records(10)
+        octomap = OctoMap(save_flying_data=False)
+        # every put fills a queue of one record, the mapper is always a full queue behind
+        octomap.pipeline = IngestionPipeline(octomap.octotree, queue_size=1, on_batch=octomap.on_batch)
+        row = replay(records, rate=0, octomap=octomap)
+        self.assertEqual(octomap.pipeline.get_statistics()['queue_size'], 1)
+        self.assertFalse(row['kept_up'])
+
+    def test_replay_records_flight_log(self):
+        records = Test_IngestionPipeline.get_records(30)
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                octomap = OctoMap(save_flying_data=True)
+                replay(records, rate=0, octomap=octomap)
+                # the flight log worker has written every batch in order before the disconnect closed the log
+                logged = np.concatenate(list(read_flight_log(FILE_FLIGHT_LOG)))
+            finally:
+                os.chdir(working_directory)
+        self.assertEqual(logged['timestamp'].tolist(), [timestamp for timestamp, _ in records])
+        self.assertEqual(octomap.flight_log_worker.get_statistics()['exported'],
+                         octomap.pipeline.get_statistics()['batches'])
+
+    def test_replay_rate(self):
+        records = Test_IngestionPipeline.get_records(5)
+        received = []
+        cf = ReplayCrazyflie(records, rate=10)
+        logconf = ReplayLogConfig()
+        cf.log.add_config(logconf)
+        logconf.data_received_cb.add_callback(lambda timestamp, data, logconf: received.append(timestamp))
+        start_time = time.perf_counter()
+        logconf.start()
+        cf.wait()
+        # 4 periods of 100 ms at 10x
+        self.assertGreaterEqual(time.perf_counter() - start_time, 0.04)
+        self.assertEqual(received, [0, 100, 200, 300, 400])
+
+    def test_flight_log_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'flight_log.bin')
+            measurement = dict(x=1, y=2, z=30, roll=0, pitch=0, yaw=0, front=40, back=400, left=400, right=400)
+            with FlightLogWriter(path) as writer:
+                writer.append(1200, measurement)
+            records = get_flight_log_records(path)
+        self.assertEqual(records, [(1200, to_log_data(measurement))])
+        self.assertEqual(parse_log_data(records[0][1])[0]['front'], 40)
+
+
+class Test_TransformMeasurements(unittest.TestCase):
+    def test_matches_get_end_point(self):
+        rng = np.random.default_rng(3)
+        measurements = [dict(x=rng.uniform(-100, 100), y=rng.uniform(-100, 100), z=rng.uniform(0, 60),
+                             roll=round(rng.uniform(-10, 10), 2), pitch=round(rng.uniform(-10, 10), 2),
+                             yaw=round(rng.uniform(-180, 180), 2), front=rng.uniform(0, 500), back=rng.uniform(0, 500),
+                             left=rng.uniform(0, 500), right=rng.uniform(0, 500)) for _ in range(200)]
+        expected_points, expected_index = [], []
+        for index, measurement in enumerate(measurements):
+            end_points = get_end_point([int(measurement[name]) for name in ('x', 'y', 'z')], measurement)
+            expected_points.extend(end_points)
+            expected_index.extend([index] * len(end_points))
+
+        end_points, record_index, is_hit = transform_measurements(*get_measurement_arrays(measurements))
+        self.assertEqual(end_points.shape, (len(expected_points), 3))
+        self.assertTrue(np.allclose(end_points, expected_points))
+        self.assertEqual(record_index.tolist(), expected_index)
+
+    def test_empty(self):
+        end_points, record_index, is_hit = transform_measurements(*get_measurement_arrays([]))
+        self.assertEqual(end_points.shape, (0, 3))
+        self.assertEqual(len(record_index), 0)
+
+    def test_free_beams(self):
+        start_points, attitudes, ranges = np.array([[0, 0, 30]]), np.zeros((1, 3)), np.array([[40, 500, 400, 20]])
+        end_points, record_index, is_hit = transform_measurements(start_points, attitudes, ranges, free_beam_range=-1)
+        self.assertEqual(end_points.tolist(), [[40, 0, 30], [0, -20, 30]])
+        end_points, record_index, is_hit = transform_measurements(start_points, attitudes, ranges, free_beam_range=60)
+        self.assertEqual(end_points.tolist(), [[40, 0, 30], [-60, 0, 30], [0, 60, 30], [0, -20, 30]])
+        self.assertEqual(is_hit.tolist(), [True, False, False, True])
+
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_rays(start_points[record_index], end_points, record_index, is_hit=is_hit)
+        self.assertEqual(int((octotree.to_arrays()['state'] == STATE_OCCUPIED).sum()), 2)
+        self.assertEqual(octotree.get_probability((-50, 1, 30)), octotree.get_probability((10, 1, 30)))
+        self.assertLess(octotree.get_probability((1, 50, 30)), 0.5)
+        self.assertEqual(octotree.get_probability((-70, 1, 30)), 0.5)
+
+    def test_insert_rays(self):
+        scan_list = Test_PrunePolicy.scan_list
+        expected = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        expected.insert_scan_list(scan_list)
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        start_points = [origin for origin, end_points in scan_list for _ in end_points]
+        end_points = [end_point for _, end_points in scan_list for end_point in end_points]
+        scan_index = [index for index, (_, scan_end_points) in enumerate(scan_list) for _ in scan_end_points]
+        octotree.insert_rays(np.array(start_points), np.array(end_points), np.array(scan_index))
+        get_leafs = lambda octotree: sorted((key, node.get_log_odds()) for key, _, node in octotree.iter_leafs())
+        self.assertEqual(get_leafs(octotree), get_leafs(expected))
+
+
+class Test_RayCache(unittest.TestCase):
+
+    def test_same_map_with_and_without_cache(self):
+        scan_list = Test_PrunePolicy.scan_list * 3
+        for backend in ('object', 'array'):
+            cached = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend)
+            uncached = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend, ray_cache_size=0)
+            cached.insert_scan_list(scan_list)
+            uncached.insert_scan_list(scan_list)
+            self.assertEqual(Test_PrunePolicy.get_leafs(self, cached), Test_PrunePolicy.get_leafs(self, uncached))
+            statistics = cached.get_statistics()
+            self.assertGreater(statistics['ray_cache_hits'], 0)
+            self.assertEqual(uncached.get_statistics()['ray_cache_hits'], 0)
+
+    def test_repeated_ray_is_skipped(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        for _ in range(3):
+            octotree.ray_casting((0, 0, 0), (40, 0, 0))
+        statistics = octotree.get_statistics()
+        self.assertEqual((statistics['ray_cache_hits'], statistics['ray_cache_misses']), (1, 2))
+
+    def test_truncated_and_full_ray(self):
+        origin, end_point = (1, 1, 1), (101, 1, 1)
+        cached = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        uncached = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, ray_cache_size=0)
+        for octotree in (cached, uncached):
+            # the truncated ray is saturated, the full ray still has to mark the voxels behind the truncation
+            for max_range in (20, 20, -1, -1, 20):
+                octotree.insert_scan(origin, [end_point], max_range=max_range)
+        self.assertEqual(Test_PrunePolicy.get_leafs(self, cached), Test_PrunePolicy.get_leafs(self, uncached))
+        self.assertLess(cached.get_probability((60, 1, 1)), 0.5)
+        self.assertEqual(cached.get_statistics()['ray_cache_hits'], 1)
+
+    def test_changed_voxel_invalidates_the_cache(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+        # a clamped free voxel of the cached ray becomes occupied
+        self.assertTrue(octotree.insert_point((20, 0, 0), HIT_LOGODDS))
+        probability = octotree.get_probability((20, 0, 0))
+        octotree.insert_scan((0, 0, 0), [(40, 0, 0)])
+        self.assertEqual(octotree.get_statistics()['ray_cache_hits'], 0)
+        self.assertLess(octotree.get_probability((20, 0, 0)), probability)
+
+    def test_saturated_update_changes_nothing(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        self.assertTrue(octotree.insert_point((0, 0, 0), HIT_LOGODDS))
+        self.assertFalse(octotree.insert_point((0, 0, 0), HIT_LOGODDS))
+        self.assertTrue(octotree.insert_point((0, 0, 0), MISS_LOGODDS))
+        self.assertFalse(octotree.insert_point((10 ** 6, 0, 0), HIT_LOGODDS))
+
+    def test_saturated_pruned_leaf_is_not_split(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+        num_splits = octotree.get_statistics()['num_splits']
+        octotree.insert_scan_list(Test_PrunePolicy.scan_list[-1:])
+        self.assertEqual(octotree.get_statistics()['num_splits'], num_splits)
+
+
+class Test_FixedPointLogOdds(unittest.TestCase):
+
+    def get_leafs(self, octotree):
+        # float logodds accumulate rounding errors, the fixed-point ones do not
+        return [(key, depth, round(log_odds, 6)) for key, depth, log_odds in Test_PrunePolicy.get_leafs(self, octotree)]
+
+    def test_same_map_as_float(self):
+        for inner_occupancy in ('max', 'mean'):
+            expected = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array',
+                                inner_occupancy=inner_occupancy)
+            expected.insert_scan_list(Test_PrunePolicy.scan_list)
+            for storage in ('int16', 'int8'):
+                octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array',
+                                    log_odds_storage=storage, inner_occupancy=inner_occupancy)
+                octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+                self.assertEqual(self.get_leafs(octotree), self.get_leafs(expected))
+                self.assertEqual(octotree.get_statistics()['nodes_per_depth'], expected.get_statistics()['nodes_per_depth'])
+                for point in [(0, 0, 0), (30, 3, 1), (61, 10, 2), (-40, 30, -10)]:
+                    self.assertAlmostEqual(octotree.get_probability(point), expected.get_probability(point))
+                self.assertLess(octotree.get_statistics()['estimated_bytes'], expected.get_statistics()['estimated_bytes'])
+
+    def test_increments_are_exact(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array', log_odds_storage='int8')
+        for _ in range(3):
+            octotree.insert_point((0, 0, 0), MISS_LOGODDS)
+        octotree.insert_point((0, 0, 0), HIT_LOGODDS)
+        arrays = octotree.to_arrays()
+        self.assertEqual(arrays['log_odds'].tolist(), [0.45])
+        self.assertEqual(arrays['state'].tolist(), [STATE_UNCERTAIN])
+        octotree.insert_point((0, 0, 0), HIT_LOGODDS)
+        self.assertEqual(octotree.to_arrays()['log_odds'].tolist(), [OCCUPANCY_LOGODDS])
+
+    def test_save_load(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array', log_odds_storage='int16')
+        octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'octotree.bt')
+            octotree.save(path)
+            loaded = OctoTree.load(path, backend='array', log_odds_storage='int8')
+        self.assertEqual(loaded.get_log_odds_storage(), 'int8')
+        self.assertEqual(Test_PrunePolicy.get_leafs(self, loaded), Test_PrunePolicy.get_leafs(self, octotree))
+        self.assertEqual(loaded.get_statistics()['num_occupied'], octotree.get_statistics()['num_occupied'])
+
+    def test_invalid_storage(self):
+        with self.assertRaises(ValueError):
+            OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array', log_odds_storage='int4')
+        with self.assertRaises(ValueError):
+            OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='object', log_odds_storage='int8')
+
+
+class Test_ChunkedOctoTree(unittest.TestCase):
+
+    def test_same_map_as_single_tree_inside_the_bounds(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+        chunked.insert_scan_list(Test_PrunePolicy.scan_list)
+        self.assertEqual(chunked.get_chunk_keys(), [(0, 0, 0)])
+        self.assertEqual(Test_PrunePolicy.get_leafs(self, chunked), Test_PrunePolicy.get_leafs(self, octotree))
+        expected, arrays = octotree.to_arrays(), chunked.to_arrays()
+        for name in ('keys', 'coords', 'depth', 'log_odds', 'state'):
+            self.assertTrue(np.array_equal(arrays[name], expected[name]))
+        statistics = chunked.get_statistics()
+        self.assertEqual(statistics['num_chunks'], 1)
+        self.assertEqual(statistics['nodes_per_depth'], octotree.get_statistics()['nodes_per_depth'])
+
+    def test_rays_cross_chunks(self):
+        chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array')
+        width = chunked.chunk_width
+        chunked.insert_scan((0, 0, 0), [(2.5 * width, 2, 2), (-1.5 * width, -2, 2)])
+        self.assertEqual(sorted(chunked.get_chunk_keys()), [(-1, 0, 0), (0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0)])
+        self.assertGreater(chunked.get_probability((2.5 * width, 2, 2)), 0.5)
+        self.assertLess(chunked.get_probability((1.5 * width, 1, 2)), 0.5)
+        self.assertGreater(chunked.get_probability((-1.5 * width, -2, 2)), 0.5)
+        # chunks which were never observed are unknown and not allocated
+        self.assertEqual(chunked.get_probability((0, 10 * width, 0)), 0.5)
+        self.assertEqual(chunked.num_chunks, 5)
+        self.assertTrue(chunked.any_occupied((2.4 * width, 0, 0), (2.6 * width, 4, 4)))
+        self.assertFalse(chunked.any_occupied((1.4 * width, 0, 0), (1.6 * width, 4, 4)))
+
+        arrays = chunked.to_arrays()
+        keys = [chunked.coord_to_key(coord) for coord in arrays['coords'].tolist()]
+        self.assertEqual(keys, list(map(tuple, arrays['keys'].tolist())))
+        self.assertEqual(sorted(key for key, _, _ in chunked.iter_leafs()), sorted(keys))
+
+    def test_change_tracking(self):
+        chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, track_changes=True)
+        width = chunked.chunk_width
+        self.assertTrue(chunked.insert_point((width, 0, 0)))
+        self.assertTrue(chunked.insert_point((-width, 0, 0)))
+        changes = chunked.pop_changes()
+        self.assertEqual(sorted(map(tuple, changes['origins'].tolist())),
+                         sorted([chunked.key_to_coord(chunked.coord_to_key(point)) for point in ((width, 0, 0), (-width, 0, 0))]))
+        self.assertEqual(changes['new_state'].tolist(), [STATE_OCCUPIED] * 2)
+        self.assertEqual(len(chunked.pop_changes()['keys']), 0)
+
+    def test_unclipped_measurements(self):
+        start_points, attitudes, ranges = np.array([[0, 0, 0]]), np.zeros((1, 3)), np.array([[390, 0, 0, 0]])
+        clipped, _, _ = transform_measurements(start_points, attitudes, ranges)
+        end_points, _, _ = transform_measurements(start_points, attitudes, ranges, clip=False)
+        self.assertEqual(end_points[0].tolist(), [390, 0, 0])
+        self.assertLess(clipped[0][0], 390)
+
+
+class Test_RollingMap(unittest.TestCase):
+
+    def fly(self, chunked, num_chunks):
+        """
+        Fly along x through num_chunks chunks and observe a wall next to the drone in each of them.
+        """
+        width = chunked.chunk_width
+        for index in range(num_chunks):
+            position = (index * width, 0, 0)
+            chunked.insert_scan(position, [(index * width + 40, 20, 0), (index * width - 40, 20, 0)])
+            chunked.set_position(position)
+
+    def test_drop(self):
+        chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, rolling_radius=300, eviction='drop')
+        self.fly(chunked, 20)
+        statistics = chunked.get_statistics()
+        self.assertLessEqual(statistics['num_chunks'], 3)
+        self.assertEqual(statistics['num_chunks'] + statistics['num_evicted'], 20)
+        self.assertEqual(chunked.get_probability((0, 20, 0)), 0.5)
+        self.assertGreater(chunked.get_probability((19 * chunked.chunk_width + 40, 20, 0)), 0.5)
+
+    def test_memory_is_capped(self):
+        sizes = []
+        for num_chunks in (10, 40):
+            chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array', rolling_radius=300)
+            self.fly(chunked, num_chunks)
+            sizes.append(chunked.get_statistics()['estimated_bytes'])
+        self.assertEqual(sizes[0], sizes[1])
+
+    def test_coarsen(self):
+        chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, rolling_radius=300, eviction='coarsen',
+                                  eviction_depth=3)
+        self.fly(chunked, 5)
+        statistics = chunked.get_statistics()
+        self.assertEqual(statistics['num_chunks'], 5)
+        self.assertGreater(statistics['num_coarse_chunks'], 0)
+        first = chunked.get_chunk((0, 0, 0))
+        self.assertEqual(max(first.to_arrays()['depth']), 3)
+        self.assertEqual(first.get_statistics()['num_leafs'], len(first.to_arrays()['keys']))
+        # the coarse leaf keeps the occupied summary of the wall
+        self.assertGreater(chunked.get_probability((40, 20, 0)), 0.5)
+        # coming back refines the chunk again
+        chunked.insert_scan((0, 0, 0), [(40, 20, 0)])
+        chunked.set_position((0, 0, 0))
+        self.assertEqual(max(first.to_arrays()['depth']), TREE_MAX_DEPTH)
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, rolling_radius=300,
+                                      eviction='spill', spill_directory=directory, track_changes=True)
+            expected = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+            self.fly(chunked, 6)
+            self.fly(expected, 6)
+            statistics = chunked.get_statistics()
+            self.assertGreater(statistics['num_tiles'], 0)
+            self.assertEqual(len(os.listdir(directory)), statistics['num_tiles'])
+            # the changes of the spilled chunks are kept
+            self.assertEqual(len(chunked.pop_changes()['keys']), len(expected.to_arrays()['keys']))
+            # a spilled chunk is loaded again when it is touched
+            self.assertEqual(chunked.get_probability((40, 20, 0)), expected.get_probability((40, 20, 0)))
+            self.assertEqual(Test_PrunePolicy.get_leafs(self, chunked.get_chunk((0, 0, 0))),
+                             Test_PrunePolicy.get_leafs(self, expected.get_chunk((0, 0, 0))))
+            # the tile of the loaded chunk is kept, it is only written again if the chunk changes
+            self.assertEqual(len(os.listdir(directory)), statistics['num_tiles'])
+            self.assertEqual(chunked.get_statistics()['tile_writes'], statistics['tile_writes'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, eviction='forget')
+
+
+class Test_TileStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create(self, max_resident_chunks: int):
+        return ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, tile_store=TileStore(self.directory.name),
+                               max_resident_chunks=max_resident_chunks)
+
+    def test_store(self):
+        store = TileStore(self.directory.name)
+        self.assertIsNone(store.read((0, 0, 0)))
+        store.write((-1, 2, 0), b'tile' * 100)
+        self.assertIn((-1, 2, 0), store)
+        self.assertEqual(store.read((-1, 2, 0)), b'tile' * 100)
+        self.assertLess(store.get_statistics()['tile_bytes_written'], 400)
+        # a new store finds the tiles of the directory
+        self.assertEqual(TileStore(self.directory.name).keys(), [(-1, 2, 0)])
+        store.delete((-1, 2, 0))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_bounded_resident_chunks(self):
+        chunked = self.create(max_resident_chunks=2)
+        expected = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        for octotree in (chunked, expected):
+            Test_RollingMap.fly(self, octotree, 6)
+        statistics = chunked.get_statistics()
+        self.assertEqual(statistics['num_chunks'], 2)
+        self.assertEqual(statistics['num_tiles'], 4)
+        # chunks which left memory are loaded again by queries and by insertions
+        width = chunked.chunk_width
+        for index in range(6):
+            point = (index * width + 40, 20, 0)
+            self.assertEqual(chunked.get_probability(point), expected.get_probability(point))
+        chunked.insert_point((40, 20, 0))
+        expected.insert_point((40, 20, 0))
+        self.assertEqual(chunked.get_probability((40, 20, 0)), expected.get_probability((40, 20, 0)))
+        self.assertEqual(chunked.get_statistics()['num_chunks'], 2)
+
+    def test_region_queries_load_stored_chunks(self):
+        chunked = self.create(max_resident_chunks=2)
+        expected = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        for octotree in (chunked, expected):
+            Test_RollingMap.fly(self, octotree, 6)
+        width = chunked.chunk_width
+        # the box and the sphere cover all six chunks, four of them are only in the tile store
+        bbox_min, bbox_max, center = (-width, -width, -width), (6 * width, width, width), (3 * width, 0, 0)
+        rows = Test_Query.rows
+        for state in (None, STATE_OCCUPIED):
+            self.assertEqual(rows(chunked.query_box(bbox_min, bbox_max, state)),
+                             rows(expected.query_box(bbox_min, bbox_max, state)))
+            self.assertEqual(rows(chunked.query_radius(center, 4 * width, state)),
+                             rows(expected.query_radius(center, 4 * width, state)))
+            self.assertEqual(sorted((key, depth) for key, depth, _ in chunked.iter_box(bbox_min, bbox_max, state)),
+                             rows(expected.query_box(bbox_min, bbox_max, state)))
+        self.assertEqual(len(rows(expected.query_box(bbox_min, bbox_max, STATE_OCCUPIED))), 12)
+        self.assertEqual(chunked.get_statistics()['num_chunks'], 2)
+        # the wall in the first chunk has left memory, a collision check still finds it
+        chunked.get_probability((5 * width + 40, 20, 0))
+        self.assertNotIn((0, 0, 0), chunked.get_chunk_keys())
+        self.assertTrue(chunked.any_occupied((30, 10, -10), (50, 30, 10)))
+
+    def test_write_back_only_dirty_chunks(self):
+        chunked = self.create(max_resident_chunks=1)
+        width = chunked.chunk_width
+        chunked.insert_point((0, 0, 0))
+        chunked.insert_point((width, 0, 0))
+        self.assertEqual(chunked.get_statistics()['tile_writes'], 1)
+        # reading a chunk does not make it dirty, the chunk it replaces is dirty
+        chunked.get_probability((0, 0, 0))
+        self.assertEqual(chunked.get_statistics()['tile_writes'], 2)
+        chunked.get_probability((width, 0, 0))
+        self.assertEqual(chunked.get_statistics()['tile_writes'], 2)
+
+    def test_reopen(self):
+        chunked = self.create(max_resident_chunks=2)
+        Test_RollingMap.fly(self, chunked, 4)
+        self.assertEqual(chunked.flush(), 2)
+        self.assertEqual(chunked.flush(), 0)
+        reopened = self.create(max_resident_chunks=2)
+        self.assertEqual(reopened.num_chunks, 0)
+        width = chunked.chunk_width
+        for index in range(4):
+            point = (index * width + 40, 20, 0)
+            self.assertEqual(reopened.get_probability(point), chunked.get_probability(point))
+            self.assertGreater(reopened.get_probability(point), 0.5)
+
+
+class Test_ParallelBuilder(unittest.TestCase):
+    # repeated scans clamp and prune voxels, the random rays cross the partitions
+    scan_list = Test_PrunePolicy.scan_list * 4 + \
+                [((0, 0, 0), end_points.tolist()) for end_points in np.random.default_rng(0).uniform(-120, 120, (8, 4, 3))]
+
+    def build_serial(self, **options):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, **options)
+        octotree.insert_scan_list(self.scan_list)
+        if octotree.get_prune_policy() == 'deferred':
+            octotree.prune()
+        return octotree
+
+    def test_identical_to_serial_build(self):
+        for options in ({}, {'backend': 'array'}, {'prune_policy': 'off'}, {'prune_policy': 'deferred'},
+                        {'inner_occupancy': 'mean'}, {'backend': 'array', 'log_odds_storage': 'int16'}):
+            expected = self.build_serial(**options).to_bytes(log_odds=True)
+            for partition_depth in (0, 1, 2):
+                octotree = build_octotree(self.scan_list, 1, partition_depth, **options)
+                self.assertEqual(octotree.to_bytes(log_odds=True), expected, (options, partition_depth))
+
+    def test_worker_processes(self):
+        timings = {}
+        octotree = build_octotree(self.scan_list, 3, timings=timings)
+        self.assertEqual(len(timings['workers']), 3)
+        self.assertEqual(octotree.to_bytes(log_odds=True), self.build_serial().to_bytes(log_odds=True))
+        # the merged tree can be updated further
+        octotree.insert_scan((2, 3, 0), [(-30, -30, 30)])
+        self.assertGreater(octotree.get_probability((-30, -30, 30)), 0.5)
+
+    def test_scan_updates(self):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        origin, end_points = self.scan_list[-1]
+        scans, keys, occupied = get_scan_updates([(origin, end_points)], octotree.origin, TREE_RESOLUTION,
+                                                 1 << TREE_MAX_DEPTH)
+        free_keys, occupied_keys = octotree.compute_update(origin, end_points)
+        self.assertEqual(set(map(tuple, keys[occupied].tolist())), set(occupied_keys))
+        self.assertEqual(set(map(tuple, keys[~occupied].tolist())), set(free_keys))
+        self.assertEqual(scans.tolist(), [0] * len(keys))
+
+    def test_empty_and_invalid(self):
+        self.assertEqual(build_octotree([], 2).get_leaf_node_list(), [])
+        with self.assertRaises(ValueError):
+            build_octotree(self.scan_list, 1, TREE_MAX_DEPTH + 1)
+
+
+class Test_Merge(unittest.TestCase):
+    def build(self, scan_list, **options):
+        octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, **options)
+        octotree.insert_scan_list(scan_list)
+        return octotree
+
+    def assert_counters(self, octotree):
+        loaded = OctoTree.from_bytes(octotree.to_bytes(log_odds=True))
+        for name in ('nodes_per_depth', 'num_leafs', 'num_inner', 'num_occupied', 'num_free'):
+            self.assertEqual(octotree.get_statistics()[name], loaded.get_statistics()[name], name)
+
+    def test_merge_into_empty_tree(self):
+        for backend in ('object', 'array'):
+            for policy in ('sum', 'max_confidence'):
+                source = self.build(Test_PrunePolicy.scan_list, backend=backend)
+                merged = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend)
+                self.assertTrue(merged.merge(source, policy))
+                self.assertEqual(merged.to_bytes(log_odds=True), source.to_bytes(log_odds=True))
+                self.assert_counters(merged)
+
+    def test_policies(self):
+        hit = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        hit.insert_point((30, 30, 30))
+        miss = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        miss.insert_scan((2, 30, 30), [(60, 30, 30)])
+        summed = OctoTree.from_bytes(hit.to_bytes(log_odds=True))
+        summed.merge(miss, 'sum')
+        self.assertAlmostEqual(summed.get_probability((30, 30, 30)), 1 / (1 + math.exp(-(HIT_LOGODDS + MISS_LOGODDS))))
+        self.assertEqual(summed.get_probability((10, 30, 30)), miss.get_probability((10, 30, 30)))
+        confident = OctoTree.from_bytes(hit.to_bytes(log_odds=True))
+        confident.merge(miss, 'max_confidence')
+        self.assertEqual(confident.get_probability((30, 30, 30)), hit.get_probability((30, 30, 30)))
+        # the uncertain voxel of the sum is less confident than the occupied voxel
+        summed.merge(hit, 'max_confidence')
+        self.assertEqual(summed.get_probability((30, 30, 30)), hit.get_probability((30, 30, 30)))
+        self.assert_counters(summed)
+        with self.assertRaises(ValueError):
+            summed.merge(miss, 'min')
+
+    def test_identical_clamped_trees(self):
+        octotree = self.build(Test_PrunePolicy.scan_list[:4])
+        expected = octotree.to_bytes(log_odds=True)
+        self.assertFalse(octotree.merge(self.build(Test_PrunePolicy.scan_list[:4])))
+        self.assertEqual(octotree.to_bytes(log_odds=True), expected)
+
+    def test_shifted_grid(self):
+        shift = (3 * TREE_RESOLUTION, -5 * TREE_RESOLUTION, 0)
+        other = OctoTree(shift, TREE_RESOLUTION, TREE_MAX_DEPTH - 1)
+        other.insert_scan(shift, [(shift[0] + 40, shift[1], shift[2])])
+        octotree = self.build(Test_PrunePolicy.scan_list)
+        octotree.merge(other)
+        copy = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        copy.merge(other)
+        for key, _, node in other.iter_leafs():
+            point = other.key_to_coord(key)
+            self.assertEqual(copy.get_probability(point), node.probability)
+            self.assertNotEqual(octotree.get_probability(point), 0.5)
+        self.assertGreater(octotree.get_probability((shift[0] + 40, shift[1], shift[2])), 0.5)
+        self.assert_counters(octotree)
+        with self.assertRaises(ValueError):
+            octotree.merge(OctoTree((1, 0, 0), TREE_RESOLUTION, TREE_MAX_DEPTH))
+        with self.assertRaises(ValueError):
+            octotree.merge(OctoTree(TREE_CENTER, TREE_RESOLUTION * 2, TREE_MAX_DEPTH))
+
+
+class Test_Diff(unittest.TestCase):
+    def setUp(self):
+        self.octotree = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        self.octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+
+    def copy(self):
+        return OctoTree.from_bytes(self.octotree.to_bytes(log_odds=True))
+
+    def test_identical(self):
+        diff = self.octotree.diff(self.copy())
+        self.assertEqual(len(diff['keys']), 0)
+        self.assertEqual(diff['keys'].shape, (0, 3))
+
+    def test_added_removed_changed(self):
+        newer = self.copy()
+        newer.insert_point((-40, -40, 40))
+        # a free voxel needs two hits to become occupied
+        newer.insert_point((-60, 0, 0))
+        newer.insert_point((-60, 0, 0))
+        diff = self.octotree.diff(newer)
+        self.assertEqual(sorted(map(tuple, diff['keys'].tolist())),
+                         sorted([newer.coord_to_key((-40, -40, 40)), newer.coord_to_key((-60, 0, 0))]))
+        self.assertEqual(diff['depth'].tolist(), [TREE_MAX_DEPTH] * 2)
+        self.assertEqual(diff['new_state'].tolist(), [STATE_OCCUPIED] * 2)
+        self.assertEqual(sorted(diff['added'].tolist()), [False, True])
+        self.assertEqual(sorted(diff['changed'].tolist()), [False, True])
+        # the other way round the new voxel is removed
+        reverse = newer.diff(self.octotree)
+        self.assertEqual(reverse['removed'].sum(), 1)
+        self.assertEqual(reverse['keys'].tolist(), diff['keys'].tolist())
+        self.assertEqual(reverse['old_state'].tolist(), diff['new_state'].tolist())
+
+    def test_pruned_region(self):
+        older = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        newer = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        # a free slab pruned into large leafs, the newer map sees an obstacle inside it
+        for octotree in (older, newer):
+            octotree.insert_scan_list([((x, -100, z), [(x, 100, z)]) for x in range(-126, 128, 4) for z in (2, 6)])
+        newer.insert_point((2, 50, 2))
+        newer.insert_point((2, 50, 2))
+        diff = older.diff(newer)
+        self.assertEqual(list(map(tuple, diff['keys'].tolist())), [newer.coord_to_key((2, 50, 2))])
+        self.assertEqual((diff['old_state'].tolist(), diff['new_state'].tolist()), ([STATE_FREE], [STATE_OCCUPIED]))
+        # a pruned region unknown before is added as one region with its depth
+        empty = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+        added = empty.diff(older)
+        self.assertTrue(np.all(added['added']))
+        self.assertLess(added['depth'].min(), TREE_MAX_DEPTH)
+        self.assertEqual(len(added['keys']), len(older.to_arrays()['keys']))
+
+    def test_checkpoints(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for counter, octotree in ((1.0, self.octotree), (2.0, self.copy())):
+                if counter == 2.0:
+                    octotree.insert_point((-40, -40, 40))
+                occu_node_coor_list, free_node_coor_list = get_classified_node_coor_list(octotree.to_arrays())
+                pd.DataFrame(occu_node_coor_list).to_csv(os.path.join(directory, 'occu_node_coor_list{}.csv'.format(counter)))
+                pd.DataFrame(free_node_coor_list).to_csv(os.path.join(directory, 'free_node_coor_list{}.csv'.format(counter)))
+            diff = import_checkpoint(1.0, directory).diff(import_checkpoint(2.0, directory))
+            self.assertEqual(diff['origins'].tolist(), [list(self.octotree.key_to_coord(self.octotree.coord_to_key((-40, -40, 40))))])
+
+    def test_different_grids(self):
+        with self.assertRaises(ValueError):
+            self.octotree.diff(OctoTree((4, 0, 0), TREE_RESOLUTION, TREE_MAX_DEPTH))
+
+
+
+class Test_Query(unittest.TestCase):
+    def setUp(self):
+        self.octotrees = [OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend=backend)
+                          for backend in ('object', 'array')]
+        for octotree in self.octotrees:
+            octotree.insert_scan_list(Test_PrunePolicy.scan_list)
+
+    def expected(self, octotree, overlaps, state=None):
+        # brute force over all known leafs, a leaf covers key ... key+size
+        arrays = octotree.to_arrays()
+        size = (1 << (TREE_MAX_DEPTH - arrays['depth']))[:, None]
+        selected = overlaps(arrays['keys'], size)
+        if state is not None:
+            selected &= arrays['state'] == state
+        return sorted(zip(map(tuple, arrays['keys'][selected].tolist()), arrays['depth'][selected].tolist()))
+
+    @staticmethod
+    def rows(arrays):
+        return sorted(zip(map(tuple, arrays['keys'].tolist()), arrays['depth'].tolist()))
+
+    def test_box_matches_brute_force(self):
+        bbox_min, bbox_max = (40, -10, -5), (70, 12, 8)
+        for octotree in self.octotrees:
+            key_min, key_max = np.array(octotree.coord_to_key(bbox_min)), np.array(octotree.coord_to_key(bbox_max))
+            for state in (None, STATE_FREE, STATE_OCCUPIED):
+                expected = self.expected(octotree, lambda keys, size: np.all((keys <= key_max) & (keys + size > key_min),
+                                                                             axis=1), state)
+                self.assertGreater(len(expected), 0)
+                arrays = octotree.query_box(bbox_min, bbox_max, state)
+                self.assertEqual(self.rows(arrays), expected)
+                self.assertEqual(sorted((key, depth) for key, depth, _ in octotree.iter_box(bbox_min, bbox_max, state)),
+                                 expected)
+                self.assertTrue(np.array_equal(arrays['coords'], octotree.origin + arrays['keys'] * TREE_RESOLUTION))
+
+    def test_radius_matches_brute_force(self):
+        center, radius = (58, 3, 2), 9.5
+        for octotree in self.octotrees:
+            key_center = (np.array(center) - octotree.origin) / TREE_RESOLUTION
+            for state in (None, STATE_FREE, STATE_OCCUPIED):
+                expected = self.expected(octotree, lambda keys, size: np.sum(
+                    np.maximum(np.maximum(keys - key_center, key_center - keys - size), 0) ** 2, axis=1)
+                    <= (radius / TREE_RESOLUTION) ** 2, state)
+                self.assertGreater(len(expected), 0)
+                self.assertEqual(self.rows(octotree.query_radius(center, radius, state)), expected)
+                self.assertEqual(sorted((key, depth) for key, depth, _ in octotree.iter_radius(center, radius, state)),
+                                 expected)
+
+    def test_lazy_and_outside(self):
+        leafs = self.octotrees[0].iter_box((-200, -200, -200), (200, 200, 200))
+        key, depth, node = next(leafs)
+        self.assertTrue(node.is_leaf())
+        for octotree in self.octotrees:
+            self.assertEqual(len(octotree.query_box((500, 500, 500), (600, 600, 600))['keys']), 0)
+            self.assertEqual(octotree.query_radius((0, 0, 0), 1000)['keys'].shape, (len(octotree.to_arrays()['keys']), 3))
+
+    def test_chunked(self):
+        chunked = ChunkedOctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, backend='array')
+        width = chunked.chunk_width
+        chunked.insert_scan((0, 0, 0), [(2.5 * width, 2, 2), (-1.5 * width, -2, 2)])
+        arrays = chunked.query_box((2 * width, 0, 0), (3 * width, 4, 4), STATE_OCCUPIED)
+        self.assertEqual(list(map(tuple, arrays['keys'].tolist())), [chunked.coord_to_key((2.5 * width, 2, 2))])
+        occupied = [key for key, _, _ in chunked.iter_radius((-1.5 * width, -2, 2), 2, STATE_OCCUPIED)]
+        self.assertEqual(occupied, [chunked.coord_to_key((-1.5 * width, -2, 2))])
+        self.assertEqual(len(chunked.query_radius((0, 0, 0), 4 * width)['keys']), len(chunked.to_arrays()['keys']))
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,336 @@
+from array import array
+
+import math
+
+import numpy as np
+
+from Config import DEFAULT_LOGODDS, POOL_INITIAL_CAPACITY, FREE_LOGODDS, OCCUPANCY_LOGODDS, HIT_LOGODDS, MISS_LOGODDS
+from Config import LOG_ODDS_STORAGE, LOG_ODDS_STORAGES, LOG_ODDS_SCALES
+from OctoNode import OctoNode
+
+NO_CHILDREN = -1
+# array typecode of the logodds buffer for each storage, numpy uses the same codes
+LOG_ODDS_TYPECODES = {'float': 'd', 'int16': 'h', 'int8': 'b'}
+
+class OctoNodePool:
+    """
+    Array-backed storage for the nodes of an OctoTree.
+    Every node is a slot in a set of flat buffers instead of a Python object,
+    the 8 children of a node always occupy 8 consecutive slots (a block).
+    Blocks released by pruning are kept in a free list and reused by the next split.
+    With a fixed-point storage the logodds buffer holds integers in units of 1 / scale,
+    the buffers keep the stored values and encode/decode convert them from/to logodds.
+    """
+
+    def __init__(self, capacity: int = POOL_INITIAL_CAPACITY, storage: str = LOG_ODDS_STORAGE):
+        """
+        Create a new pool with the root node in slot 0.
+
+        Args:
+            capacity: number of preallocated slots --- int
+            storage: type of the logodds, 'float', 'int16' or 'int8' --- str
+        """
+        if storage not in LOG_ODDS_STORAGES:
+            raise ValueError("Unknown logodds storage '{}', expected one of {}".format(storage, LOG_ODDS_STORAGES))
+        self.storage = storage
+        self.scale = LOG_ODDS_SCALES.get(storage)
+        self.typecode = LOG_ODDS_TYPECODES[storage]
+        self._init_fixed_point()
+
+        capacity = max(capacity, 1)
+        self.log_odds = array(self.typecode, [self.default]) * capacity
+        self.leaf = array('b', [0]) * capacity
+        self.first_child = array('i', [NO_CHILDREN]) * capacity
+        self._size = 1
+        self._free_blocks = []
+
+    def _init_fixed_point(self):
+        """
+        Stored values of the thresholds and increments, and the probability of each fixed-point value.
+        """
+        self.default = self.encode(DEFAULT_LOGODDS)
+        self.free = self.encode(FREE_LOGODDS)
+        self.occupied = self.encode(OCCUPANCY_LOGODDS)
+        self.increments = {diff_logodds: self.encode(diff_logodds) for diff_logodds in (HIT_LOGODDS, MISS_LOGODDS)}
+        self.probabilities = None
+        if self.scale is None:
+            return
+        for name, log_odds in (('DEFAULT_LOGODDS', DEFAULT_LOGODDS), ('FREE_LOGODDS', FREE_LOGODDS),
+                               ('OCCUPANCY_LOGODDS', OCCUPANCY_LOGODDS), ('HIT_LOGODDS', HIT_LOGODDS),
+                               ('MISS_LOGODDS', MISS_LOGODDS)):
+            if self.decode(self.encode(log_odds)) != log_odds:
+                raise ValueError("{} is not a multiple of 1/{}, it can not be stored as {}".format(
+                    name, self.scale, self.storage))
+        info = np.iinfo(self.typecode)
+        if self.free < info.min or self.occupied > info.max:
+            raise ValueError("The thresholds exceed the range of {} with the scale {}".format(self.storage, self.scale))
+        # logodds are clamped, every value of a node lies between the thresholds
+        odds = [math.pow(math.e, self.decode(value)) for value in range(self.free, self.occupied + 1)]
+        self.probabilities = [value / (value + 1) for value in odds]
+
+    def encode(self, log_odds: float):
+        """
+        Returns:
+            the stored value of the logodds --- float or int
+        """
+        if self.scale is None:
+            return log_odds
+        return int(round(log_odds * self.scale))
+
+    def decode(self, value):
+        """
+        Returns:
+            the logodds of a stored value --- float
+        """
+        if self.scale is None:
+            return value
+        return value / self.scale
+
+    def get_log_odds_array(self, slots: np.ndarray = None):
+        """
+        Returns:
+            the logodds of the given slots (all slots if None), a copy of the buffer --- ndarray of float64
+        """
+        values = np.frombuffer(self.log_odds, dtype=self.typecode)
+        values = values[:self._size] if slots is None else values[slots]
+        if self.scale is None:
+            return values.copy()
+        return values / self.scale
+
+    @classmethod
+    def from_arrays(cls, log_odds, leaf, first_child, storage: str = LOG_ODDS_STORAGE):
+        """
+        Create a pool holding the given nodes, e.g. nodes loaded from a file.
+        Slot 0 is the root and the children of every node must be a block of 8 consecutive slots.
+
+        Args:
+            log_odds: logodds of each slot --- ndarray of float64
+            leaf: whether each slot is a leaf --- ndarray of int8
+            first_child: slot of the first child of each slot, NO_CHILDREN for nodes without children --- ndarray of int32
+            storage: type of the logodds, 'float', 'int16' or 'int8' --- str
+        Returns:
+            a pool without free blocks --- OctoNodePool
+        """
+        pool = cls(capacity=1, storage=storage)
+        values = np.asarray(log_odds, dtype=np.float64)
+        if pool.scale is not None:
+            values = np.clip(np.round(values * pool.scale), pool.free, pool.occupied)
+        pool.log_odds = array(pool.typecode, values.astype(pool.typecode).tobytes())
+        pool.leaf = array('b', leaf.astype(np.int8, copy=False).tobytes())
+        pool.first_child = array('i', first_child.astype(np.intc, copy=False).tobytes())
+        pool._size = len(pool.log_odds)
+        return pool
+
+    @property
+    def capacity(self):
+        """
+        Returns:
+            number of allocated slots --- int
+        """
+        return len(self.log_odds)
+
+    @property
+    def num_slots(self):
+        """
+        Returns:
+            number of slots in use (root and all blocks which are not free) --- int
+        """
+        return self._size - 8 * len(self._free_blocks)
+
+    @property
+    def nbytes(self):
+        """
+        Returns:
+            size of the node buffers in bytes --- int
+        """
+        return sum(buffer.itemsize * len(buffer) for buffer in (self.log_odds, self.leaf, self.first_child))
+
+    def get_root(self):
+        """
+        Returns:
+            handle of the root node --- PoolNode
+        """
+        return PoolNode(self, 0)
+
+    def allocate_block(self):
+        """
+        Allocate 8 consecutive slots for the children of a node.
+        A block released by pruning is reused before the buffers grow.
+
+        Returns:
+            the slot of the first child --- int
+        """
+        if self._free_blocks:
+            first = self._free_blocks.pop()
+        else:
+            first = self._size
+            if first + 8 > self.capacity:
+                self._grow(first + 8)
+            self._size += 8
+
+        for slot in range(first, first + 8):
+            self.log_odds[slot] = self.default
+            self.leaf[slot] = 0
+            self.first_child[slot] = NO_CHILDREN
+        return first
+
+    def release_block(self, first: int):
+        """
+        Return the block starting at 'first' (and all blocks below it) to the free list.
+
+        Args:
+            first: the slot of the first child --- int
+        """
+        for slot in range(first, first + 8):
+            if self.first_child[slot] != NO_CHILDREN:
+                self.release_block(self.first_child[slot])
+                self.first_child[slot] = NO_CHILDREN
+        self._free_blocks.append(first)
+
+    def _grow(self, min_capacity: int):
+        """
+        Double the buffers until they hold at least 'min_capacity' slots.
+        """
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        extra = capacity - self.capacity
+        self.log_odds.extend(array(self.typecode, [self.default]) * extra)
+        self.leaf.extend(array('b', [0]) * extra)
+        self.first_child.extend(array('i', [NO_CHILDREN]) * extra)
+
+
+class PoolNode(OctoNode):
+    """
+    Lightweight handle on a slot of an OctoNodePool.
+    It exposes the storage of the slot under the attribute names used by OctoNode,
+    so the node algorithms of OctoNode run unchanged on the array backend.
+    """
+    __slots__ = ('_pool', '_slot')
+
+    def __init__(self, pool: OctoNodePool, slot: int):
+        self._pool = pool
+        self._slot = slot
+
+    @property
+    def _log_odds(self):
+        return self._pool.decode(self._pool.log_odds[self._slot])
+
+    @_log_odds.setter
+    def _log_odds(self, value):
+        self._pool.log_odds[self._slot] = self._pool.encode(value)
+
+    @property
+    def probability(self):
+        """
+        Returns:
+            occupancy probability of node, from the lookup table of a fixed-point pool --- float
+        """
+        pool = self._pool
+        if pool.probabilities is None:
+            return OctoNode.probability.fget(self)
+        return pool.probabilities[pool.log_odds[self._slot] - pool.free]
+
+    @property
+    def _is_leaf(self):
+        return self._pool.leaf[self._slot] == 1
+
+    @_is_leaf.setter
+    def _is_leaf(self, value):
+        self._pool.leaf[self._slot] = 1 if value else 0
+
+    @property
+    def _children(self):
+        first = self._pool.first_child[self._slot]
+        if first == NO_CHILDREN:
+            return ()
+        return tuple(PoolNode(self._pool, slot) for slot in range(first, first + 8))
+
+    def has_children(self):
+        """
+        Returns:
+            whether this is a leaf node --- bool
+        """
+        return self._pool.first_child[self._slot] != NO_CHILDREN
+
+    def get_child(self, index: int):
+        """
+        Returns:
+            node's child with the given index --- PoolNode
+        """
+        return PoolNode(self._pool, self._pool.first_child[self._slot] + index)
+
+    def _check_children_logodds(self):
+        """
+        Returns:
+            whether the logodds of all children are the same and arrive thresholds --- bool
+        """
+        first = self._pool.first_child[self._slot]
+        if first == NO_CHILDREN:
+            return True
+        log_odds = self._pool.log_odds[first]
+        if log_odds != self._pool.free and log_odds != self._pool.occupied:
+            return False
+        return self._pool.log_odds[first:first + 8].count(log_odds) == 8 and \
+               self._pool.first_child[first:first + 8].count(NO_CHILDREN) == 8
+
+    def _update_inner_occupancy(self, mode: str = 'max'):
+        """
+        Sets the logodds of an inner node to the maximum (or mean) logodds of its known children.
+
+        Args:
+            mode: 'max' or 'mean' --- str
+        """
+        pool = self._pool
+        first = pool.first_child[self._slot]
+        values = [pool.log_odds[slot] for slot in range(first, first + 8)
+                  if pool.leaf[slot] or pool.first_child[slot] != NO_CHILDREN]
+        if values:
+            pool.log_odds[self._slot] = max(values) if mode == 'max' else pool.encode(pool.decode(sum(values)) / len(values))
+
+    def _update_logodds(self, diff_logodds):
+        """
+        Updates the occupancy probability in logodds of the leaf node, in stored units.
+
+        Args:
+            diff_logodds: the difference value of logodds --- float
+        """
+        pool = self._pool
+        increment = pool.increments.get(diff_logodds)
+        if increment is None:
+            increment = pool.encode(diff_logodds)
+        value = pool.log_odds[self._slot] + increment
+        pool.log_odds[self._slot] = pool.occupied if value >= pool.occupied else pool.free if value <= pool.free else value
+
+    def _split(self):
+        """
+        Splits the node into 8 child nodes taken from the pool.
+        Child nodes are given the occupancy probability of this parent node as the initial probability
+        """
+        pool = self._pool
+        first = pool.allocate_block()
+        pool.first_child[self._slot] = first
+        if pool.leaf[self._slot]:
+            # a pruned leaf hands its value down to the children and keeps it as occupancy summary
+            pool.log_odds[first:first + 8] = array(pool.typecode, [pool.log_odds[self._slot]]) * 8
+            pool.leaf[first:first + 8] = array('b', [1]) * 8
+            pool.leaf[self._slot] = 0
+
+    def _prune(self):
+        """
+        Prune own children and give their slots back to the pool.
+        """
+        first = self._pool.first_child[self._slot]
+        self._pool.log_odds[self._slot] = self._pool.log_odds[first]
+        self._pool.first_child[self._slot] = NO_CHILDREN
+        self._pool.release_block(first)
+        self._is_leaf = True
+
+    def _collapse(self):
+        """
+        Drop all descendants and give their slots back to the pool, the node keeps its occupancy summary as a leaf.
+        """
+        first = self._pool.first_child[self._slot]
+        self._pool.first_child[self._slot] = NO_CHILDREN
+        self._pool.release_block(first)
+        self._is_leaf = True
@@ -1,15 +1,31 @@
 import math
+from collections import deque, OrderedDict
 
-from Config import HIT_LOGODDS, MISS_LOGODDS
+import numpy as np
+
+from Config import HIT_LOGODDS, MISS_LOGODDS, OCCUPANCY_LOGODDS, TREE_BACKEND, TREE_BACKENDS
+from Config import PRUNE_POLICY, PRUNE_POLICIES, PRUNE_INTERVAL, INNER_OCCUPANCY, INNER_OCCUPANCY_MODES
+from Config import DEFAULT_LOGODDS, SAVE_LOG_ODDS, RAY_CACHE_SIZE, LOG_ODDS_STORAGE, LOG_ODDS_STORAGES
+from Config import FREE_LOGODDS, TRACK_CHANGES, STATE_UNKNOWN, STATE_FREE, STATE_OCCUPIED, STATE_UNCERTAIN
+from Config import MERGE_POLICY, MERGE_POLICIES
 from OctoNode import OctoNode
-from MapUtil import bresenham3D, export_known_voxel
+from OctoNodePool import OctoNodePool, NO_CHILDREN
+from OctoTreeFile import write_tree_file, read_tree_file, pack_tree, unpack_tree, CODE_UNKNOWN, CODE_FREE, CODE_OCCUPIED, CODE_INNER
+from TreeStatistics import TreeStatistics
+from MapUtil import compute_ray_keys, cast_rays, truncate_rays, export_known_voxel
+
+# key offset of each child index in units of the child width
+CHILD_OFFSETS = np.array([[index & 1, (index >> 1) & 1, (index >> 2) & 1] for index in range(8)], dtype=np.int64)
 
 class OctoTree:
     """
     OctoMap to store 3D probabilistic occupancy information.
     """
 
-    def __init__(self, center: tuple, resolution: int, max_depth: int):
+    def __init__(self, center: tuple, resolution: int, max_depth: int, backend: str = TREE_BACKEND,
+                 prune_policy: str = PRUNE_POLICY, inner_occupancy: str = INNER_OCCUPANCY,
+                 track_changes: bool = TRACK_CHANGES, ray_cache_size: int = RAY_CACHE_SIZE,
+                 log_odds_storage: str = LOG_ODDS_STORAGE):
         """
         Create a new OctoMap.
         The map will be created around the 'center' position.
@@ -18,6 +34,12 @@ class OctoTree:
             center: the coordinate of the center --- (x,y,z): tuple
             resolution: maximal resolution --- int
             max_depth: maximun depth --- int
+            backend: storage engine of the nodes, 'object' or 'array' --- str
+            prune_policy: when children are pruned, 'eager', 'deferred' or 'off' --- str
+            inner_occupancy: logodds summary of the children kept by inner nodes, 'max' or 'mean' --- str
+            track_changes: whether voxels whose state changes are recorded, see pop_changes --- bool
+            ray_cache_size: number of saturated rays remembered to skip their repetitions, 0 disables the cache --- int
+            log_odds_storage: type of the stored logodds, 'float' or the fixed-point 'int16'/'int8' of the array backend --- str
         
         Returns:
             a new OctoTree Map --- OctoTree
@@ -27,8 +49,54 @@ class OctoTree:
         self._resolution = resolution
         self._max_depth = max_depth
 
-        self._root = OctoNode()
-        
+        if backend not in TREE_BACKENDS:
+            raise ValueError("Unknown tree backend '{}', expected one of {}".format(backend, TREE_BACKENDS))
+        self._backend = backend
+        if log_odds_storage not in LOG_ODDS_STORAGES:
+            raise ValueError("Unknown logodds storage '{}', expected one of {}".format(log_odds_storage, LOG_ODDS_STORAGES))
+        if log_odds_storage != 'float' and backend != 'array':
+            raise ValueError("Fixed-point logodds '{}' need the array backend".format(log_odds_storage))
+        self._log_odds_storage = log_odds_storage
+        self._pool = None
+        if backend == 'array':
+            self._pool = OctoNodePool(storage=log_odds_storage)
+            self._root = self._pool.get_root()
+        else:
+            self._root = OctoNode()
+
+        self._statistics = TreeStatistics(max_depth)
+
+        if prune_policy not in PRUNE_POLICIES:
+            raise ValueError("Unknown prune policy '{}', expected one of {}".format(prune_policy, PRUNE_POLICIES))
+        self._prune_policy = prune_policy
+        # keys of the parents of updated leafs (at depth max_depth - 1) waiting for a deferred pruning pass
+        self._dirty_keys = set()
+        # whether pruning has to visit the whole tree, e.g. after expand
+        self._prune_all = False
+        self._num_scans = 0
+
+        if inner_occupancy not in INNER_OCCUPANCY_MODES:
+            raise ValueError("Unknown inner occupancy '{}', expected one of {}".format(inner_occupancy, INNER_OCCUPANCY_MODES))
+        self._inner_occupancy = inner_occupancy
+
+        # voxel key -> (state at the last checkpoint, current state), None if changes are not tracked
+        self._changes = None
+        self._change_callbacks = []
+        self.enable_change_tracking(track_changes)
+
+        # (start point, end point, is hit) -> saturation version at which applying the ray changed nothing
+        self._ray_cache = OrderedDict() if ray_cache_size > 0 else None
+        self._ray_cache_size = ray_cache_size
+        self._ray_cache_hits = 0
+        self._ray_cache_misses = 0
+        # incremented whenever a clamped voxel changes, only then a saturated ray can change the map again
+        self._saturation_version = 0
+
+        # the shape of the tree never changes, so it is computed only once
+        self._key_range: int = 1 << max_depth
+        self._radius: int = resolution * (self._key_range >> 1)
+        self._width: int = resolution * self._key_range
+        self._origin: tuple = (center[0] - self._radius, center[1] - self._radius, center[2] - self._radius)
 
     @property
     def radius(self):
@@ -36,9 +104,7 @@ class OctoTree:
         Returns:
             the radius of this tree (also width/2) --- int
         """
-        radius: int = self._resolution * int(math.pow(2, self._max_depth - 1))
-
-        return radius
+        return self._radius
     
     @property
     def width(self):
@@ -46,9 +112,7 @@ class OctoTree:
         Returns:
             the width of this tree --- int
         """
-        width: int = int(self._resolution * math.pow(2, self._max_depth))
-
-        return width
+        return self._width
     
     @property
     def origin(self):
@@ -56,10 +120,194 @@ class OctoTree:
         Returns:
             the origin coordinate of this tree --- (x,y,z): tuple
         """
-        origin: tuple = (self._center[0] - self.radius, self._center[1] - self.radius, self._center[2] - self.radius)
-        
-        return origin
-    
+        return self._origin
+
+    def coord_to_key(self, point: tuple):
+        """
+        Convert a coordinate into the integer key of the voxel containing it.
+        Each component of the key is the index of the voxel along that axis, from 0 to 2^max_depth - 1,
+        bit (max_depth - 1 - depth) of the key selects the child at the given depth.
+
+        Args:
+            point: the coordinate to convert --- (x,y,z): tuple
+        Returns:
+            the voxel key, None if the point is not contained in this tree --- (kx,ky,kz): tuple
+        """
+        key_x = math.floor((point[0] - self._origin[0]) / self._resolution)
+        key_y = math.floor((point[1] - self._origin[1]) / self._resolution)
+        key_z = math.floor((point[2] - self._origin[2]) / self._resolution)
+        key_range = self._key_range
+        if 0 <= key_x < key_range and 0 <= key_y < key_range and 0 <= key_z < key_range:
+            return (key_x, key_y, key_z)
+        return None
+
+    def key_to_coord(self, key: tuple):
+        """
+        Convert a voxel key into the coordinate of the voxel origin.
+
+        Args:
+            key: the voxel key --- (kx,ky,kz): tuple
+        Returns:
+            the origin coordinate of the voxel --- (x,y,z): tuple
+        """
+        return (self._origin[0] + key[0] * self._resolution,
+                self._origin[1] + key[1] * self._resolution,
+                self._origin[2] + key[2] * self._resolution)
+
+    def _update_key(self, key: tuple, diff_logodds: float):
+        """
+        Update the leaf voxel of the key with a new observation.
+        The tree is descended iteratively by slicing one bit of each key component per level,
+        afterwards the parents on the path are pruned or get their occupancy summary updated bottom-up.
+
+        Args:
+            key: the voxel key of the observation --- (kx,ky,kz): tuple
+            diff_logodds: the difference value of logodds --- float
+        Returns:
+            whether the map changed --- bool
+        """
+        key_x, key_y, key_z = key
+        statistics = self._statistics
+        node = self._root
+        path = []
+        has_split = False
+        # nodes from this depth down were unknown before this update
+        unknown_depth = self._max_depth
+        for level in range(self._max_depth - 1, -1, -1):
+            if not node.has_children():
+                if node.is_leaf() and self._is_saturated(node.get_log_odds(), diff_logodds):
+                    # a pruned leaf which is clamped already, splitting it would only prune it again
+                    return False
+                if not node.is_leaf():
+                    unknown_depth = min(unknown_depth, len(path))
+                statistics.on_split(len(path), node.is_leaf(), node.get_log_odds())
+                node._split()
+                has_split = True
+            path.append(node)
+            node = node.get_child(((key_x >> level) & 1) | (((key_y >> level) & 1) << 1) | (((key_z >> level) & 1) << 2))
+        was_leaf = node.is_leaf()
+        old_log_odds = node.get_log_odds()
+        if was_leaf and self._is_saturated(old_log_odds, diff_logodds):
+            return False
+        node.update_logodds(diff_logodds)
+        statistics.on_update(was_leaf, old_log_odds, node.get_log_odds())
+        if self._changes is not None:
+            self._record_change(key, self.get_state(old_log_odds) if was_leaf else STATE_UNKNOWN,
+                                self.get_state(node.get_log_odds()))
+        if was_leaf and not has_split and node.get_log_odds() == old_log_odds:
+            # nothing changed, the parents are still up to date
+            return False
+        if was_leaf and (old_log_odds == FREE_LOGODDS or old_log_odds == OCCUPANCY_LOGODDS):
+            self._saturation_version += 1
+
+        if self._prune_policy == 'deferred':
+            self._dirty_keys.add((key_x >> 1, key_y >> 1, key_z >> 1))
+        prune = self._prune_policy == 'eager'
+        inner_occupancy = self._inner_occupancy
+        for depth in range(len(path) - 1, -1, -1):
+            parent = path[depth]
+            # a parent can only be pruned if its child on the path has been pruned
+            if prune and parent._check_children_logodds():
+                parent._prune()
+                statistics.on_prune(depth, parent.get_log_odds())
+                continue
+            prune = False
+            old_log_odds = parent.get_log_odds()
+            parent._update_inner_occupancy(inner_occupancy)
+            if depth < unknown_depth and parent.get_log_odds() == old_log_odds:
+                break
+        return True
+
+    @staticmethod
+    def _is_saturated(log_odds: float, diff_logodds: float):
+        """
+        Returns:
+            whether an update can not change the logodds because they are clamped in its direction --- bool
+        """
+        return log_odds >= OCCUPANCY_LOGODDS if diff_logodds > 0 else log_odds <= FREE_LOGODDS
+
+    @staticmethod
+    def get_state(log_odds: float):
+        """
+        Args:
+            log_odds: logodds of a known voxel --- float
+        Returns:
+            STATE_OCCUPIED or STATE_FREE when a threshold has been arrived at, STATE_UNCERTAIN otherwise --- int
+        """
+        if log_odds >= OCCUPANCY_LOGODDS:
+            return STATE_OCCUPIED
+        if log_odds <= FREE_LOGODDS:
+            return STATE_FREE
+        return STATE_UNCERTAIN
+
+    def _record_change(self, key: tuple, old_state: int, new_state: int):
+        """
+        Record the state change of a voxel, a voxel that returns to its state at the last checkpoint is dropped.
+        """
+        if old_state == new_state:
+            return
+        if key in self._changes:
+            old_state = self._changes[key][0]
+        if old_state == new_state:
+            del self._changes[key]
+        else:
+            self._changes[key] = (old_state, new_state)
+
+    def enable_change_tracking(self, enabled: bool = True):
+        """
+        Start (or stop) recording the voxels whose state changes, starting a new change set.
+
+        Args:
+            enabled: whether changes are recorded --- bool
+        """
+        self._changes = {} if enabled else None
+
+    def is_tracking_changes(self):
+        return self._changes is not None
+
+    def pop_changes(self):
+        """
+        Return the voxels whose state changed since the last checkpoint and start a new change set.
+
+        Returns:
+            voxel keys, voxel origin coordinates, state at the last checkpoint and current state
+            of each changed voxel --- dict of ndarray
+        """
+        if self._changes is None:
+            raise ValueError("Changes are not tracked by this tree.")
+        changes = self._changes
+        self._changes = {}
+
+        keys = np.array(list(changes.keys()), dtype=np.int64).reshape(-1, 3)
+        states = np.array(list(changes.values()), dtype=np.int64).reshape(-1, 2)
+        return {
+            'keys': keys,
+            'origins': self._origin + keys * self._resolution,
+            'old_state': states[:, 0],
+            'new_state': states[:, 1],
+        }
+
+    def add_change_callback(self, callback):
+        """
+        Register a consumer of change sets, it is called with the result of pop_changes by publish_changes.
+
+        Args:
+            callback: function taking the change set --- callable
+        """
+        self._change_callbacks.append(callback)
+
+    def publish_changes(self):
+        """
+        Pop the changes since the last checkpoint and hand them to all registered callbacks.
+
+        Returns:
+            the published change set, see pop_changes --- dict of ndarray
+        """
+        changes = self.pop_changes()
+        for callback in self._change_callbacks:
+            callback(changes)
+        return changes
+
     def insert_point(self, point: tuple, diff_logodds: float = HIT_LOGODDS):
         """
         Add an observation to the octo map.
@@ -67,10 +315,16 @@ class OctoTree:
         Args:
             point: the coordinate of the observation lidar point --- (x,y,z): tuple
             diff_logodds: the difference value of logodds
+        Returns:
+            whether the map changed --- bool
         """
         if not len(point) == 3:
             raise ValueError("Point should be tuple (x,y,z)")
-        self._root.update(point, diff_logodds, self.origin, self.width, self._max_depth)
+        key = self.coord_to_key(point)
+        # points outside of the tree are ignored
+        if key is None:
+            return False
+        return self._update_key(key, diff_logodds)
 
     def ray_casting(self, start_point: tuple, end_point: tuple, diff_logodds: float = MISS_LOGODDS):
         """
@@ -83,14 +337,351 @@ class OctoTree:
         """
         if len(start_point) != 3 or len(end_point) != 3:
             raise ValueError("Point should be tuple (x,y,z)")
-        
+        if diff_logodds == MISS_LOGODDS:
+            # a scan of one ray, so a repeated saturated ray is skipped
+            self._insert_scans([start_point], [end_point], [0, 1], -1)
+            return
+
         # Insert occupancy voxel
         self.insert_point(end_point)
         # Insert free voxel
-        grid_path: list = bresenham3D(start_point, end_point)
-        for point in grid_path:
-            self._root.update(point, diff_logodds, self.origin, self.width, self._max_depth)
-        
+        ray_keys, _ = compute_ray_keys(start_point, end_point, self._origin, self._resolution)
+        for key in self._valid_keys(ray_keys):
+            self._update_key(key, diff_logodds)
+
+    def _valid_keys(self, keys: np.ndarray):
+        """
+        Args:
+            keys: voxel keys, also outside of this tree --- Nx3: ndarray
+        Returns:
+            the keys contained in this tree --- list of (kx,ky,kz)
+        """
+        valid = np.all((keys >= 0) & (keys < self._key_range), axis=1)
+        return list(map(tuple, keys[valid].tolist()))
+
+    def _cast_rays(self, start_points: np.ndarray, end_points: np.ndarray, max_range: float = -1,
+                   is_hit: np.ndarray = None, traverse: np.ndarray = None):
+        """
+        Traverse a batch of rays in the keys of this tree, see cast_rays.
+        """
+        return cast_rays(start_points, end_points, self._origin, self._resolution, max_range, is_hit, traverse)
+
+    def compute_update(self, origin: tuple, end_points: list, max_range: float = -1):
+        """
+        Collect the voxels observed by a scan as unique keys.
+        A voxel which is the end point of one ray and on the path of another is only kept as occupied.
+
+        Args:
+            origin: the coordinate of the sensor --- (x,y,z): tuple
+            end_points: the coordinates of the observation points --- list of (x,y,z)
+            max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+        Returns:
+            keys of the free voxels, keys of the occupied voxels --- set, set
+        """
+        if len(origin) != 3:
+            raise ValueError("Point should be tuple (x,y,z)")
+        end_points = np.asarray(end_points, dtype=float).reshape(-1, 3)
+        start_points = np.broadcast_to(np.asarray(origin, dtype=float), end_points.shape)
+
+        ray_keys, _, end_keys, is_hit = self._cast_rays(start_points, end_points, max_range)
+        occupied_keys = set(self._valid_keys(end_keys[is_hit]))
+        free_keys = set(self._valid_keys(ray_keys))
+        free_keys -= occupied_keys
+        return free_keys, occupied_keys
+
+    def _apply_update(self, free_keys, occupied_keys):
+        """
+        Update the free voxels before the occupied ones.
+
+        Returns:
+            keys of the voxels which changed --- set
+        """
+        changed_keys = set()
+        for key in free_keys:
+            if self._update_key(key, MISS_LOGODDS):
+                changed_keys.add(key)
+        for key in occupied_keys:
+            if self._update_key(key, HIT_LOGODDS):
+                changed_keys.add(key)
+        return changed_keys
+
+    def insert_scan(self, origin: tuple, end_points: list, max_range: float = -1):
+        """
+        Add all rays of one scan to the tree, each observed voxel is updated exactly once.
+
+        Args:
+            origin: the coordinate of the sensor --- (x,y,z): tuple
+            end_points: the coordinates of the observation points --- list of (x,y,z)
+            max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+        """
+        if len(origin) != 3:
+            raise ValueError("Point should be tuple (x,y,z)")
+        end_points = np.asarray(end_points, dtype=float).reshape(-1, 3)
+        start_points = np.broadcast_to(np.asarray(origin, dtype=float), end_points.shape)
+        self._insert_scans(start_points, end_points, [0, end_points.shape[0]], max_range)
+
+    def insert_scan_list(self, scan_list: list, max_range: float = -1):
+        """
+        Add a sequence of scans to the tree, the rays of all scans are traversed in one batch.
+        The result is the same as calling insert_scan for each scan.
+        A scan may also tell which of its rays end in an obstacle, the others only mark free space (see insert_rays).
+
+        Args:
+            scan_list: (origin, end points[, is_hit]) for each scan --- list of (tuple, list[, list])
+            max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+        """
+        start_points = []
+        end_points = []
+        is_hit = []
+        scan_bounds = [0]
+        for scan in scan_list:
+            origin, scan_end_points = scan[0], scan[1]
+            start_points.extend([origin] * len(scan_end_points))
+            end_points.extend(scan_end_points)
+            is_hit.extend(scan[2] if len(scan) > 2 else [True] * len(scan_end_points))
+            scan_bounds.append(len(end_points))
+        self._insert_scans(start_points, end_points, scan_bounds, max_range, np.array(is_hit, dtype=bool))
+
+    def insert_rays(self, start_points: np.ndarray, end_points: np.ndarray, scan_index: np.ndarray,
+                    max_range: float = -1, is_hit: np.ndarray = None):
+        """
+        Add a batch of rays given as arrays, consecutive rays with the same scan index form a scan.
+        The result is the same as calling insert_scan for each scan, see transform_measurements for the arrays.
+        Rays which did not hit an obstacle (e.g. beams beyond the sensor range) only mark free space.
+
+        Args:
+            start_points: the coordinates of the sensor --- Nx3: ndarray
+            end_points: the coordinates of the observation points --- Nx3: ndarray
+            scan_index: the scan of each ray --- N: ndarray
+            max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+            is_hit: whether each ray ends in an obstacle, all rays do if None --- N: ndarray
+        """
+        scan_index = np.asarray(scan_index)
+        changes = np.flatnonzero(scan_index[1:] != scan_index[:-1]) + 1
+        scan_bounds = [0] + changes.tolist() + [len(scan_index)] if len(scan_index) else [0]
+        self._insert_scans(start_points, end_points, scan_bounds, max_range, is_hit)
+
+    def _insert_scans(self, start_points, end_points, scan_bounds: list, max_range: float, is_hit: np.ndarray = None):
+        """
+        Traverse the rays of all scans in one batch and apply the scans one after another.
+        A ray whose voxels were all clamped the last time it was applied is skipped while no clamped voxel changed,
+        its end point still takes part in the deduplication of its scan.
+        The rays are cached after the truncation to max_range, as they are traversed.
+        """
+        start_points = np.asarray(start_points, dtype=float).reshape(-1, 3)
+        end_points, is_hit = truncate_rays(start_points, end_points, max_range, is_hit)
+        max_range = -1
+        cache = self._ray_cache
+        traverse = None
+        if cache is not None:
+            rays = list(zip(map(tuple, start_points.tolist()), map(tuple, end_points.tolist()), is_hit.tolist()))
+            skipped = self._find_cached_rays(rays, 0, len(rays))
+            traverse = ~skipped
+        ray_keys, offsets, end_keys, is_hit = self._cast_rays(start_points, end_points, max_range, is_hit, traverse)
+
+        for first, last in zip(scan_bounds[:-1], scan_bounds[1:]):
+            occupied_keys = set(self._valid_keys(end_keys[first:last][is_hit[first:last]]))
+            scan_ray_keys = ray_keys[offsets[first]:offsets[last]]
+            if cache is not None:
+                # an earlier scan of the batch may have saturated a ray which is repeated here
+                skipped[first:last] |= self._find_cached_rays(rays, first, last, traverse)
+                scan_ray_keys = scan_ray_keys[np.repeat(~skipped[first:last], np.diff(offsets[first:last + 1]))]
+            free_keys = set(self._valid_keys(scan_ray_keys))
+            free_keys -= occupied_keys
+            changed_keys = self._apply_update(free_keys, occupied_keys)
+            self._count_scan()
+            if cache is not None:
+                self._cache_saturated_rays(rays, first, last, skipped, ray_keys, offsets, end_keys, is_hit,
+                                           occupied_keys, changed_keys)
+        if cache is not None:
+            num_skipped = int(np.count_nonzero(skipped))
+            self._ray_cache_hits += num_skipped
+            self._ray_cache_misses += len(rays) - num_skipped
+
+    def _find_cached_rays(self, rays: list, first: int, last: int, candidates: np.ndarray = None):
+        """
+        Returns:
+            whether each of the rays first ... last-1 is known to be saturated, only candidates are looked up --- ndarray
+        """
+        cache = self._ray_cache
+        version = self._saturation_version
+        cached = np.zeros(last - first, dtype=bool)
+        for index in range(first, last):
+            if candidates is not None and not candidates[index]:
+                continue
+            if cache.get(rays[index]) == version:
+                cache.move_to_end(rays[index])
+                cached[index - first] = True
+        return cached
+
+    def _cache_saturated_rays(self, rays, first, last, skipped, ray_keys, offsets, end_keys, is_hit,
+                              occupied_keys, changed_keys):
+        """
+        Remember the traversed rays of a scan which did not change any of their voxels.
+        A ray with a voxel that was only updated as an end point of another ray is not known to be saturated.
+        """
+        cache = self._ray_cache
+        scan_keys = ray_keys[offsets[first]:offsets[last]]
+        ray_index = np.repeat(np.arange(first, last), np.diff(offsets[first:last + 1]))
+        valid = np.all((scan_keys >= 0) & (scan_keys < self._key_range), axis=1)
+        unsaturated = [key in occupied_keys or key in changed_keys for key in map(tuple, scan_keys[valid].tolist())]
+        unsaturated = set(ray_index[valid][np.array(unsaturated, dtype=bool)].tolist())
+        for index in range(first, last):
+            if skipped[index] or index in unsaturated:
+                continue
+            if is_hit[index] and tuple(end_keys[index].tolist()) in changed_keys:
+                continue
+            cache[rays[index]] = self._saturation_version
+            cache.move_to_end(rays[index])
+            if len(cache) > self._ray_cache_size:
+                cache.popitem(last=False)
+
+    def _count_scan(self):
+        """
+        Run the deferred pruning pass every PRUNE_INTERVAL scans.
+        """
+        self._num_scans += 1
+        if self._prune_policy == 'deferred' and self._num_scans % PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def _find_node(self, key: tuple, depth: int):
+        """
+        Return the node at 'depth' whose key prefix is 'key'.
+
+        Args:
+            key: the first 'depth' bits of a voxel key --- (kx,ky,kz): tuple
+            depth: depth of the node --- int
+        Returns:
+            the node, None if it has not been created --- OctoNode
+        """
+        node = self._root
+        for level in range(depth - 1, -1, -1):
+            if not node.has_children():
+                return None
+            node = node.get_child(((key[0] >> level) & 1) | (((key[1] >> level) & 1) << 1) | (((key[2] >> level) & 1) << 2))
+        return node
+
+    def prune(self):
+        """
+        Prune the tree bottom-up, 8 children with the same clamped logodds are merged into their parent.
+        With the deferred policy only the parents marked since the last pass are visited,
+        otherwise (or after expand) the whole tree is.
+
+        Returns:
+            number of pruned nodes --- int
+        """
+        if self._prune_policy == 'deferred' and not self._prune_all:
+            num_pruned = self._prune_dirty()
+        else:
+            num_pruned = self._prune_tree()
+        self._dirty_keys = set()
+        self._prune_all = False
+        return num_pruned
+
+    def _prune_dirty(self):
+        """
+        Prune the marked parents, a parent that has been pruned marks its own parent.
+        """
+        num_pruned = 0
+        level_keys = self._dirty_keys
+        for depth in range(self._max_depth - 1, -1, -1):
+            parent_keys = set()
+            for key in level_keys:
+                node = self._find_node(key, depth)
+                if node is not None and node.has_children() and node._check_children_logodds():
+                    node._prune()
+                    self._statistics.on_prune(depth, node.get_log_odds())
+                    parent_keys.add((key[0] >> 1, key[1] >> 1, key[2] >> 1))
+                    num_pruned += 1
+            level_keys = parent_keys
+        return num_pruned
+
+    def _prune_tree(self):
+        """
+        Prune the whole tree, the inner nodes are visited from the deepest level up.
+        """
+        inner_nodes = []
+        queue = [self._root]
+        while queue:
+            level_nodes = [node for node in queue if node.has_children()]
+            inner_nodes.append(level_nodes)
+            queue = [child for node in level_nodes for child in node.get_children()]
+
+        num_pruned = 0
+        for depth in range(len(inner_nodes) - 1, -1, -1):
+            for node in inner_nodes[depth]:
+                if node._check_children_logodds():
+                    node._prune()
+                    self._statistics.on_prune(depth, node.get_log_odds())
+                    num_pruned += 1
+        return num_pruned
+
+    def expand(self):
+        """
+        Expand all pruned leafs down to the maximum depth, the children keep the value of their parent.
+        Unknown space is not expanded.
+
+        Returns:
+            number of expanded nodes --- int
+        """
+        num_expanded = 0
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth == self._max_depth:
+                continue
+            if node.is_leaf() and not node.has_children():
+                self._statistics.on_split(depth, True, node.get_log_odds())
+                node._split()
+                num_expanded += 1
+            if node.has_children():
+                stack.extend((child, depth + 1) for child in node.get_children())
+        self._prune_all = True
+        return num_expanded
+
+    def coarsen(self, depth: int):
+        """
+        Reduce the tree to 'depth': every node at that depth with children becomes a leaf
+        with the occupancy summary of its subtree (see inner_occupancy), e.g. for a region far away from the drone.
+        Later observations split the coarse leafs again. The state changes of the dropped voxels are not recorded.
+
+        Args:
+            depth: depth of the coarsest leafs --- int
+        Returns:
+            number of collapsed nodes --- int
+        """
+        num_collapsed = 0
+        stack = [(self._root, 0)]
+        while stack:
+            node, node_depth = stack.pop()
+            if not node.has_children():
+                continue
+            if node_depth < depth:
+                stack.extend((child, node_depth + 1) for child in node.get_children())
+            else:
+                node._collapse()
+                num_collapsed += 1
+        if num_collapsed:
+            # the nodes are rebuilt in breadth-first order like a loaded tree, the pool gives its free slots back
+            statistics = self._statistics
+            num_splits, num_prunes = statistics.num_splits, statistics.num_prunes
+            self._load_nodes(*self._level_order())
+            statistics.num_splits, statistics.num_prunes = num_splits, num_prunes
+        return num_collapsed
+
+    def insert_point_cloud(self, origin: tuple, point_cloud: np.ndarray, max_range: float = -1):
+        """
+        Add a point cloud observed from one sensor origin to the tree, see insert_scan.
+
+        Args:
+            origin: the coordinate of the sensor --- (x,y,z): tuple
+            point_cloud: the coordinates of the observation points --- Nx3: ndarray
+            max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+        """
+        point_cloud = np.asarray(point_cloud, dtype=float)
+        if point_cloud.ndim != 2 or point_cloud.shape[1] != 3:
+            raise ValueError("Point cloud should be an array of shape (N, 3)")
+        self.insert_scan(tuple(origin), point_cloud, max_range)
 
     def contains(self, point: tuple):
         """
@@ -104,54 +695,704 @@ class OctoTree:
         if not len(point) == 3:
             raise ValueError("Point should be tuple (x,y,z)")
 
-        res: bool = (self._center[0] - self.radius) <= point[0] < (self._center[0] + self.radius) and \
-                    (self._center[1] - self.radius) <= point[1] < (self._center[1] + self.radius) and \
-                    (self._center[2] - self.radius) <= point[2] < (self._center[2] + self.radius)
+        res: bool = self.coord_to_key(point) is not None
         return res
     
-    def get_probability(self, point: tuple):
+    def get_probability(self, point: tuple, depth: int = None):
         """
         Return the occupancy probability of the voxel at a given point coordinate.
+        With a depth the descent stops at that level and the occupancy summary of the inner node is used.
 
         Args:
             point: coordinate of some voxel to get probability --- (x,y,z): tuple
+            depth: maximal depth of the query, the full depth if None --- int
         Returns:
             occupancy probability of the corresponding voxel --- float
         """
-        if not self.contains(point):
+        key = self.coord_to_key(point)
+        if key is None:
             raise ValueError("Invalid point.")
-        
-        probability: float = self._root.probability_at(point, self.origin, self.width)
+        if depth is None:
+            depth = self._max_depth
+
+        key_x, key_y, key_z = key
+        node = self._root
+        level = self._max_depth - 1
+        while node.has_children() and level >= self._max_depth - depth:
+            node = node.get_child(((key_x >> level) & 1) | (((key_y >> level) & 1) << 1) | (((key_z >> level) & 1) << 2))
+            level -= 1
+        probability: float = node.probability
 
         return probability
+
+    def any_occupied(self, bbox_min: tuple, bbox_max: tuple):
+        """
+        Return whether any occupied voxel intersects the box.
+        With the 'max' inner occupancy whole subtrees without an occupied leaf are skipped at their root.
+
+        Args:
+            bbox_min: the minimum corner of the box --- (x,y,z): tuple
+            bbox_max: the maximum corner of the box --- (x,y,z): tuple
+        Returns:
+            whether an occupied voxel has been found --- bool
+        """
+        key_min, key_max = self._box_keys(bbox_min, bbox_max)
+        if any(key_min[i] > key_max[i] for i in range(3)):
+            return False
+
+        early_out = self._inner_occupancy == 'max'
+        stack = [(self._root, 0, (0, 0, 0))]
+        while stack:
+            node, depth, key = stack.pop()
+            size = 1 << (self._max_depth - depth)
+            if any(key[i] > key_max[i] or key[i] + size <= key_min[i] for i in range(3)):
+                continue
+            if not node.has_children():
+                if node.is_leaf() and node.get_log_odds() >= OCCUPANCY_LOGODDS:
+                    return True
+                continue
+            if early_out and node.get_log_odds() < OCCUPANCY_LOGODDS:
+                continue
+            half = size >> 1
+            for index, child in enumerate(node.get_children()):
+                stack.append((child, depth + 1, (key[0] + (half if index & 1 else 0),
+                                                 key[1] + (half if index & 2 else 0),
+                                                 key[2] + (half if index & 4 else 0))))
+        return False
+
+    def iter_box(self, bbox_min: tuple, bbox_max: tuple, state: int = None):
+        """
+        Iterate lazily over the known leafs intersecting a box, only the nodes intersecting it are descended.
+        A pruned leaf reaching out of the box is returned whole with its depth.
+
+        Args:
+            bbox_min: the minimum corner of the box --- (x,y,z): tuple
+            bbox_max: the maximum corner of the box --- (x,y,z): tuple
+            state: only leafs in this state (STATE_FREE, STATE_OCCUPIED or STATE_UNCERTAIN), all if None --- int
+        Returns:
+            (key, depth, node) for each leaf --- generator of ((kx,ky,kz), int, OctoNode)
+        """
+        key_min, key_max = self._box_keys(bbox_min, bbox_max)
+        return self._iter_region(lambda key, size: all(key[i] <= key_max[i] and key_min[i] < key[i] + size
+                                                       for i in range(3)), state)
+
+    def query_box(self, bbox_min: tuple, bbox_max: tuple, state: int = None):
+        """
+        Collect the known leafs intersecting a box into columnar arrays, see iter_box and to_arrays.
+        """
+        key_min, key_max = self._box_keys(bbox_min, bbox_max)
+        if self._backend == 'array':
+            return self._query_pool(lambda keys, size: np.all((keys <= key_max) & (keys + size > key_min), axis=1),
+                                    state)
+        return self._leaf_arrays(self.iter_box(bbox_min, bbox_max, state))
+
+    def iter_radius(self, center: tuple, radius: float, state: int = None):
+        """
+        Iterate lazily over the known leafs intersecting a sphere, only the nodes intersecting it are descended.
+        A pruned leaf reaching out of the sphere is returned whole with its depth.
+
+        Args:
+            center: the center of the sphere --- (x,y,z): tuple
+            radius: the radius of the sphere --- float
+            state: only leafs in this state (STATE_FREE, STATE_OCCUPIED or STATE_UNCERTAIN), all if None --- int
+        Returns:
+            (key, depth, node) for each leaf --- generator of ((kx,ky,kz), int, OctoNode)
+        """
+        # in units of keys, a node covers key ... key+size
+        center = [(center[i] - self._origin[i]) / self._resolution for i in range(3)]
+        squared_radius = (radius / self._resolution) ** 2
+
+        def overlaps(key, size):
+            return sum(max(key[i] - center[i], 0, center[i] - key[i] - size) ** 2 for i in range(3)) <= squared_radius
+        return self._iter_region(overlaps, state)
+
+    def query_radius(self, center: tuple, radius: float, state: int = None):
+        """
+        Collect the known leafs intersecting a sphere into columnar arrays, see iter_radius and to_arrays.
+        """
+        if self._backend == 'array':
+            key_center = (np.asarray(center, dtype=float) - self._origin) / self._resolution
+            squared_radius = (radius / self._resolution) ** 2
+            return self._query_pool(
+                lambda keys, size: np.sum(np.maximum(np.maximum(keys - key_center, key_center - keys - size), 0) ** 2,
+                                          axis=1) <= squared_radius, state)
+        return self._leaf_arrays(self.iter_radius(center, radius, state))
+
+    def _box_keys(self, bbox_min: tuple, bbox_max: tuple):
+        """
+        Returns:
+            the smallest and the largest key of a box inside the tree, empty if a minimum exceeds a maximum --- list, list
+        """
+        key_min = [max(math.floor((bbox_min[i] - self._origin[i]) / self._resolution), 0) for i in range(3)]
+        key_max = [min(math.floor((bbox_max[i] - self._origin[i]) / self._resolution), self._key_range - 1) for i in range(3)]
+        return key_min, key_max
+
+    def _iter_region(self, overlaps, state: int = None):
+        """
+        Iterate over the known leafs of the nodes for which overlaps(key, size) is true,
+        the children of a node are only visited if it overlaps the region.
+        With the 'max' inner occupancy a query for occupied leafs skips subtrees without one at their root.
+        """
+        early_out = state == STATE_OCCUPIED and self._inner_occupancy == 'max'
+        stack = [(self._root, 0, (0, 0, 0))]
+        while stack:
+            node, depth, key = stack.pop()
+            size = 1 << (self._max_depth - depth)
+            if not overlaps(key, size):
+                continue
+            if not node.has_children():
+                if node.is_leaf() and (state is None or self.get_state(node.get_log_odds()) == state):
+                    yield key, depth, node
+                continue
+            if early_out and node.get_log_odds() < OCCUPANCY_LOGODDS:
+                continue
+            half = size >> 1
+            for index, child in enumerate(node.get_children()):
+                stack.append((child, depth + 1, (key[0] + (half if index & 1 else 0),
+                                                 key[1] + (half if index & 2 else 0),
+                                                 key[2] + (half if index & 4 else 0))))
+
+    def _query_pool(self, overlaps, state: int = None):
+        """
+        Region query of the array backend, the overlapping nodes are selected level by level with array operations.
+        """
+        early_out = state == STATE_OCCUPIED and self._inner_occupancy == 'max'
+        arrays = self._leaf_arrays(None, *self._pool_leafs(self._max_depth, overlaps, early_out))
+        if state is None:
+            return arrays
+        selected = arrays['state'] == state
+        return {name: values[selected] for name, values in arrays.items()}
+
+    def get_coarse_occupancy(self, depth: int):
+        """
+        Return the known nodes at a chosen depth, leafs above that depth are returned at their own depth.
+        Inner nodes carry the occupancy summary of their subtree.
+
+        Args:
+            depth: depth of the returned nodes --- int
+        Returns:
+            voxel keys of the node origins, depth and logodds of each node, see to_arrays --- dict of ndarray
+        """
+        return self.to_arrays(max_depth=depth)
         
+    def snapshot(self):
+        """
+        Copy the known leafs into arrays which stay consistent while the tree is updated, e.g. for a background export.
+        A deferred pruning pass runs first, so the snapshot matches the pruned tree.
+
+        Returns:
+            see to_arrays --- dict of ndarray
+        """
+        if self._prune_policy == 'deferred':
+            self.prune()
+        return self.to_arrays()
+
     def export_known_voxel(self,counter):
         """
         Export voxels whose logodds have been arrived at the threshold.
         """
-        leaf_node_list: list = self.get_leaf_node_list()
-        export_known_voxel(leaf_node_list,counter)
+        export_known_voxel(self.snapshot(), counter)
+
+    def iter_leafs(self, max_depth: int = None, predicate=None):
+        """
+        Iterate over the known leafs of the tree depth-first without building a list.
+        The key of a node is the key of the voxel at its origin, it is derived while descending.
+
+        Args:
+            max_depth: known nodes at this depth are returned as leafs, the full depth if None --- int
+            predicate: only nodes for which predicate(key, depth, node) is true are returned --- callable
+        Returns:
+            (key, depth, node) for each leaf --- generator of ((kx,ky,kz), int, OctoNode)
+        """
+        if max_depth is None:
+            max_depth = self._max_depth
+        stack = [(self._root, 0, (0, 0, 0))]
+        while stack:
+            node, depth, key = stack.pop()
+            if depth < max_depth and node.has_children():
+                half = 1 << (self._max_depth - depth - 1)
+                for index, child in enumerate(node.get_children()):
+                    stack.append((child, depth + 1, (key[0] + (half if index & 1 else 0),
+                                                     key[1] + (half if index & 2 else 0),
+                                                     key[2] + (half if index & 4 else 0))))
+            elif node.is_leaf() or node.has_children():
+                if predicate is None or predicate(key, depth, node):
+                    yield key, depth, node
+
+    def to_arrays(self, max_depth: int = None, predicate=None):
+        """
+        Collect the known leafs in a single pass into columnar arrays, see iter_leafs.
+
+        Returns:
+            voxel keys and origin coordinates of the nodes, their depth, logodds and state --- dict of ndarray
+        """
+        if self._backend == 'array' and predicate is None:
+            return self._leaf_arrays(None, *self._pool_leafs(self._max_depth if max_depth is None else max_depth))
+        return self._leaf_arrays(self.iter_leafs(max_depth, predicate))
+
+    def _leaf_arrays(self, leafs, keys=None, depths=None, log_odds=None):
+        """
+        Columnar arrays of leafs given as (key, depth, node) or as keys, depths and logodds, see to_arrays.
+        """
+        if leafs is not None:
+            keys, depths, log_odds = [], [], []
+            for key, depth, node in leafs:
+                keys.append(key)
+                depths.append(depth)
+                log_odds.append(node.get_log_odds())
+
+        keys = np.array(keys, dtype=np.int64).reshape(-1, 3)
+        log_odds = np.array(log_odds, dtype=float)
+        state = np.full(log_odds.shape, STATE_UNCERTAIN, dtype=np.int8)
+        state[log_odds >= OCCUPANCY_LOGODDS] = STATE_OCCUPIED
+        state[log_odds <= FREE_LOGODDS] = STATE_FREE
+        return {
+            'keys': keys,
+            'coords': self._origin + keys * self._resolution,
+            'depth': np.array(depths, dtype=np.int64),
+            'log_odds': log_odds,
+            'state': state,
+        }
+
+    def _pool_leafs(self, max_depth: int, overlaps=None, occupied_only: bool = False):
+        """
+        Known leafs of the array backend, collected level by level with array operations on the pool buffers.
+        With overlaps(keys, size) only the nodes it selects are kept and descended,
+        with occupied_only no inner node whose summary is below the occupancy threshold is descended.
+
+        Returns:
+            keys, depths and logodds of the leafs --- (ndarray, ndarray, ndarray)
+        """
+        pool = self._pool
+        pool_leaf = np.frombuffer(pool.leaf, dtype=np.int8)
+        pool_first_child = np.frombuffer(pool.first_child, dtype=np.intc)
+
+        slots = np.zeros(1, dtype=np.int64)
+        keys = np.zeros((1, 3), dtype=np.int64)
+        leaf_slots, leaf_keys, leaf_depths = [], [], []
+        for depth in range(max_depth + 1):
+            if overlaps is not None:
+                selected = overlaps(keys, 1 << (self._max_depth - depth))
+                slots, keys = slots[selected], keys[selected]
+            first_child = pool_first_child[slots]
+            inner = first_child != NO_CHILDREN
+            known = (pool_leaf[slots] == 1) & ~inner if depth < max_depth else (pool_leaf[slots] == 1) | inner
+            leaf_slots.append(slots[known])
+            leaf_keys.append(keys[known])
+            leaf_depths.append(np.full(np.count_nonzero(known), depth, dtype=np.int64))
+            if occupied_only and depth < max_depth:
+                inner &= pool.get_log_odds_array(slots) >= OCCUPANCY_LOGODDS
+            if depth == max_depth or not inner.any():
+                break
+            half = 1 << (self._max_depth - depth - 1)
+            slots = (first_child[inner][:, np.newaxis] + np.arange(8)).ravel()
+            keys = (keys[inner][:, np.newaxis, :] + CHILD_OFFSETS * half).reshape(-1, 3)
+
+        slots = np.concatenate(leaf_slots)
+        # no view on the growable pool buffers is kept
+        log_odds = pool.get_log_odds_array(slots)
+        del pool_leaf, pool_first_child
+        return np.concatenate(leaf_keys), np.concatenate(leaf_depths), log_odds
 
     def get_leaf_node_list(self):
         """
-        Return leaf nodes for tree traversal using BFS.
+        Return leaf nodes, see iter_leafs.
+        """
+        return [node for _, _, node in self.iter_leafs()]
+    
+    def save(self, path: str, log_odds: bool = SAVE_LOG_ODDS):
+        """
+        Save the tree to a binary file, see OctoTreeFile.
+        Without logodds only the free/occupied state of the leafs is saved (the maximum likelihood map).
+
+        Args:
+            path: file to write --- str
+            log_odds: whether the logodds of all nodes are saved --- bool
         """
-        if not self._root:
-            return []
+        if self._prune_policy == 'deferred':
+            self.prune()
+        codes, values = self._level_order()
+        write_tree_file(path, self._center, self._resolution, self._max_depth, self._inner_occupancy,
+                        codes, values if log_odds else None)
 
-        leaf_nodes = []
-        queue = [self._root]
-        while queue:
-            child_nodes = []
-            for node in queue:
-                if node.is_leaf():
-                    leaf_nodes.append(node)
+    def to_bytes(self, log_odds: bool = SAVE_LOG_ODDS):
+        """
+        Serialize the tree like save, e.g. for a tile of a TileStore.
+
+        Returns:
+            the content of a tree file --- bytes
+        """
+        if self._prune_policy == 'deferred':
+            self.prune()
+        codes, values = self._level_order()
+        return pack_tree(self._center, self._resolution, self._max_depth, self._inner_occupancy,
+                         codes, values if log_odds else None)
+
+    def merge(self, other: 'OctoTree', policy: str = MERGE_POLICY):
+        """
+        Merge the known voxels of another tree into this tree, e.g. the map of another drone or session.
+        Trees with the same grid are walked together node by node: unknown nodes of 'other' are skipped,
+        a pruned leaf of 'other' is applied to the whole subtree of this tree below it and two equal pruned
+        leafs stay untouched, so the cost follows the known nodes of 'other' and not the number of observations.
+        Other grids are merged leaf by leaf if their voxels align, the voxels outside of this tree are dropped.
+        The state changes of the merged voxels are not recorded.
+
+        Args:
+            other: the tree to merge, it is not modified --- OctoTree
+            policy: 'sum' adds the logodds (clamped), 'max_confidence' keeps the logodds farther from 0 --- str
+        Returns:
+            whether this tree changed --- bool
+        """
+        if policy not in MERGE_POLICIES:
+            raise ValueError("Unknown merge policy '{}', expected one of {}".format(policy, MERGE_POLICIES))
+        if other.get_resolution() != self._resolution:
+            raise ValueError("Can not merge a tree with resolution {} into a tree with resolution {}".format(
+                other.get_resolution(), self._resolution))
+        offset = [(other.origin[i] - self._origin[i]) / self._resolution for i in range(3)]
+        if any(value != math.floor(value) for value in offset):
+            raise ValueError("The voxels of the trees do not align, their origins are {} and {}".format(
+                other.origin, self._origin))
+        offset = [int(value) for value in offset]
+
+        if offset == [0, 0, 0] and other.get_max_depth() == self._max_depth:
+            changed = self._merge_nodes(self._root, other.get_root(), 0, policy)
+        else:
+            boxes = []
+            for key, depth, node in other.iter_leafs():
+                low = (key[0] + offset[0], key[1] + offset[1], key[2] + offset[2])
+                size = 1 << (other.get_max_depth() - depth)
+                if all(low[i] < self._key_range and low[i] + size > 0 for i in range(3)):
+                    boxes.append((low, (low[0] + size, low[1] + size, low[2] + size), node.get_log_odds()))
+            changed = bool(boxes) and self._merge_boxes(self._root, 0, (0, 0, 0), boxes, policy)
+        if changed:
+            # cached rays may cross merged voxels
+            self._saturation_version += 1
+        return changed
+
+    def _merge_nodes(self, node: OctoNode, other: OctoNode, depth: int, policy: str):
+        """
+        Merge the subtree of 'other' into the subtree of 'node' at the same place, returns whether it changed.
+        """
+        if not other.has_children():
+            return other.is_leaf() and self._merge_leaf(node, other.get_log_odds(), depth, policy)
+        if not node.has_children():
+            self._statistics.on_split(depth, node.is_leaf(), node.get_log_odds())
+            node._split()
+        changed = False
+        for child, other_child in zip(node.get_children(), other.get_children()):
+            changed |= self._merge_nodes(child, other_child, depth + 1, policy)
+        self._summarize_node(node, depth)
+        return changed
+
+    def _merge_boxes(self, node: OctoNode, depth: int, key: tuple, boxes: list, policy: str):
+        """
+        Merge the leafs of another grid, given as key boxes (low, high, logodds) overlapping the subtree of 'node'
+        at 'key', every box is handed down to the children it overlaps.
+        """
+        size = 1 << (self._max_depth - depth)
+        low, high, log_odds = boxes[0]
+        if all(low[i] <= key[i] and key[i] + size <= high[i] for i in range(3)):
+            # the leafs of a tree are disjoint, a box covering the node is its only box
+            return self._merge_leaf(node, log_odds, depth, policy)
+        if not node.has_children():
+            self._statistics.on_split(depth, node.is_leaf(), node.get_log_odds())
+            node._split()
+        half = size >> 1
+        middle = (key[0] + half, key[1] + half, key[2] + half)
+        child_boxes = [[] for _ in range(8)]
+        for box in boxes:
+            low, high, _ = box
+            # the halves of each axis overlapped by the box
+            sides = [(0, 1) if low[i] < middle[i] < high[i] else (0,) if high[i] <= middle[i] else (1,) for i in range(3)]
+            for side_z in sides[2]:
+                for side_y in sides[1]:
+                    for side_x in sides[0]:
+                        child_boxes[side_x | (side_y << 1) | (side_z << 2)].append(box)
+        changed = False
+        for index, child in enumerate(node.get_children()):
+            if child_boxes[index]:
+                child_key = (key[0] + half * (index & 1), key[1] + half * ((index >> 1) & 1), key[2] + half * (index >> 2))
+                changed |= self._merge_boxes(child, depth + 1, child_key, child_boxes[index], policy)
+        self._summarize_node(node, depth)
+        return changed
+
+    def _merge_leaf(self, node: OctoNode, log_odds: float, depth: int, policy: str):
+        """
+        Merge a known region with the same logodds everywhere into the subtree of 'node'.
+        """
+        if node.has_children():
+            changed = False
+            for child in node.get_children():
+                changed |= self._merge_leaf(child, log_odds, depth + 1, policy)
+            self._summarize_node(node, depth)
+            return changed
+        was_leaf = node.is_leaf()
+        old_log_odds = node.get_log_odds()
+        if not was_leaf or policy == 'max_confidence' and abs(log_odds) > abs(old_log_odds):
+            node._log_odds = log_odds
+            node._is_leaf = True
+        elif policy == 'sum':
+            node.update_logodds(log_odds)
+        if was_leaf and node.get_log_odds() == old_log_odds:
+            return False
+        self._statistics.on_update(was_leaf, old_log_odds, node.get_log_odds())
+        return True
+
+    def _summarize_node(self, node: OctoNode, depth: int):
+        """
+        Prune an inner node whose children changed, unless pruning is off, or update its occupancy summary.
+        """
+        if self._prune_policy != 'off' and node._check_children_logodds():
+            node._prune()
+            self._statistics.on_prune(depth, node.get_log_odds())
+        else:
+            node._update_inner_occupancy(self._inner_occupancy)
+
+    def diff(self, other: 'OctoTree'):
+        """
+        Compare this tree (old) with another tree of the same grid (new), e.g. two flights or two checkpoints.
+        Both trees are walked together, two leafs with the same state end the walk at once, so equal pruned regions
+        cost one comparison. A pruned leaf facing a subtree is compared with each of its nodes.
+        A region that is a leaf in both trees is reported once with its depth, e.g. a whole pruned block.
+
+        Args:
+            other: the newer tree --- OctoTree
+        Returns:
+            key of the origin voxel, depth, origin coordinate, old and new state of each differing region,
+            and whether it was added (unknown before), removed (unknown after) or changed --- dict of ndarray
+        """
+        if other.get_resolution() != self._resolution or other.origin != self._origin or \
+                other.get_max_depth() != self._max_depth:
+            raise ValueError("Only trees with the same center, resolution and depth can be compared")
+        rows = []
+        self._diff_nodes(self._root, other.get_root(), 0, (0, 0, 0), rows)
+        keys = np.array([row[0] for row in rows], dtype=np.int64).reshape(-1, 3)
+        depth = np.array([row[1] for row in rows], dtype=np.int64)
+        states = np.array([row[2:] for row in rows], dtype=np.int64).reshape(-1, 2)
+        return {
+            'keys': keys,
+            'depth': depth,
+            'origins': self._origin + keys * self._resolution,
+            'old_state': states[:, 0],
+            'new_state': states[:, 1],
+            'added': states[:, 0] == STATE_UNKNOWN,
+            'removed': states[:, 1] == STATE_UNKNOWN,
+            'changed': (states[:, 0] != STATE_UNKNOWN) & (states[:, 1] != STATE_UNKNOWN),
+        }
+
+    def _diff_nodes(self, old, new, depth: int, key: tuple, rows: list):
+        """
+        Compare two nodes at the same place, a state instead of a node stands for a leaf region above it.
+        """
+        old_children = not isinstance(old, int) and old.has_children()
+        new_children = not isinstance(new, int) and new.has_children()
+        if not old_children and not new_children:
+            old_state, new_state = self._node_state(old), self._node_state(new)
+            if old_state != new_state:
+                rows.append((key, depth, old_state, new_state))
+            return
+        old_nodes = old.get_children() if old_children else [self._node_state(old)] * 8
+        new_nodes = new.get_children() if new_children else [self._node_state(new)] * 8
+        half = 1 << (self._max_depth - depth - 1)
+        for index in range(8):
+            self._diff_nodes(old_nodes[index], new_nodes[index], depth + 1,
+                             (key[0] + half * (index & 1), key[1] + half * ((index >> 1) & 1), key[2] + half * (index >> 2)),
+                             rows)
+
+    def _node_state(self, node):
+        """
+        Returns:
+            the state of a node without children, or the given state --- int
+        """
+        if isinstance(node, int):
+            return node
+        return self.get_state(node.get_log_odds()) if node.is_leaf() else STATE_UNKNOWN
+
+    def _summarize_levels(self, depth: int):
+        """
+        Summarize the inner nodes above 'depth' again from their children bottom-up, e.g. after their subtrees
+        have been replaced. Like after an update, 8 equal clamped leafs are pruned unless pruning is off.
+        """
+        levels = [[self._root]]
+        for _ in range(depth - 1):
+            levels.append([child for node in levels[-1] if node.has_children() for child in node.get_children()])
+        for node_depth in range(len(levels) - 1, -1, -1):
+            for node in levels[node_depth]:
                 if node.has_children():
-                    child_nodes.extend(node.get_children())
-            queue = child_nodes
+                    self._summarize_node(node, node_depth)
+
+    def _level_order(self):
+        """
+        Returns:
+            file code and logodds of all nodes in breadth-first order, see OctoTreeFile --- ndarray, ndarray
+        """
+        codes, values = [], []
+        queue = deque([self._root])
+        self._append_level_order(self._root, codes, values)
+        while queue:
+            for child in queue.popleft().get_children():
+                if self._append_level_order(child, codes, values):
+                    queue.append(child)
+        return np.array(codes, dtype=np.uint8), np.array(values, dtype=float)
+
+    @staticmethod
+    def _append_level_order(node: OctoNode, codes: list, values: list):
+        """
+        Append the file code and the logodds of a node, returns whether the node has children.
+        """
+        values.append(node.get_log_odds())
+        if node.has_children():
+            codes.append(CODE_INNER)
+            return True
+        if node.is_leaf():
+            codes.append(CODE_OCCUPIED if node.get_log_odds() > DEFAULT_LOGODDS else CODE_FREE)
+        else:
+            codes.append(CODE_UNKNOWN)
+        return False
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, backend: str = TREE_BACKEND, prune_policy: str = PRUNE_POLICY,
+             track_changes: bool = TRACK_CHANGES, log_odds_storage: str = LOG_ODDS_STORAGE):
+        """
+        Load a tree saved by save.
+        The nodes are decoded with array operations, no ray is cast again.
+        The loaded nodes are a copy of the file, a memory-mapped file is closed once they are built.
+
+        Args:
+            path: file to read --- str
+            mmap: whether the file is memory-mapped instead of read at once, see read_tree_file --- bool
+            backend: storage engine of the nodes, 'object' or 'array' --- str
+            prune_policy: when children are pruned, 'eager', 'deferred' or 'off' --- str
+            track_changes: whether voxels whose state changes are recorded, see pop_changes --- bool
+            log_odds_storage: type of the stored logodds, the saved logodds are rounded to a fixed-point storage --- str
+        Returns:
+            the loaded tree --- OctoTree
+        """
+        with read_tree_file(path, mmap) as tree_file:
+            return cls._from_tree_file(tree_file, backend=backend, prune_policy=prune_policy,
+                                       track_changes=track_changes, log_odds_storage=log_odds_storage)
+
+    @classmethod
+    def from_bytes(cls, buffer, backend: str = TREE_BACKEND, prune_policy: str = PRUNE_POLICY,
+                   track_changes: bool = TRACK_CHANGES, log_odds_storage: str = LOG_ODDS_STORAGE):
+        """
+        Create a tree serialized by to_bytes, the options are the ones of load.
+
+        Args:
+            buffer: the content of a tree file --- bytes
+        Returns:
+            the tree --- OctoTree
+        """
+        return cls._from_tree_file(unpack_tree(buffer), backend=backend, prune_policy=prune_policy,
+                                   track_changes=track_changes, log_odds_storage=log_odds_storage)
+
+    @classmethod
+    def _from_tree_file(cls, tree_file: dict, **options):
+        octotree = cls(tree_file['center'], tree_file['resolution'], tree_file['max_depth'],
+                       inner_occupancy=tree_file['inner_occupancy'], **options)
+        octotree._load_nodes(tree_file['codes'], tree_file['log_odds'])
+        return octotree
+
+    def _load_nodes(self, codes: np.ndarray, log_odds: np.ndarray = None):
+        """
+        Replace all nodes by nodes given in breadth-first order, see OctoTreeFile.
+
+        Args:
+            codes: file code of each node --- ndarray of uint8
+            log_odds: logodds of each node, derived from the codes if None --- ndarray of float
+        """
+        num_nodes = len(codes)
+        inner = np.flatnonzero(codes == CODE_INNER)
+        num_inner = len(inner)
+        # breadth-first order puts every parent before the block of its children
+        if num_nodes != 1 + 8 * num_inner or np.any(inner >= 1 + 8 * np.arange(num_inner)):
+            raise ValueError("The nodes are not a tree in breadth-first order")
+
+        leaf = (codes == CODE_FREE) | (codes == CODE_OCCUPIED)
+        first_child = np.full(num_nodes, NO_CHILDREN, dtype=np.intc)
+        first_child[inner] = 1 + 8 * np.arange(num_inner)
+        parent = np.repeat(inner, 8)
+        depth = np.zeros(num_nodes, dtype=np.int64)
+        for _ in range(self._max_depth):
+            depth[1:] = depth[parent] + 1
+        if num_inner and depth[inner].max() >= self._max_depth:
+            raise ValueError("The nodes are deeper than the maximum depth {}".format(self._max_depth))
+
+        if log_odds is None:
+            log_odds = self._summarize_codes(codes, inner, depth)
+
+        if self._backend == 'array':
+            self._pool = OctoNodePool.from_arrays(log_odds, leaf, first_child, self._log_odds_storage)
+            self._root = self._pool.get_root()
+            log_odds = self._pool.get_log_odds_array()
+        else:
+            nodes = [OctoNode() for _ in range(num_nodes)]
+            for node, value, is_leaf in zip(nodes, log_odds.tolist(), leaf.tolist()):
+                node._log_odds = value
+                node._is_leaf = is_leaf
+            for rank, slot in enumerate(inner.tolist()):
+                nodes[slot]._children = tuple(nodes[1 + 8 * rank:9 + 8 * rank])
+            self._root = nodes[0]
+
+        self._statistics.recount(depth, leaf, log_odds, num_inner)
+        self._dirty_keys = set()
+        self._prune_all = False
+        self._saturation_version += 1
+
+    def _summarize_codes(self, codes: np.ndarray, inner: np.ndarray, depth: np.ndarray):
+        """
+        Logodds of nodes saved without logodds: the clamped values for the leafs, bottom-up summaries for inner nodes.
+        """
+        log_odds = np.full(len(codes), DEFAULT_LOGODDS, dtype=float)
+        log_odds[codes == CODE_FREE] = FREE_LOGODDS
+        log_odds[codes == CODE_OCCUPIED] = OCCUPANCY_LOGODDS
+        known = codes != CODE_UNKNOWN
+        blocks = 1 + 8 * np.arange(len(inner))[:, np.newaxis] + np.arange(8)
+        inner_depth = depth[inner]
+        for level in range(self._max_depth - 1, -1, -1):
+            selected = inner_depth == level
+            children = blocks[selected]
+            child_known = known[children]
+            if self._inner_occupancy == 'max':
+                summary = np.where(child_known, log_odds[children], -np.inf).max(axis=1)
+            else:
+                summary = (log_odds[children] * child_known).sum(axis=1) / np.maximum(child_known.sum(axis=1), 1)
+            log_odds[inner[selected]] = np.where(child_known.any(axis=1), summary, DEFAULT_LOGODDS)
+        return log_odds
+
+    def get_statistics(self):
+        """
+        Return node statistics of this tree, they are maintained incrementally and cost no traversal.
+
+        Returns:
+            node counts per depth, leaf and inner counts, split and prune counters,
+            clamped occupied/free leaf counts, ray cache hits/misses and the estimated memory in bytes --- dict
+        """
+        statistics: dict = self._statistics.as_dict()
+        statistics['ray_cache_hits'] = self._ray_cache_hits
+        statistics['ray_cache_misses'] = self._ray_cache_misses
+        if self._pool is not None:
+            statistics['estimated_bytes'] = self._pool.nbytes
+        else:
+            statistics['estimated_bytes'] = OctoNode.estimate_bytes(statistics['num_nodes'], statistics['num_inner'])
+        return statistics
+
+    def sample_statistics(self):
+        """
+        Append the current statistics with a timestamp to the time series of this tree.
+
+        Returns:
+            the sampled statistics --- dict
+        """
+        return self._statistics.sample(self.get_statistics())
+
+    def get_statistics_history(self):
+        """
+        Returns:
+            all statistics taken by sample_statistics, oldest first --- list of dict
+        """
+        return self._statistics.get_history()
 
-        return leaf_nodes
-    
     def get_center(self):
         return self._center
     
@@ -163,3 +1404,15 @@ class OctoTree:
     
     def get_root(self):
         return self._root
+
+    def get_backend(self):
+        return self._backend
+
+    def get_log_odds_storage(self):
+        return self._log_odds_storage
+
+    def get_prune_policy(self):
+        return self._prune_policy
+
+    def get_inner_occupancy(self):
+        return self._inner_occupancy
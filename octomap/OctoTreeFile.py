@@ -0,0 +1,148 @@
+import mmap
+import struct
+from contextlib import contextmanager
+
+import numpy as np
+
+from Config import INNER_OCCUPANCY_MODES
+
+"""
+Binary file format of an OctoTree, in the spirit of OctoMap's .bt/.ot files.
+
+header: magic, version, flags, code of the root, inner occupancy mode, center, resolution, max_depth,
+        number of inner nodes (nodes with children)
+masks:  one little-endian uint16 per inner node in breadth-first order, 2 bits per child:
+        CODE_UNKNOWN, CODE_FREE, CODE_OCCUPIED (a leaf) or CODE_INNER (the child has children)
+values: optional float64 logodds of every node (root, then the 8 children of each inner node) in the same order
+
+The nodes are stored in breadth-first (not depth-first) order, so the children of the i-th inner node
+are always the nodes 1 + 8i ... 8 + 8i and the tree is decoded with array operations only.
+"""
+MAGIC = b'OCTB'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBB3ddI4xQ')
+FLAG_LOG_ODDS = 1
+
+CODE_UNKNOWN = 0
+CODE_FREE = 1
+CODE_OCCUPIED = 2
+CODE_INNER = 3
+
+CHILD_SHIFTS = np.arange(0, 16, 2, dtype=np.uint16)
+
+def _padding(size: int):
+    return -size % 8
+
+def write_tree_file(path: str, center: tuple, resolution: float, max_depth: int, inner_occupancy: str,
+                    codes: np.ndarray, log_odds: np.ndarray = None):
+    """
+    Write the nodes of a tree in breadth-first order, see pack_tree.
+
+    Args:
+        path: file to write --- str
+    """
+    with open(path, 'wb') as file:
+        file.write(pack_tree(center, resolution, max_depth, inner_occupancy, codes, log_odds))
+
+def pack_tree(center: tuple, resolution: float, max_depth: int, inner_occupancy: str,
+              codes: np.ndarray, log_odds: np.ndarray = None):
+    """
+    Serialize the nodes of a tree in breadth-first order.
+
+    Args:
+        center: the coordinate of the center --- (x,y,z): tuple
+        resolution: maximal resolution --- float
+        max_depth: maximun depth --- int
+        inner_occupancy: logodds summary kept by inner nodes --- str
+        codes: code of each node, the root first --- ndarray of uint8
+        log_odds: logodds of each node, not saved if None --- ndarray of float
+    Returns:
+        the content of a tree file --- bytes
+    """
+    num_inner = (len(codes) - 1) // 8
+    child_codes = np.asarray(codes[1:], dtype=np.uint16).reshape(num_inner, 8)
+    masks = (child_codes << CHILD_SHIFTS).sum(axis=1, dtype=np.uint16).astype('<u2')
+    flags = FLAG_LOG_ODDS if log_odds is not None else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, int(codes[0]), INNER_OCCUPANCY_MODES.index(inner_occupancy),
+                         *center, resolution, max_depth, num_inner)
+
+    parts = [header, masks.tobytes(), b'\0' * _padding(masks.nbytes)]
+    if log_odds is not None:
+        parts.append(np.asarray(log_odds, dtype='<f8').tobytes())
+    return b''.join(parts)
+
+@contextmanager
+def read_tree_file(path: str, use_mmap: bool = True):
+    """
+    Read a file written by write_tree_file, to be used in a with statement.
+    With use_mmap the file is memory-mapped instead of read into memory at once and the logodds are a read-only view
+    of the mapping: the nodes are built from the pages of the file, but both backends copy the values into their
+    own storage, so the load is not zero-copy. The mapping is closed at the end of the with statement,
+    no view of it may be kept beyond.
+
+    Args:
+        path: file to read --- str
+        use_mmap: map the file instead of reading it --- bool
+    Returns:
+        center, resolution, max_depth, inner_occupancy, codes of all nodes and their logodds (None if not saved) --- dict
+    """
+    with open(path, 'rb') as file:
+        if not use_mmap:
+            yield unpack_tree(file.read(), path)
+            return
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    tree_file = None
+    try:
+        tree_file = unpack_tree(buffer, path)
+        yield tree_file
+    finally:
+        # the views of the mapping must be released before it can be closed
+        if tree_file is not None:
+            tree_file.clear()
+        tree_file = None
+        buffer.close()
+
+def unpack_tree(buffer, path: str = '<buffer>'):
+    """
+    Parse the content of a tree file, the logodds are a read-only view of the buffer.
+
+    Args:
+        buffer: the content of a tree file --- bytes, mmap
+        path: name of the content in error messages --- str
+    Returns:
+        see read_tree_file --- dict
+    """
+    if len(buffer) < HEADER.size:
+        raise ValueError("'{}' is not an OctoTree file, it is too short".format(path))
+    magic, version, flags, root_code, inner_occupancy, cx, cy, cz, resolution, max_depth, num_inner = \
+        HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("'{}' is not an OctoTree file".format(path))
+    if version != VERSION:
+        raise ValueError("Unsupported OctoTree file version {} in '{}'".format(version, path))
+
+    num_nodes = 1 + 8 * num_inner
+    offset = HEADER.size
+    masks_size = 2 * num_inner
+    values_offset = offset + masks_size + _padding(masks_size)
+    expected_size = values_offset + (8 * num_nodes if flags & FLAG_LOG_ODDS else 0)
+    if len(buffer) != expected_size:
+        raise ValueError("'{}' has {} bytes, expected {}".format(path, len(buffer), expected_size))
+
+    masks = np.frombuffer(buffer, dtype='<u2', count=num_inner, offset=offset)
+    codes = np.empty(num_nodes, dtype=np.uint8)
+    codes[0] = root_code
+    codes[1:] = ((masks[:, np.newaxis] >> CHILD_SHIFTS) & 3).ravel()
+
+    log_odds = None
+    if flags & FLAG_LOG_ODDS:
+        log_odds = np.frombuffer(buffer, dtype='<f8', count=num_nodes, offset=values_offset)
+
+    return {
+        'center': (cx, cy, cz),
+        'resolution': resolution,
+        'max_depth': max_depth,
+        'inner_occupancy': INNER_OCCUPANCY_MODES[inner_occupancy],
+        'codes': codes,
+        'log_odds': log_odds,
+    }
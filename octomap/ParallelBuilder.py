@@ -0,0 +1,231 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Config import LOGGER, TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH, TREE_BACKEND, PRUNE_POLICY, INNER_OCCUPANCY
+from Config import LOG_ODDS_STORAGE, BUILD_WORKERS, PARTITION_DEPTH
+from OctoTreeFile import CODE_INNER
+from OctoTree import OctoTree
+from MapUtil import cast_rays, import_flying_data, get_scan_list
+
+"""
+Parallel construction of an OctoTree from a recorded flight.
+
+The rays of all scans are traversed once in the main process and every scan is reduced to its voxel updates
+(the occupied end points win over free space, like in OctoTree.insert_scan). A voxel only depends on its own
+sequence of updates, so the updates are split by the node at PARTITION_DEPTH containing them and each worker
+process replays the updates of its partitions scan by scan into its own tree.
+The trees of the workers cover disjoint subtrees, they are merged in breadth-first order and only the few
+inner nodes above the partitions are summarized again. The result is the tree of the serial build.
+"""
+
+def get_num_workers(num_workers: int = BUILD_WORKERS):
+    """
+    Returns:
+        the number of worker processes, all cores if 'num_workers' is 0 --- int
+    """
+    return num_workers if num_workers > 0 else os.cpu_count() or 1
+
+def get_scan_updates(scan_list: list, origin: tuple, resolution: float, key_range: int, max_range: float = -1):
+    """
+    Reduce every scan to the voxels it updates, see OctoTree.insert_scan.
+
+    Args:
+        scan_list: (origin, end points[, is_hit]) for each scan, see OctoTree.insert_scan_list --- list of (tuple, list[, list])
+        origin: the coordinate of the key (0, 0, 0) --- (x,y,z): tuple
+        resolution: maximal resolution --- float
+        key_range: number of keys along each axis, keys outside of the tree are dropped --- int
+        max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+    Returns:
+        scan index, key and whether the voxel is occupied of each update, sorted by scan --- ndarray, Nx3: ndarray, ndarray
+    """
+    start_points = []
+    end_points = []
+    scan_index = []
+    is_hit = []
+    for index, scan in enumerate(scan_list):
+        scan_origin, scan_end_points = scan[0], scan[1]
+        start_points.extend([scan_origin] * len(scan_end_points))
+        end_points.extend(scan_end_points)
+        scan_index.extend([index] * len(scan_end_points))
+        is_hit.extend(scan[2] if len(scan) > 2 else [True] * len(scan_end_points))
+    scan_index = np.array(scan_index, dtype=np.int64)
+    ray_keys, offsets, end_keys, is_hit = cast_rays(np.asarray(start_points, dtype=float).reshape(-1, 3),
+                                                    np.asarray(end_points, dtype=float).reshape(-1, 3),
+                                                    origin, resolution, max_range, np.array(is_hit, dtype=bool))
+    scans = np.concatenate([np.repeat(scan_index, np.diff(offsets)), scan_index[is_hit]])
+    keys = np.concatenate([ray_keys, end_keys[is_hit]]).astype(np.int64)
+    occupied = np.concatenate([np.zeros(len(ray_keys), dtype=bool), np.ones(np.count_nonzero(is_hit), dtype=bool)])
+    valid = np.all((keys >= 0) & (keys < key_range), axis=1)
+    scans, keys, occupied = scans[valid], keys[valid], occupied[valid]
+
+    # sorted by scan and key, an occupied update comes first and wins over the free updates of the same voxel
+    order = np.lexsort((~occupied, keys[:, 2], keys[:, 1], keys[:, 0], scans))
+    scans, keys, occupied = scans[order], keys[order], occupied[order]
+    first = np.ones(len(scans), dtype=bool)
+    first[1:] = (scans[1:] != scans[:-1]) | np.any(keys[1:] != keys[:-1], axis=1)
+    return scans[first], keys[first], occupied[first]
+
+def _partition_updates(keys: np.ndarray, max_depth: int, partition_depth: int):
+    """
+    Returns:
+        the index of the node at partition_depth containing each key --- ndarray
+    """
+    shift = max_depth - partition_depth
+    cells = keys >> shift
+    return (cells[:, 0] << (2 * partition_depth)) | (cells[:, 1] << partition_depth) | cells[:, 2]
+
+def _assign_partitions(partitions: np.ndarray, num_workers: int):
+    """
+    Distribute the partitions over the workers, the largest partition goes to the least loaded worker.
+
+    Returns:
+        the worker of each update --- ndarray
+    """
+    indices, counts = np.unique(partitions, return_counts=True)
+    loads = [0] * num_workers
+    worker_of = {}
+    for index in np.argsort(-counts, kind='stable').tolist():
+        worker = loads.index(min(loads))
+        worker_of[int(indices[index])] = worker
+        loads[worker] += int(counts[index])
+    return np.array([worker_of[partition] for partition in partitions.tolist()], dtype=np.int64)
+
+def _build_partition(arguments: tuple, options: dict, scans: np.ndarray, keys: np.ndarray, occupied: np.ndarray):
+    """
+    Replay the updates of some partitions scan by scan, runs in a worker process.
+
+    Returns:
+        the tree file of the built tree, see OctoTree.to_bytes, and the cpu seconds of the replay --- bytes, float
+    """
+    start_time = time.process_time()
+    octotree = OctoTree(*arguments, **options)
+    bounds = np.flatnonzero(np.diff(scans)) + 1
+    for scan_keys, scan_occupied in zip(np.split(keys, bounds), np.split(occupied, bounds)):
+        octotree._apply_update(map(tuple, scan_keys[~scan_occupied].tolist()),
+                               map(tuple, scan_keys[scan_occupied].tolist()))
+        octotree._count_scan()
+    return octotree.to_bytes(log_odds=True), time.process_time() - start_time
+
+def merge_partitions(octotree: OctoTree, trees: list, partition_depth: int):
+    """
+    Replace the nodes of 'octotree' by the union of trees which only know disjoint nodes at partition_depth.
+    Every node is taken from the tree which knows it, the inner nodes above partition_depth are summarized again.
+
+    Args:
+        octotree: the tree receiving the nodes --- OctoTree
+        trees: trees with the same center, resolution and depth as 'octotree' --- list of OctoTree
+        partition_depth: depth of the disjoint nodes --- int
+    """
+    codes, values = [], []
+    queue = deque([[tree.get_root() for tree in trees]])
+    while queue:
+        nodes = queue.popleft()
+        known = [node for node in nodes if node.is_leaf() or node.has_children()]
+        if len(known) > 1:
+            # an inner node above the partitions, its logodds are summarized after the merge
+            codes.append(CODE_INNER)
+            values.append(0.0)
+            queue.extend(map(list, zip(*(node.get_children() for node in known))))
+        elif OctoTree._append_level_order(known[0] if known else nodes[0], codes, values):
+            queue.extend([child] for child in known[0].get_children())
+    octotree._load_nodes(np.array(codes, dtype=np.uint8), np.array(values, dtype=float))
+    octotree._summarize_levels(partition_depth)
+
+def build_octotree(scan_list: list, num_workers: int = BUILD_WORKERS, partition_depth: int = PARTITION_DEPTH,
+                   max_range: float = -1, center: tuple = TREE_CENTER, resolution: int = TREE_RESOLUTION,
+                   max_depth: int = TREE_MAX_DEPTH, backend: str = TREE_BACKEND, prune_policy: str = PRUNE_POLICY,
+                   inner_occupancy: str = INNER_OCCUPANCY, log_odds_storage: str = LOG_ODDS_STORAGE,
+                   timings: dict = None):
+    """
+    Build a tree from a sequence of scans with a pool of worker processes, see the module description.
+    The tree is the same as after OctoTree.insert_scan_list, a deferred tree is pruned like before save.
+
+    Args:
+        scan_list: (origin, end points[, is_hit]) for each scan, see OctoTree.insert_scan_list --- list of (tuple, list[, list])
+        num_workers: number of worker processes, all cores if 0, 1 builds in this process --- int
+        partition_depth: the updates are split by the node at this depth containing them --- int
+        max_range: rays longer than this are truncated and only mark free space, no limit if negative --- float
+        timings: filled with the seconds of the ray casting, the cpu seconds of each worker and the seconds
+                 of the merge if given --- dict
+    Returns:
+        the built tree --- OctoTree
+    """
+    if not 0 <= partition_depth <= max_depth:
+        raise ValueError("The partition depth {} is not in [0, {}]".format(partition_depth, max_depth))
+    num_workers = get_num_workers(num_workers)
+    timings = timings if timings is not None else {}
+    arguments = (center, resolution, max_depth)
+    options = {'backend': backend, 'prune_policy': prune_policy, 'inner_occupancy': inner_occupancy,
+               'log_odds_storage': log_odds_storage, 'ray_cache_size': 0}
+    octotree = OctoTree(*arguments, **options)
+
+    start_time = time.perf_counter()
+    scans, keys, occupied = get_scan_updates(scan_list, octotree.origin, resolution, 1 << max_depth, max_range)
+    workers = _assign_partitions(_partition_updates(keys, max_depth, partition_depth), num_workers)
+    tasks = [np.flatnonzero(workers == worker) for worker in range(num_workers)]
+    tasks = [(arguments, options, scans[task], keys[task], occupied[task]) for task in tasks if len(task)]
+    timings['cast'] = time.perf_counter() - start_time
+
+    if not tasks:
+        return octotree
+    if num_workers == 1:
+        results = [_build_partition(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+            results = list(executor.map(_build_partition, *zip(*tasks)))
+    timings['workers'] = [seconds for _, seconds in results]
+    timings['build'] = time.perf_counter() - start_time - timings['cast']
+
+    start_time = time.perf_counter()
+    trees = [OctoTree.from_bytes(buffer, backend=backend, prune_policy=prune_policy, log_odds_storage=log_odds_storage)
+             for buffer, _ in results]
+    merge_partitions(octotree, trees, partition_depth)
+    timings['merge'] = time.perf_counter() - start_time
+    return octotree
+
+def measure_scaling(scan_list: list, worker_counts: tuple = (1, 2, 4, 8), partition_depth: int = PARTITION_DEPTH):
+    """
+    Build the same tree serially and with each number of workers.
+    The critical path is the ray casting, the cpu time of the slowest worker and the merge:
+    the wall time on enough idle cores, also when the workers share fewer cores during the measurement.
+
+    Returns:
+        the serial build and a row for each number of workers --- list of dict
+    """
+    start_time = time.perf_counter()
+    serial = OctoTree(TREE_CENTER, TREE_RESOLUTION, TREE_MAX_DEPTH)
+    serial.insert_scan_list(scan_list)
+    if serial.get_prune_policy() == 'deferred':
+        serial.prune()
+    rows = [{'workers': 0, 'seconds': time.perf_counter() - start_time}]
+    rows[0]['critical_path'] = rows[0]['seconds']
+    LOGGER.info("serial build: {seconds:.2f}s".format(**rows[0]))
+    expected = serial.to_bytes(log_odds=True)
+    for num_workers in worker_counts:
+        timings = {}
+        start_time = time.perf_counter()
+        octotree = build_octotree(scan_list, num_workers, partition_depth, timings=timings)
+        row = {
+            'workers': num_workers,
+            'seconds': time.perf_counter() - start_time,
+            'cast': timings['cast'],
+            'slowest_worker': max(timings['workers']),
+            'merge': timings['merge'],
+            'identical': octotree.to_bytes(log_odds=True) == expected,
+        }
+        row['critical_path'] = row['cast'] + row['slowest_worker'] + row['merge']
+        rows.append(row)
+        LOGGER.info("{workers} workers: {seconds:.2f}s, cast {cast:.2f}s, slowest worker {slowest_worker:.2f}s, "
+                    "merge {merge:.2f}s, critical path {critical_path:.2f}s, identical: {identical}".format(**row))
+    return rows
+
+def main():
+    start_points, end_points = import_flying_data()
+    measure_scaling(get_scan_list(start_points, end_points))
+
+if __name__ == "__main__":
+    main()
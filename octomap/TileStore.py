@@ -0,0 +1,109 @@
+import os
+import re
+import zlib
+
+from Config import TILE_COMPRESSION_LEVEL
+
+"""
+Tiles of a chunked map on disk, see ChunkedOctoTree.
+Every chunk is one file holding its tree file (OctoTree.to_bytes) compressed with zlib,
+the chunk coordinates are part of the file name.
+"""
+TILE_NAME = 'tile_{}_{}_{}.bt.z'
+TILE_PATTERN = re.compile(r'^tile_(-?\d+)_(-?\d+)_(-?\d+)\.bt\.z$')
+
+class TileStore:
+    """
+    Directory of compressed tiles keyed by chunk coordinates.
+    The directory is created if needed, tiles already in it are part of the store.
+    """
+
+    def __init__(self, directory: str, compression_level: int = TILE_COMPRESSION_LEVEL):
+        """
+        Args:
+            directory: directory of the tiles --- str
+            compression_level: zlib level of the tiles written by this store --- int
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._compression_level = compression_level
+        self._keys = set()
+        for name in os.listdir(directory):
+            match = TILE_PATTERN.match(name)
+            if match:
+                self._keys.add(tuple(int(value) for value in match.groups()))
+        self._num_reads = 0
+        self._num_writes = 0
+        self._bytes_read = 0
+        self._bytes_written = 0
+
+    def __contains__(self, chunk_key: tuple):
+        return chunk_key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        """
+        Returns:
+            chunk coordinates of all stored tiles --- list of (cx,cy,cz)
+        """
+        return list(self._keys)
+
+    def get_path(self, chunk_key: tuple):
+        """
+        Returns:
+            the file of a tile --- str
+        """
+        return os.path.join(self._directory, TILE_NAME.format(*chunk_key))
+
+    def read(self, chunk_key: tuple):
+        """
+        Returns:
+            the tree file of a chunk, None if it has no tile --- bytes
+        """
+        if chunk_key not in self._keys:
+            return None
+        with open(self.get_path(chunk_key), 'rb') as file:
+            data = file.read()
+        self._num_reads += 1
+        self._bytes_read += len(data)
+        return zlib.decompress(data)
+
+    def write(self, chunk_key: tuple, content: bytes):
+        """
+        Replace the tile of a chunk, the file is replaced atomically so a crash keeps the previous tile.
+
+        Args:
+            chunk_key: chunk coordinates --- (cx,cy,cz): tuple
+            content: the tree file of the chunk --- bytes
+        """
+        data = zlib.compress(content, self._compression_level)
+        path = self.get_path(chunk_key)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+        self._keys.add(chunk_key)
+        self._num_writes += 1
+        self._bytes_written += len(data)
+
+    def delete(self, chunk_key: tuple):
+        """
+        Remove the tile of a chunk if there is one.
+        """
+        if chunk_key in self._keys:
+            os.remove(self.get_path(chunk_key))
+            self._keys.discard(chunk_key)
+
+    def get_statistics(self):
+        """
+        Returns:
+            number of tiles, tile reads and writes and the compressed bytes read and written --- dict
+        """
+        return {
+            'num_tiles': len(self._keys),
+            'tile_reads': self._num_reads,
+            'tile_writes': self._num_writes,
+            'tile_bytes_read': self._bytes_read,
+            'tile_bytes_written': self._bytes_written,
+        }
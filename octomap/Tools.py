@@ -1,7 +1,10 @@
+import os
+
 import numpy as np
 import matplotlib.pyplot as plt
-from Config import INDICE_LENGTH, OFFSETX, OFFSETY, OFFSETZ
-from MapUtil import read_flying_data
+from Config import INDICE_LENGTH, OFFSETX, OFFSETY, OFFSETZ, FILE_OCTOTREE, FILE_FLIGHT_LOG
+from MapUtil import read_flying_data, get_classified_node_coor_list
+from OctoTree import OctoTree
 
 
 class Tools:
@@ -12,8 +15,16 @@ class Tools:
     def build_octomap_from_file(self):
         """
         Build an octomap from a file.
+        The tree saved by the last build is loaded, the recorded rays are only replayed if there is none
+        or a newer flight has been recorded since.
         """
-        self.occu_node_coor_list, self.free_node_coor_list = read_flying_data()
+        if os.path.exists(FILE_OCTOTREE) and not (os.path.exists(FILE_FLIGHT_LOG) and
+                                                  os.path.getmtime(FILE_FLIGHT_LOG) > os.path.getmtime(FILE_OCTOTREE)):
+            self.octotree = OctoTree.load(FILE_OCTOTREE)
+            occu_node_coor_list, free_node_coor_list = get_classified_node_coor_list(self.octotree.to_arrays())
+            self.occu_node_coor_list, self.free_node_coor_list = occu_node_coor_list.tolist(), free_node_coor_list.tolist()
+        else:
+            self.occu_node_coor_list, self.free_node_coor_list = read_flying_data()
         print("The number of occupied nodes: ", len(self.occu_node_coor_list))
         print("The number of free nodes: ", len(self.free_node_coor_list))
 
@@ -0,0 +1,127 @@
+import time
+
+import numpy as np
+
+from Config import FREE_LOGODDS, OCCUPANCY_LOGODDS
+
+class TreeStatistics:
+    """
+    Node statistics of one OctoTree.
+    The counters are maintained incrementally by the tree whenever it splits, prunes or updates a node,
+    so reading them never traverses the tree.
+    """
+
+    def __init__(self, max_depth: int):
+        """
+        Args:
+            max_depth: maximum depth of the tree --- int
+        """
+        self.nodes_per_depth = [0] * (max_depth + 1)
+        self.nodes_per_depth[0] = 1
+        self.num_leafs = 0
+        self.num_inner = 0
+        self.num_splits = 0
+        self.num_prunes = 0
+        self.num_occupied = 0
+        self.num_free = 0
+        self._history = []
+
+    @property
+    def num_nodes(self):
+        """
+        Returns:
+            number of nodes in the tree, including unknown children --- int
+        """
+        return sum(self.nodes_per_depth)
+
+    def _count_clamped(self, log_odds: float, count: int):
+        if log_odds == OCCUPANCY_LOGODDS:
+            self.num_occupied += count
+        elif log_odds == FREE_LOGODDS:
+            self.num_free += count
+
+    def on_split(self, depth: int, was_leaf: bool, log_odds: float):
+        """
+        A node at 'depth' got 8 children, a leaf hands its value down to all of them.
+        """
+        self.num_splits += 1
+        self.nodes_per_depth[depth + 1] += 8
+        self.num_inner += 1
+        if was_leaf:
+            self.num_leafs += 7
+            self._count_clamped(log_odds, 7)
+
+    def on_prune(self, depth: int, log_odds: float):
+        """
+        The 8 leaf children of a node at 'depth' with the same value were removed, the node became a leaf.
+        """
+        self.num_prunes += 1
+        self.nodes_per_depth[depth + 1] -= 8
+        self.num_inner -= 1
+        self.num_leafs -= 7
+        self._count_clamped(log_odds, -7)
+
+    def on_update(self, was_leaf: bool, old_log_odds: float, new_log_odds: float):
+        """
+        A leaf (or a so far unknown node) got a new value.
+        """
+        if was_leaf:
+            self._count_clamped(old_log_odds, -1)
+        else:
+            self.num_leafs += 1
+        self._count_clamped(new_log_odds, 1)
+
+    def recount(self, depth: np.ndarray, leaf: np.ndarray, log_odds: np.ndarray, num_inner: int):
+        """
+        Reset the node counters to those of a tree given as flat node arrays, e.g. a tree loaded from a file.
+        The split and prune counters start from 0 again.
+
+        Args:
+            depth: depth of each node --- ndarray of int
+            leaf: whether each node is a leaf --- ndarray of bool
+            log_odds: logodds of each node --- ndarray of float
+            num_inner: number of nodes with children --- int
+        """
+        counts = np.bincount(depth, minlength=len(self.nodes_per_depth))
+        self.nodes_per_depth = [int(count) for count in counts]
+        self.num_leafs = int(np.count_nonzero(leaf))
+        self.num_inner = num_inner
+        self.num_splits = 0
+        self.num_prunes = 0
+        self.num_occupied = int(np.count_nonzero(leaf & (log_odds == OCCUPANCY_LOGODDS)))
+        self.num_free = int(np.count_nonzero(leaf & (log_odds == FREE_LOGODDS)))
+
+    def as_dict(self):
+        """
+        Returns:
+            snapshot of all counters --- dict
+        """
+        return {
+            'num_nodes': self.num_nodes,
+            'nodes_per_depth': list(self.nodes_per_depth),
+            'num_leafs': self.num_leafs,
+            'num_inner': self.num_inner,
+            'num_splits': self.num_splits,
+            'num_prunes': self.num_prunes,
+            'num_occupied': self.num_occupied,
+            'num_free': self.num_free,
+        }
+
+    def sample(self, snapshot: dict):
+        """
+        Append a snapshot to the time series.
+
+        Args:
+            snapshot: statistics of the tree, see as_dict --- dict
+        """
+        snapshot = dict(snapshot)
+        snapshot['time'] = time.time()
+        self._history.append(snapshot)
+        return snapshot
+
+    def get_history(self):
+        """
+        Returns:
+            all snapshots taken by sample, oldest first --- list of dict
+        """
+        return self._history